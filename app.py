@@ -15,358 +15,155 @@
 # responses based on user input.
 # """
 
-import base64
+import hashlib
 import io
-import json
 import re
 import random
-from typing import Any, Dict, List, Optional
+import secrets
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional
 
 import streamlit as st
-from PIL import Image
 import os
-import requests
 from streamlit.errors import StreamlitSecretNotFoundError
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+# Backends, prompt building and the chat store live in the Streamlit-free code_gen_ai
+# package; this file is the UI on top of it. Heavy optional dependencies (numpy, PIL,
+# requests, speech_recognition, openai) are imported where they are used, so a cold
+# start only pays for Streamlit; `python bench/importtime.py` profiles the import
+from code_gen_ai.api import send_to_backend
+from code_gen_ai.backend import (
+    get_backend_health,
+    get_backend_schedulers,
+    get_model_residency,
+    get_ollama_transport_stats,
+    mark_model_used,
+    request_model_preload,
+    start_model_keeper,
+)
+from code_gen_ai.cache import get_coalescing_stats, get_response_cache_stats, get_semantic_cache_stats
+from code_gen_ai.config import (
+    AUTO_MODEL,
+    CHAT_MODES,
+    DEFAULT_MODEL,
+    DEFAULT_SYSTEM_PROMPT,
+    MODEL_OPTIONS,
+    PREWARM_IN_BACKGROUND,
+    SEMANTIC_CACHE_EMBED_MODEL,
+    SEMANTIC_CACHE_ENABLED,
+    SEMANTIC_CACHE_THRESHOLD,
+    SPEECH_RECOGNITION_AVAILABLE,
+    STREAM_HEARTBEAT_INTERVAL,
+    register_secret_source,
+)
+from code_gen_ai.generation import GenerationScope, stream_in_background
+from code_gen_ai.metrics import format_turn_timings, record_turn_metrics, start_metrics_server, turn_timings
+from code_gen_ai.prewarm import run_prewarm_cli, start_background_prewarm
+from code_gen_ai.prompts import (
+    generate_bug_prompt,
+    generate_concept_prompt,
+    generate_writing_prompt,
+    load_catalogue,
+    summarize_title,
+)
+from code_gen_ai.store import (
+    clear_chat_messages,
+    content_digest,
+    create_persistent_chat,
+    delete_message,
+    delete_persistent_chat,
+    get_chat_meta,
+    list_chats,
+    load_chat_messages,
+    make_message,
+    save_message,
+    search_chats,
+    set_chat_title,
+)
+from code_gen_ai.utils import load_image, store_image_blob
 
-# If you prefer to hardcode an API key directly in this file (not recommended for production),
-# put it here as a string. Leave empty to use environment or Streamlit secrets.
-#"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" = ""
-GROQ_BASE_URL_DIRECT = ""
-GEMINI_API_KEY_DIRECT = ""
-OLLAMA_API_URL = "http://localhost:11434/api/generate"
-
-# Audio processing imports
-try:
-    import speech_recognition as sr
-    SPEECH_RECOGNITION_AVAILABLE = True
-except ImportError:
-    SPEECH_RECOGNITION_AVAILABLE = False
-
-
-CHAT_MODES = ["Chat", "Generate Code", "Explain Code"]
-MODEL_OPTIONS = ["gpt-oss-120b", "llama3", "deepseek-r1", "deepseek-ocr:3b"]
-DEFAULT_SYSTEM_PROMPT = "You are ChatGPT, a large language model trained by OpenAI. You are helpful, creative, clever, and very friendly."
 CODE_BLOCK_PATTERN = re.compile(r"```(?P<lang>[\w+\-]*)\n(?P<code>.*?)```", re.DOTALL)
-OLLAMA_CHAT_URL = "http://localhost:11434/api/chat"
-
-# Random Concept Explainer Data
-CONCEPTS_BY_DIFFICULTY = {
-    "Beginner": [
-        {"category": "Data Structures", "topic": "Arrays vs Linked Lists"},
-        {"category": "Algorithms", "topic": "Linear Search"},
-        {"category": "Web Dev", "topic": "What is HTTP?"},
-        {"category": "CS Basics", "topic": "What is a Variable?"},
-        {"category": "AI", "topic": "What is Machine Learning?"},
-        {"category": "Data Structures", "topic": "Stack and Queue basics"},
-        {"category": "Algorithms", "topic": "Bubble Sort"},
-        {"category": "Web Dev", "topic": "HTML vs CSS vs JavaScript"},
-        {"category": "CS Basics", "topic": "What is an Operating System?"},
-        {"category": "AI", "topic": "Supervised vs Unsupervised Learning"},
-    ],
-    "Intermediate": [
-        {"category": "Data Structures", "topic": "Hashmap collision resolution"},
-        {"category": "Algorithms", "topic": "Two Pointers technique"},
-        {"category": "Web Dev", "topic": "REST vs GraphQL"},
-        {"category": "CS Basics", "topic": "Process vs Thread"},
-        {"category": "AI", "topic": "Gradient Descent optimization"},
-        {"category": "Data Structures", "topic": "Binary Search Trees"},
-        {"category": "Algorithms", "topic": "Merge Sort vs Quick Sort"},
-        {"category": "Web Dev", "topic": "CORS and how it works"},
-        {"category": "CS Basics", "topic": "Virtual Memory"},
-        {"category": "AI", "topic": "Overfitting and Regularization"},
-    ],
-    "Advanced": [
-        {"category": "Data Structures", "topic": "Red-Black Trees balancing"},
-        {"category": "Algorithms", "topic": "Dynamic Programming - State compression"},
-        {"category": "Web Dev", "topic": "Microservices architecture patterns"},
-        {"category": "CS Basics", "topic": "Deadlock prevention algorithms"},
-        {"category": "AI", "topic": "Self-attention in Transformers"},
-        {"category": "Data Structures", "topic": "B+ Trees for databases"},
-        {"category": "Algorithms", "topic": "A* pathfinding algorithm"},
-        {"category": "Web Dev", "topic": "Event-driven architecture"},
-        {"category": "CS Basics", "topic": "Memory management and Garbage Collection"},
-        {"category": "AI", "topic": "Reinforcement Learning - Q-Learning"},
-    ]
-}
-
-# Random Writing Tasks Data
-WRITING_TASKS_BY_TONE = {
-    "Formal": [
-        {"type": "Email", "prompt": "Write a professional apology email for missing a meeting"},
-        {"type": "Email", "prompt": "Write a formal request for a deadline extension"},
-        {"type": "Documentation", "prompt": "Write API documentation for a user authentication endpoint"},
-        {"type": "Resume", "prompt": "Write a resume bullet point for leading a software migration project"},
-        {"type": "Email", "prompt": "Write a professional introduction email to a new client"},
-        {"type": "Report", "prompt": "Write an executive summary for a quarterly performance report"},
-        {"type": "Proposal", "prompt": "Write a project proposal introduction for a new mobile app"},
-    ],
-    "Friendly": [
-        {"type": "Email", "prompt": "Write a friendly follow-up email after a job interview"},
-        {"type": "Social Media", "prompt": "Write an engaging LinkedIn post about starting a new job"},
-        {"type": "Message", "prompt": "Write a warm welcome message for new team members"},
-        {"type": "Blog", "prompt": "Write a casual blog intro about learning to code"},
-        {"type": "Social Media", "prompt": "Write an Instagram caption for a team building event"},
-        {"type": "Email", "prompt": "Write a friendly reminder email for an upcoming team lunch"},
-        {"type": "Newsletter", "prompt": "Write a friendly company newsletter opening paragraph"},
-    ],
-    "Humorous": [
-        {"type": "Social Media", "prompt": "Write a funny tweet about debugging code at 3 AM"},
-        {"type": "Product", "prompt": "Write a humorous product description for a rubber duck debugger"},
-        {"type": "Email", "prompt": "Write a playfully sarcastic out-of-office auto-reply"},
-        {"type": "Story", "prompt": "Write a short funny story about a programmer's first day at work"},
-        {"type": "Social Media", "prompt": "Write a witty LinkedIn post about surviving Monday meetings"},
-        {"type": "Caption", "prompt": "Write a humorous error message for a 404 page"},
-        {"type": "Bio", "prompt": "Write a funny developer bio for a GitHub profile"},
-    ]
-}
-
-# Random Bug Generator Data
-BUGGY_CODE_SNIPPETS = [
-    {
-        "language": "python",
-        "title": "Off-by-one error in loop",
-        "buggy_code": '''def sum_first_n(arr, n):
-    """Sum the first n elements of arr"""
-    total = 0
-    for i in range(1, n + 1):  
-        total += arr[i]
-    return total
-
-''',
-        "fixed_code": '''def sum_first_n(arr, n):
-    """Sum the first n elements of arr"""
-    total = 0
-    for i in range(n):  # Fixed: start from 0
-        total += arr[i]
-    return total''',
-        "explanation": "The loop started at index 1 instead of 0, causing it to skip the first element and potentially access an out-of-bounds index.",
-        "prevention": "Always remember Python uses 0-based indexing. Use range(n) for first n elements."
-    },
-    {
-        "language": "python",
-        "title": "Mutable default argument",
-        "buggy_code": '''def add_item(item, items=[]):  
-    items.append(item)
-    return items
-
-# Try calling:
-# print(add_item("a"))  # ['a']
-# print(add_item("b"))  # Expect ['b'], but get ['a', 'b']!''',
-        "fixed_code": '''def add_item(item, items=None):
-    if items is None:
-        items = []
-    items.append(item)
-    return items''',
-        "explanation": "Mutable default arguments (like lists) are created once at function definition, not each call. All calls share the same list!",
-        "prevention": "Never use mutable objects (lists, dicts) as default arguments. Use None and create inside the function."
-    },
-    {
-        "language": "javascript",
-        "title": "Async/Await missing",
-        "buggy_code": '''async function fetchUserData(userId) {
-    const response = fetch(`/api/users/${userId}`);  
-    const data = response.json();
-    return data;
-}
-
-''',
-        "fixed_code": '''async function fetchUserData(userId) {
-    const response = await fetch(`/api/users/${userId}`);
-    const data = await response.json();
-    return data;
-}''',
-        "explanation": "Missing 'await' keywords cause the function to return Promises instead of waiting for the actual values.",
-        "prevention": "Always use 'await' when calling async functions or Promise-returning methods like fetch()."
-    },
-    {
-        "language": "javascript",
-        "title": "Variable hoisting issue",
-        "buggy_code": '''function printNumbers() {
-    for (var i = 0; i < 3; i++) {
-        setTimeout(function() {
-            console.log(i);  
-        }, 100);
-    }
-}
-''',
-        "fixed_code": '''function printNumbers() {
-    for (let i = 0; i < 3; i++) {
-        setTimeout(function() {
-            console.log(i);  // Fixed: prints 0, 1, 2
-        }, 100);
-    }
-}''',
-        "explanation": "'var' is function-scoped, so all callbacks share the same 'i'. By the time they run, the loop has finished and i=3.",
-        "prevention": "Use 'let' instead of 'var' for block-scoped variables, especially in loops with closures."
-    },
-    {
-        "language": "python",
-        "title": "Infinite loop",
-        "buggy_code": '''def find_target(arr, target):
-    left, right = 0, len(arr) - 1
-    while left <= right:
-        mid = (left + right) // 2
-        if arr[mid] == target:
-            return mid
-        elif arr[mid] < target:
-            left = mid  
-        else:
-            right = mid  
-    return -1''',
-        "fixed_code": '''def find_target(arr, target):
-    left, right = 0, len(arr) - 1
-    while left <= right:
-        mid = (left + right) // 2
-        if arr[mid] == target:
-            return mid
-        elif arr[mid] < target:
-            left = mid + 1  # Fixed
-        else:
-            right = mid - 1  # Fixed
-    return -1''',
-        "explanation": "Without +1/-1, the search space never shrinks when mid equals left or right, causing an infinite loop.",
-        "prevention": "In binary search, always shrink the search space by excluding mid: left = mid + 1 or right = mid - 1."
-    },
-    {
-        "language": "java",
-        "title": "Null pointer exception",
-        "buggy_code": '''public String getUserName(User user) {
-    return user.getName().toUpperCase();  
-}
-
-''',
-        "fixed_code": '''public String getUserName(User user) {
-    if (user == null || user.getName() == null) {
-        return "Unknown";
-    }
-    return user.getName().toUpperCase();
-}''',
-        "explanation": "Calling methods on null references throws NullPointerException. Both the user object and getName() result could be null.",
-        "prevention": "Always validate inputs and check for null before calling methods. Consider using Optional in Java 8+."
-    },
-    {
-        "language": "python",
-        "title": "String comparison bug",
-        "buggy_code": '''def check_password(input_pwd, stored_pwd):
-    if input_pwd is stored_pwd:  
-        return True
-    return False
-
-''',
-        "fixed_code": '''def check_password(input_pwd, stored_pwd):
-    if input_pwd == stored_pwd:  # Fixed: use == for value comparison
-        return True
-    return False''',
-        "explanation": "'is' checks object identity (same memory location), '==' checks value equality. Different string objects with same content fail 'is' check.",
-        "prevention": "Use '==' for comparing values, 'is' only for None checks or intentional identity comparison."
-    },
-    {
-        "language": "javascript",
-        "title": "Type coercion bug",
-        "buggy_code": '''function isAdult(age) {
-    if (age == "18") {  
-        return true;
-    }
-    return age > 18;
-}
-
-''',
-        "fixed_code": '''function isAdult(age) {
-    const numAge = Number(age);
-    if (numAge >= 18) {
-        return true;
-    }
-    return false;
-}''',
-        "explanation": "Using == allows type coercion which can cause unexpected behavior. String/number comparisons with > are unpredictable.",
-        "prevention": "Always use === for comparisons and explicitly convert types. Consider TypeScript for type safety."
-    },
-    {
-        "language": "python",
-        "title": "Wrong variable scope",
-        "buggy_code": '''total = 0
-
-def add_to_total(value):
-    total = total + value  
-    return total
-
-add_to_total(5)''',
-        "fixed_code": '''total = 0
-
-def add_to_total(value):
-    global total  # Fixed: declare global
-    total = total + value
-    return total
-
-# Or better - avoid global state:
-def add_to_total(current_total, value):
-    return current_total + value''',
-        "explanation": "Assignment inside a function creates a local variable. Python sees 'total = ...' and treats 'total' as local, but it's read before assignment.",
-        "prevention": "Avoid modifying global variables. Pass values as parameters and return results. Use 'global' keyword only when necessary."
-    },
-    {
-        "language": "java",
-        "title": "Array index out of bounds",
-        "buggy_code": '''public int getLastElement(int[] arr) {
-    return arr[arr.length];  
-}
-
-''',
-        "fixed_code": '''public int getLastElement(int[] arr) {
-    if (arr == null || arr.length == 0) {
-        throw new IllegalArgumentException("Array is empty");
-    }
-    return arr[arr.length - 1];  // Fixed: length - 1
-}''',
-        "explanation": "Array indices go from 0 to length-1. Accessing arr[length] is always out of bounds.",
-        "prevention": "Remember: last valid index = length - 1. Add bounds checking and handle empty arrays."
-    }
-]
-
-
-def get_secret_or_env(key: str) -> Optional[str]:
-    """Fetch a secret from environment first, then Streamlit secrets (safely)."""
-    env_val = os.environ.get(key)
-    if env_val:
-        return env_val
+# Streaming render budget: flush at most every interval unless this many bytes are pending
+STREAM_FLUSH_INTERVAL = 0.05
+STREAM_FLUSH_BYTES = 2048
+# Prose-only tails longer than this are frozen at their last paragraph break
+STREAM_TAIL_FREEZE_CHARS = 4000
+# Chat history is rendered in pages of this many messages, newest first
+HISTORY_PAGE_SIZE = 30
+# Parsed Markdown/code segments are kept for this many distinct messages process-wide
+SEGMENT_CACHE_SIZE = 2048
+
+# Theme stylesheet; Streamlit serves static/ next to the app at app/static/ when
+# server.enableStaticServing is on
+THEME_CSS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "theme.css")
+THEME_CSS_URL = "app/static/theme.css"
+# Older releases serve app/static/*.css as text/plain with nosniff, which browsers
+# refuse as a stylesheet; 1.56 is the first to send text/css
+STATIC_CSS_MIN_STREAMLIT = (1, 56)
+
+
+def _streamlit_secret(key: str) -> Optional[str]:
+    """Look `key` up in Streamlit secrets (None when there is no secrets.toml)."""
     try:
-        if hasattr(st, "secrets"):
-            return st.secrets.get(key)
+        return st.secrets.get(key)
     except StreamlitSecretNotFoundError:
         return None
-    except Exception:
-        return None
-    return None
 
 
-def create_persistent_chat(title: Optional[str] = None) -> str:
-    """Create a saved conversation and return its identifier."""
-    chat_id = str(st.session_state.chat_counter)
-    st.session_state.chat_counter += 1
-    default_title = title or f"New chat {chat_id}"
-    st.session_state.chats[chat_id] = {"title": default_title, "messages": []}
-    return chat_id
+# Backends read credentials from the environment first, then from Streamlit secrets
+register_secret_source("streamlit", _streamlit_secret)
+
+
+def current_streamlit_session() -> Optional[str]:
+    """The Streamlit session running this script, or None outside a script run."""
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_id if ctx is not None else None
+
+
+def browser_chat_owner() -> str:
+    """This browser's owner key for saved chats.
+
+    Kept in the page URL (`?owner=...`), so reloading or bookmarking the page reopens the
+    same chats; a new key is issued when it is missing or malformed.
+    """
+    owner = st.query_params.get("owner", "")
+    if not re.fullmatch(r"[A-Za-z0-9_-]{16,64}", owner):
+        owner = secrets.token_urlsafe(16)
+        st.query_params["owner"] = owner
+    return owner
 
 
 def ensure_current_chat() -> None:
     """Make sure we have at least one persistent chat selected."""
-    if not st.session_state.chats:
-        chat_id = create_persistent_chat()
+    chats = list_chats(owner=st.session_state.chat_owner)
+    if not chats:
+        chat_id = create_persistent_chat(owner=st.session_state.chat_owner)
         st.session_state.current_chat_id = chat_id
-    elif st.session_state.current_chat_id not in st.session_state.chats:
-        st.session_state.current_chat_id = next(iter(st.session_state.chats.keys()))
+    elif st.session_state.current_chat_id not in chats:
+        st.session_state.current_chat_id = next(iter(chats.keys()))
 
 
 def init_session_state() -> None:
     """Bootstrap all keys required by the UI."""
-    st.session_state.setdefault("chat_counter", 1)
-    st.session_state.setdefault("chats", {})
     st.session_state.setdefault("current_chat_id", "")
+    # Saved chats are only visible to the browser that created them
+    st.session_state.chat_owner = browser_chat_owner()
+    # Only the active chat's messages are cached in the session
+    st.session_state.setdefault("active_messages", [])
+    st.session_state.setdefault("active_chat_id", None)
+    st.session_state.setdefault("active_chat_version", None)
     st.session_state.setdefault("is_temp_chat", False)
+    st.session_state.setdefault("semantic_cache_enabled", SEMANTIC_CACHE_ENABLED)
+    st.session_state.setdefault("semantic_cache_threshold", SEMANTIC_CACHE_THRESHOLD)
+    st.session_state.setdefault("show_turn_timings", False)
     st.session_state.setdefault("temp_messages", [])
     st.session_state.setdefault("display_name", "User")
     st.session_state.setdefault("mode_select", CHAT_MODES[0])
-    st.session_state.setdefault("model_select", MODEL_OPTIONS[0])
+    st.session_state.setdefault("model_select", DEFAULT_MODEL)
     st.session_state.setdefault("system_prompt_area", DEFAULT_SYSTEM_PROMPT)
     st.session_state.setdefault("show_search_box", False)
     st.session_state.setdefault("chat_search", "")
@@ -392,354 +189,45 @@ def init_session_state() -> None:
     st.session_state.setdefault("pending_prompt", "")
     st.session_state.setdefault("regenerate_index", None)
     st.session_state.setdefault("tts_playing", False)
-    st.session_state.setdefault("tts_message_index", None)
+    st.session_state.setdefault("tts_message_id", None)
 
     ensure_current_chat()
 
 
+@st.cache_resource(show_spinner=False)
+def _theme_stylesheet() -> Dict[str, str]:
+    """The theme CSS, plus a short digest that versions its URL so browsers refetch on change."""
+    with open(THEME_CSS_PATH, encoding="utf-8") as handle:
+        css = handle.read()
+    return {"css": css, "version": hashlib.sha256(css.encode("utf-8")).hexdigest()[:12]}
+
+
+def _streamlit_serves_css() -> bool:
+    """Whether this Streamlit serves static .css files as text/css."""
+    try:
+        version = tuple(int(part) for part in st.__version__.split(".")[:2])
+    except ValueError:
+        return False
+    return version >= STATIC_CSS_MIN_STREAMLIT
+
+
 def inject_custom_css() -> None:
-    """Inject Code Gen AI-inspired dark theme styling."""
-    st.markdown(
-        """
-        <style>
-        :root { color-scheme: dark; }
-        body, .stApp, .block-container {
-            background-color: #212121;
-            color: #ececec;
-        }
-        .block-container {
-            padding-top: 2rem;
-            padding-bottom: 6rem;
-            max-width: 800px;
-        }
-        div[data-testid="stSidebar"] {
-            background-color: #171717;
-            border-right: 1px solid #2f2f2f;
-        }
-        div[data-testid="stSidebar"] * {
-            color: #ececec !important;
-        }
-        .sidebar-logo {
-            font-size: 1.1rem;
-            font-weight: 600;
-            display: flex;
-            align-items: center;
-            gap: 0.5rem;
-            margin-bottom: 1.5rem;
-            padding: 0.5rem;
-        }
-        .sidebar-section-title {
-            text-transform: uppercase;
-            font-size: 0.7rem;
-            letter-spacing: 0.12em;
-            color: #8e8e8e;
-            margin: 1.5rem 0 0.5rem 0;
-            font-weight: 500;
-        }
-        div[data-testid="stChatMessage"] {
-            margin-bottom: 0;
-            padding: 1.5rem 0;
-        }
-        .chat-bubble {
-            width: 100%;
-            line-height: 1.6;
-        }
-        .assistant-bubble { 
-            background: transparent;
-        }
-        .user-bubble { 
-            background: transparent;
-        }
-        .hero-card {
-            text-align: center;
-            margin: 4rem auto 2rem auto;
-            padding: 2.5rem;
-            max-width: 700px;
-            position: relative;
-        }
-        .hero-glow {
-            position: absolute;
-            top: 50%;
-            left: 50%;
-            transform: translate(-50%, -50%);
-            width: 300px;
-            height: 300px;
-            background: radial-gradient(circle, rgba(16, 163, 127, 0.15) 0%, transparent 70%);
-            border-radius: 50%;
-            pointer-events: none;
-            animation: glow-pulse 4s ease-in-out infinite;
-        }
-        @keyframes glow-pulse {
-            0%, 100% { opacity: 0.5; transform: translate(-50%, -50%) scale(1); }
-            50% { opacity: 1; transform: translate(-50%, -50%) scale(1.1); }
-        }
-        .hero-logo {
-            width: 80px;
-            height: 80px;
-            border-radius: 24px;
-            background: linear-gradient(135deg, #10a37f 0%, #0d8c6d 50%, #076d54 100%);
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            margin: 0 auto 1.5rem auto;
-            font-size: 2.2rem;
-            box-shadow: 0 20px 40px rgba(16, 163, 127, 0.3), 0 0 60px rgba(16, 163, 127, 0.1);
-            animation: float 3s ease-in-out infinite;
-            position: relative;
-            z-index: 1;
-        }
-        @keyframes float {
-            0%, 100% { transform: translateY(0px); }
-            50% { transform: translateY(-8px); }
-        }
-        .hero-title {
-            font-size: 2.2rem;
-            font-weight: 700;
-            background: linear-gradient(135deg, #ffffff 0%, #a0a0a0 100%);
-            -webkit-background-clip: text;
-            -webkit-text-fill-color: transparent;
-            background-clip: text;
-            margin-bottom: 0.75rem;
-            letter-spacing: -0.02em;
-        }
-        .hero-subtitle { 
-            color: #8e8e8e; 
-            font-size: 1.1rem;
-            margin-bottom: 2.5rem;
-            line-height: 1.6;
-        }
-        .hero-badges {
-            display: flex;
-            justify-content: center;
-            gap: 0.75rem;
-            margin-bottom: 2rem;
-            flex-wrap: wrap;
-        }
-        .hero-badge {
-            background: rgba(16, 163, 127, 0.1);
-            border: 1px solid rgba(16, 163, 127, 0.3);
-            border-radius: 20px;
-            padding: 0.4rem 0.9rem;
-            font-size: 0.75rem;
-            color: #10a37f;
-            display: flex;
-            align-items: center;
-            gap: 0.4rem;
-        }
-        .suggestion-grid {
-            display: grid;
-            grid-template-columns: repeat(2, 1fr);
-            gap: 1rem;
-            max-width: 600px;
-            margin: 0 auto;
-        }
-        .suggestion-card {
-            background: linear-gradient(145deg, #2a2a2a 0%, #1f1f1f 100%);
-            border: 1px solid #3a3a3a;
-            border-radius: 16px;
-            padding: 1.25rem;
-            text-align: left;
-            font-size: 0.9rem;
-            color: #ececec;
-            cursor: pointer;
-            transition: all 0.3s cubic-bezier(0.4, 0, 0.2, 1);
-            position: relative;
-            overflow: hidden;
-        }
-        .suggestion-card::before {
-            content: '';
-            position: absolute;
-            top: 0;
-            left: 0;
-            right: 0;
-            bottom: 0;
-            background: linear-gradient(135deg, rgba(16, 163, 127, 0.1) 0%, transparent 100%);
-            opacity: 0;
-            transition: opacity 0.3s ease;
-        }
-        .suggestion-card:hover {
-            border-color: #10a37f;
-            transform: translateY(-4px);
-            box-shadow: 0 12px 24px rgba(0, 0, 0, 0.3), 0 0 0 1px rgba(16, 163, 127, 0.2);
-        }
-        .suggestion-card:hover::before {
-            opacity: 1;
-        }
-        .suggestion-icon {
-            font-size: 1.5rem;
-            margin-bottom: 0.75rem;
-            display: block;
-        }
-        .suggestion-title {
-            font-weight: 600;
-            margin-bottom: 0.3rem;
-            color: #fff;
-        }
-        .suggestion-desc {
-            font-size: 0.8rem;
-            color: #8e8e8e;
-            line-height: 1.4;
-        }
-        div[data-testid="stChatInput"] > div {
-            border: 1px solid #424242;
-            border-radius: 24px;
-            background: #2f2f2f;
-            padding: 0.25rem 0.5rem;
-        }
-        div[data-testid="stChatInput"] textarea {
-            background: transparent !important;
-            color: #ececec !important;
-        }
-        div[data-testid="stSidebar"] button {
-            border-radius: 8px;
-            border: 1px solid #424242;
-            background: #2f2f2f;
-            transition: all 0.2s;
-        }
-        div[data-testid="stSidebar"] button:hover {
-            background: #424242;
-        }
-        .input-toolbar {
-            display: flex;
-            gap: 0.5rem;
-            margin-bottom: 0.5rem;
-            padding: 0 0.5rem;
-        }
-        .toolbar-btn {
-            background: #2f2f2f;
-            border: 1px solid #424242;
-            border-radius: 8px;
-            padding: 0.5rem 1rem;
-            color: #ececec;
-            cursor: pointer;
-            font-size: 0.85rem;
-            display: flex;
-            align-items: center;
-            gap: 0.4rem;
-        }
-        .toolbar-btn:hover {
-            background: #424242;
-        }
-        .toolbar-btn.active {
-            background: #10a37f;
-            border-color: #10a37f;
-        }
-        .image-preview {
-            max-width: 300px;
-            border-radius: 12px;
-            margin: 0.5rem 0;
-            border: 1px solid #424242;
-        }
-        .voice-status {
-            background: #2f2f2f;
-            border: 1px solid #424242;
-            border-radius: 12px;
-            padding: 1rem;
-            margin: 0.5rem 0;
-            display: flex;
-            align-items: center;
-            gap: 0.75rem;
-        }
-        .voice-indicator {
-            width: 12px;
-            height: 12px;
-            border-radius: 50%;
-            background: #10a37f;
-            animation: pulse 1.5s infinite;
-        }
-        @keyframes pulse {
-            0%, 100% { opacity: 1; transform: scale(1); }
-            50% { opacity: 0.5; transform: scale(1.1); }
-        }
-        .model-badge {
-            display: inline-flex;
-            align-items: center;
-            gap: 0.3rem;
-            background: #2f2f2f;
-            border: 1px solid #424242;
-            border-radius: 6px;
-            padding: 0.25rem 0.6rem;
-            font-size: 0.75rem;
-            color: #8e8e8e;
-        }
-        .attachment-preview {
-            background: #2f2f2f;
-            border: 1px solid #424242;
-            border-radius: 12px;
-            padding: 0.75rem;
-            margin-bottom: 0.75rem;
-            display: flex;
-            align-items: center;
-            gap: 0.75rem;
-        }
-        .attachment-preview img {
-            width: 60px;
-            height: 60px;
-            object-fit: cover;
-            border-radius: 8px;
-        }
-        .attachment-info {
-            flex: 1;
-        }
-        .attachment-name {
-            font-size: 0.85rem;
-            color: #ececec;
-        }
-        .attachment-size {
-            font-size: 0.75rem;
-            color: #8e8e8e;
-        }
-        .remove-attachment {
-            color: #8e8e8e;
-            cursor: pointer;
-            font-size: 1.2rem;
-        }
-        .message-actions {
-            display: flex;
-            gap: 0.5rem;
-            margin-top: 0.75rem;
-            opacity: 0.7;
-            transition: opacity 0.2s ease;
-        }
-        .message-actions:hover {
-            opacity: 1;
-        }
-        .action-btn {
-            background: linear-gradient(145deg, #2a2a2a 0%, #1f1f1f 100%);
-            border: 1px solid #3a3a3a;
-            border-radius: 20px;
-            padding: 0.35rem 0.75rem;
-            color: #a0a0a0;
-            font-size: 0.75rem;
-            cursor: pointer;
-            display: inline-flex;
-            align-items: center;
-            gap: 0.35rem;
-            transition: all 0.2s ease;
-        }
-        .action-btn:hover {
-            background: linear-gradient(145deg, #3a3a3a 0%, #2f2f2f 100%);
-            border-color: #10a37f;
-            color: #10a37f;
-            transform: translateY(-1px);
-        }
-        .action-btn.playing {
-            background: linear-gradient(145deg, #10a37f 0%, #0d8c6d 100%);
-            border-color: #10a37f;
-            color: #fff;
-            animation: pulse-glow 1.5s infinite;
-        }
-        @keyframes pulse-glow {
-            0%, 100% { box-shadow: 0 0 5px rgba(16, 163, 127, 0.3); }
-            50% { box-shadow: 0 0 15px rgba(16, 163, 127, 0.6); }
-        }
-        .action-btn .icon {
-            font-size: 0.85rem;
-        }
-        </style>
-        """,
-        unsafe_allow_html=True,
-    )
+    """Apply the Code Gen AI-inspired dark theme from static/theme.css.
+
+    Streamlit redraws every element on each rerun, so the stylesheet is linked rather
+    than inlined: with static serving on (.streamlit/config.toml) a rerun ships only a
+    <link> tag, and the browser fetches and caches the file once. Without static serving
+    (e.g. run from another directory), or on a Streamlit release that serves .css with
+    the wrong type, the CSS is inlined as a fallback.
+    """
+    stylesheet = _theme_stylesheet()
+    if st.get_option("server.enableStaticServing") and _streamlit_serves_css():
+        st.markdown(
+            f'<link rel="stylesheet" href="{THEME_CSS_URL}?v={stylesheet["version"]}">',
+            unsafe_allow_html=True,
+        )
+    else:
+        st.markdown(f"<style>\n{stylesheet['css']}</style>", unsafe_allow_html=True)
 
 
 def set_sidebar_notice(message: str) -> None:
@@ -748,13 +236,57 @@ def set_sidebar_notice(message: str) -> None:
 
 
 def get_active_messages() -> List[Dict[str, Any]]:
-    """Return the list that represents the active conversation."""
+    """Return the list that represents the active conversation.
+
+    Saved chats are loaded from disk on first access and reloaded only when the chat
+    changes or another session wrote to it.
+    """
     if st.session_state.is_temp_chat:
         return st.session_state.temp_messages
-    return st.session_state.chats[st.session_state.current_chat_id]["messages"]
+
+    chat_id = st.session_state.current_chat_id
+    meta = get_chat_meta(chat_id, owner=st.session_state.chat_owner)
+    version = meta["updated_at"] if meta else None
+    if st.session_state.active_chat_id != chat_id or st.session_state.active_chat_version != version:
+        st.session_state.active_messages = load_chat_messages(chat_id) if meta else []
+        st.session_state.active_chat_id = chat_id
+        st.session_state.active_chat_version = version
+    return st.session_state.active_messages
+
+
+def _sync_active_chat_version() -> None:
+    """Record our own write so the session cache is not reloaded needlessly."""
+    meta = get_chat_meta(st.session_state.current_chat_id, owner=st.session_state.chat_owner)
+    st.session_state.active_chat_version = meta["updated_at"] if meta else None
+
+
+def append_message(message: Dict[str, Any]) -> None:
+    """Add a message to the active conversation, persisting it unless the chat is temporary.
+
+    The content digest is stored with the message and its segments are parsed now,
+    so later reruns only walk the cached structure.
+    """
+    messages = get_active_messages()
+    if "id" not in message:
+        message = {**make_message(message.get("role", "assistant"), message.get("content", "")), **message}
+    get_segments(message["content"], message["digest"])
+    if not st.session_state.is_temp_chat:
+        save_message(st.session_state.current_chat_id, message)
+        _sync_active_chat_version()
+    messages.append(message)
+
+
+def remove_message(index: int) -> Dict[str, Any]:
+    """Remove and return the message at `index` of the active conversation."""
+    messages = get_active_messages()
+    message = messages.pop(index)
+    if not st.session_state.is_temp_chat and message.get("id") is not None:
+        delete_message(st.session_state.current_chat_id, message["id"])
+        _sync_active_chat_version()
+    return message
 
 
-def start_tts(text: str, message_index: int) -> None:
+def start_tts(text: str, message_id: int) -> None:
     """Start text-to-speech for the given text using browser's Web Speech API."""
     # Clean the text for TTS (remove markdown, code blocks, etc.)
     clean_text = re.sub(r'```[\s\S]*?```', 'code block omitted', text)
@@ -766,7 +298,7 @@ def start_tts(text: str, message_index: int) -> None:
     clean_text = clean_text.strip()
     
     st.session_state.tts_playing = True
-    st.session_state.tts_message_index = message_index
+    st.session_state.tts_message_id = message_id
     st.session_state.tts_text = clean_text
     
     # Use JavaScript Web Speech API for TTS
@@ -791,7 +323,7 @@ def start_tts(text: str, message_index: int) -> None:
 def stop_tts() -> None:
     """Stop text-to-speech playback."""
     st.session_state.tts_playing = False
-    st.session_state.tts_message_index = None
+    st.session_state.tts_message_id = None
     
     # Use JavaScript to stop speech
     js_code = '''
@@ -813,188 +345,240 @@ def regenerate_response(messages: List[Dict[str, Any]], index: int, mode: str, s
         return
     
     user_prompt = messages[user_msg_index].get("content", "")
-    user_image = messages[user_msg_index].get("image")
+    user_image = messages[user_msg_index].get("image_ref")
     
     # Remove the old assistant message
-    messages.pop(index)
+    remove_message(index)
     
     # Generate new response (this will be handled in main loop)
     st.session_state.regenerate_prompt = user_prompt
     st.session_state.regenerate_image = user_image
 
 
-def image_to_base64(image: Image.Image) -> str:
-    """Convert PIL Image to base64 string."""
+@st.cache_data(max_entries=256, show_spinner=False)
+def image_thumbnail(image_ref: str, width: int) -> bytes:
+    """Return an encoded thumbnail for displaying a stored image at `width` pixels.
+
+    Rendered at twice the display width so it stays sharp on high-DPI screens.
+    """
+    image = load_image(image_ref)
+    image.thumbnail((width * 2, width * 2))
     buffered = io.BytesIO()
-    image.save(buffered, format="PNG")
-    return base64.b64encode(buffered.getvalue()).decode()
+    if image.mode in ("RGBA", "LA", "P"):
+        image.save(buffered, format="PNG", optimize=True)
+    else:
+        image.convert("RGB").save(buffered, format="JPEG", quality=85)
+    return buffered.getvalue()
 
 
-def transcribe_audio(audio_bytes: bytes) -> str:
-    """Transcribe audio to text using speech recognition."""
-    if not SPEECH_RECOGNITION_AVAILABLE:
-        return "[Speech recognition not available. Install: pip install SpeechRecognition]"
-    
-    recognizer = sr.Recognizer()
-    
-    try:
-        # Convert audio bytes to AudioFile
-        audio_file = io.BytesIO(audio_bytes)
-        with sr.AudioFile(audio_file) as source:
-            audio_data = recognizer.record(source)
-        
-        # Use Google's free speech recognition
-        text = recognizer.recognize_google(audio_data)
-        return text
-    except sr.UnknownValueError:
-        return "[Could not understand audio]"
-    except sr.RequestError as e:
-        return f"[Speech recognition error: {e}]"
-    except Exception as e:
-        return f"[Audio processing error: {e}]"
-
-
-def stream_generate(model: str, prompt: str, image: Optional[Image.Image] = None):
-    """Stream generate response from Ollama API as a generator."""
-    headers = {"Content-Type": "application/json"}
-    
-    # Use chat API for models like deepseek-ocr:3b
-    if model in ["deepseek-ocr:3b"]:
-        # Build message with images if provided
-        message = {
-            "role": "user",
-            "content": prompt
-        }
-        
-        if image is not None:
-            encoded_image = image_to_base64(image)
-            message["images"] = [encoded_image]
-        
-        payload = {
-            "model": model,
-            "messages": [message],
-            "stream": True
-        }
-        
-        try:
-            response = requests.post(
-                OLLAMA_CHAT_URL,
-                headers=headers,
-                json=payload,
-                stream=True,
-                timeout=120
-            )
-            response.raise_for_status()
-            
-            # Stream and yield only the assistant content
-            for line in response.iter_lines():
-                if not line:
-                    continue
-                
-                try:
-                    data = json.loads(line.decode("utf-8"))
-                except json.JSONDecodeError:
-                    continue
-                
-                # Extract content from message
-                if "message" in data and "content" in data["message"]:
-                    content = data["message"]["content"]
-                    if content:
-                        yield content
-                
-                # Stop when done
-                if data.get("done"):
-                    break
-                
-        except requests.exceptions.RequestException as e:
-            yield f"[Error connecting to Ollama: {e}. Make sure Ollama is running locally.]"
-        except Exception as e:
-            yield f"[Ollama API error: {e}]"
-    else:
-        # Use /api/generate for other models (llama3, deepseek-r1)
-        payload = {
-            "model": model,
-            "prompt": prompt,
-            "stream": True
-        }
-
-        if image is not None:
-            encoded_image = image_to_base64(image)
-            payload["images"] = [encoded_image]
-
-        try:
-            with requests.post(OLLAMA_API_URL, headers=headers, json=payload, stream=True, timeout=60) as resp:
-                resp.raise_for_status()
-                
-                for raw_line in resp.iter_lines(decode_unicode=True):
-                    if not raw_line:
-                        continue
-                    
-                    line = raw_line.strip()
-                    try:
-                        obj = json.loads(line)
-                    except json.JSONDecodeError:
-                        continue
-                    
-                    chunk_text = None
-                    if "message" in obj and isinstance(obj["message"], dict):
-                        chunk_text = obj["message"].get("content")
-                    elif "response" in obj:
-                        chunk_text = obj.get("response")
-                    
-                    if chunk_text:
-                        yield chunk_text
-                    
-                    if obj.get("done") is True:
-                        break
-        except requests.exceptions.RequestException as e:
-            yield f"[Error connecting to Ollama: {e}. Make sure Ollama is running locally.]"
-        except Exception as e:
-            yield f"[Ollama API error: {e}]"
+@st.cache_resource(show_spinner=False)
+def _segment_cache() -> Dict[str, Any]:
+    """Process-wide LRU of parsed segments keyed by content digest."""
+    return {"lock": threading.Lock(), "entries": OrderedDict()}
 
 
-def parse_and_render_segments(content: str) -> None:
-    """Render Markdown text mixed with fenced code blocks."""
+def get_segments(content: str, digest: Optional[str] = None) -> tuple:
+    """Return the parsed segments of `content`, parsing each distinct content only once.
+
+    Results are shared across sessions through a bounded LRU (SEGMENT_CACHE_SIZE);
+    pass the message's stored `digest` to skip re-hashing long responses.
+    """
+    digest = digest or content_digest(content)
+    cache = _segment_cache()
+    with cache["lock"]:
+        segments = cache["entries"].get(digest)
+        if segments is not None:
+            cache["entries"].move_to_end(digest)
+            return segments
+
+    segments = tuple(split_segments(content))
+    with cache["lock"]:
+        cache["entries"][digest] = segments
+        while len(cache["entries"]) > SEGMENT_CACHE_SIZE:
+            cache["entries"].popitem(last=False)
+    return segments
+
+
+def split_segments(content: str) -> List[tuple]:
+    """Split Markdown into ("markdown", text, "") and ("code", code, language) segments."""
+    segments = []
     start = 0
     for match in CODE_BLOCK_PATTERN.finditer(content):
         text_chunk = content[start : match.start()].strip()
         if text_chunk:
-            st.markdown(text_chunk)
+            segments.append(("markdown", text_chunk, ""))
 
         language = match.group("lang") or "text"
-        st.code(match.group("code"), language=language.strip())
+        segments.append(("code", match.group("code"), language.strip()))
         start = match.end()
 
     tail = content[start:].strip()
     if tail:
-        st.markdown(tail)
+        segments.append(("markdown", tail, ""))
+    return segments
+
+
+def render_segments(segments: Iterable[tuple]) -> None:
+    """Render segments produced by `split_segments`."""
+    for kind, text, language in segments:
+        if kind == "code":
+            st.code(text, language=language)
+        else:
+            st.markdown(text)
+
+
+def parse_and_render_segments(content: str) -> None:
+    """Render Markdown text mixed with fenced code blocks."""
+    render_segments(split_segments(content))
+
+
+def _frozen_prefix_length(tail: str) -> int:
+    """Return how much of a streaming tail is final and can be frozen.
+
+    Everything up to the last closed code fence is final. Without an open fence, a long
+    tail is also cut at its last blank line so prose-only answers stay cheap to redraw.
+    """
+    cut = 0
+    for match in CODE_BLOCK_PATTERN.finditer(tail):
+        cut = match.end()
+    rest = tail[cut:]
+    if "```" not in rest and len(rest) > STREAM_TAIL_FREEZE_CHARS:
+        paragraph_end = rest.rfind("\n\n")
+        if paragraph_end > 0:
+            cut += paragraph_end + 2
+    return cut
+
+
+def render_streaming_response(
+    chunks: Iterable[str],
+    status: Optional[Callable[[], Optional[str]]] = None,
+    stats: Optional[Dict[str, float]] = None,
+) -> str:
+    """Stream text chunks into the current container and return the full response.
+
+    Chunks are buffered and flushed every STREAM_FLUSH_INTERVAL seconds (or once
+    STREAM_FLUSH_BYTES are pending). Only the open tail is re-rendered: closed code
+    fences and finished paragraphs are frozen into their own elements, so the cost
+    stays linear in the response length instead of re-sending the whole answer per token.
+    Until the first text arrives, `status()` (e.g. a queue position) is shown instead.
+    `stats`, when given, receives the seconds until the first text ("ttft"), the number
+    of text chunks ("chunks") and the seconds spent drawing ("render").
+    """
+    started = time.monotonic()
+    render_seconds = 0.0
+    root = st.container()
+    tail_placeholder = root.empty()
+    parts: List[str] = []
+    pending: List[str] = []
+    pending_bytes = 0
+    tail = ""
+    last_flush = 0.0
+
+    def flush(final: bool = False) -> None:
+        nonlocal tail, tail_placeholder, pending_bytes, last_flush, render_seconds
+        flush_started = time.monotonic()
+        tail += "".join(pending)
+        pending.clear()
+        pending_bytes = 0
+
+        cut = _frozen_prefix_length(tail)
+        if cut:
+            with tail_placeholder.container():
+                parse_and_render_segments(tail[:cut])
+            tail = tail[cut:]
+            tail_placeholder = root.empty()
+
+        waiting_on = status() if status is not None and not parts else None
+        if not final and waiting_on:
+            tail_placeholder.caption(f"⏳ {waiting_on}")
+        elif not final:
+            tail_placeholder.markdown(tail + "▌")
+        elif tail.strip():
+            with tail_placeholder.container():
+                parse_and_render_segments(tail)
+        else:
+            tail_placeholder.empty()
+        last_flush = time.monotonic()
+        render_seconds += last_flush - flush_started
+
+    for chunk in chunks:
+        if not chunk:
+            # Heartbeat while the backend is silent: redraw the cursor so a pending
+            # Stop/rerun interrupts the script now rather than at the next token
+            if time.monotonic() - last_flush >= STREAM_HEARTBEAT_INTERVAL:
+                flush()
+            continue
+        if not parts and stats is not None:
+            stats["ttft"] = time.monotonic() - started
+        parts.append(chunk)
+        pending.append(chunk)
+        pending_bytes += len(chunk)
+        if pending_bytes >= STREAM_FLUSH_BYTES or time.monotonic() - last_flush >= STREAM_FLUSH_INTERVAL:
+            flush()
+
+    flush(final=True)
+    if stats is not None:
+        stats.update(chunks=len(parts), render=render_seconds)
+    return "".join(parts)
 
 
 def render_chat_history(messages: List[Dict[str, Any]]) -> None:
-    """Loop through session messages and display them with avatars and bubbles."""
-    for idx, message in enumerate(messages):
+    """Display the newest page of messages with avatars and bubbles.
+
+    Only the last `history_window` messages are drawn; a "Load earlier" button widens the
+    window by HISTORY_PAGE_SIZE. Parsed segments come from the shared digest-keyed cache.
+    """
+    window_owner = "temp" if st.session_state.is_temp_chat else st.session_state.current_chat_id
+    if st.session_state.get("history_window_owner") != window_owner:
+        st.session_state.history_window_owner = window_owner
+        st.session_state.history_window = HISTORY_PAGE_SIZE
+
+    first_visible = max(len(messages) - st.session_state.history_window, 0)
+    if first_visible:
+        if st.button(
+            f"⬆️ Load earlier messages ({first_visible} hidden)",
+            key="load_earlier_messages",
+            use_container_width=True,
+        ):
+            st.session_state.history_window += HISTORY_PAGE_SIZE
+            st.rerun()
+
+    for idx in range(first_visible, len(messages)):
+        message = messages[idx]
         role = message.get("role", "assistant")
         avatar = "👤" if role == "user" else "✨"
         
-        # Create unique key suffix using index and content hash
-        content_hash = hash(message.get("content", ""))
-        unique_key = f"{idx}_{content_hash}_{role}"
+        # Widget keys use the stable message id, so they survive edits and regeneration
+        message_id = message.get("id", f"idx{idx}")
+        unique_key = f"{message_id}_{role}"
         
         with st.chat_message(role, avatar=avatar):
             # Show image if present in message
-            if "image" in message and message["image"]:
-                st.image(message["image"], width=300)
+            if message.get("image_ref"):
+                st.image(image_thumbnail(message["image_ref"], 300), width=300)
             
+            content = message.get("content", "")
+            if "digest" not in message:
+                message["digest"] = content_digest(content)
+            segments = get_segments(content, message["digest"])
             st.markdown(f"<div class='chat-bubble'>", unsafe_allow_html=True)
-            parse_and_render_segments(message.get("content", ""))
+            render_segments(segments)
             st.markdown("</div>", unsafe_allow_html=True)
+            if message.get("stopped"):
+                st.caption("⏹ Generation stopped")
+            if message.get("requested_model") == AUTO_MODEL:
+                st.caption(f"🧭 Routed to {message['model']}")
+            elif message.get("requested_model"):
+                st.caption(f"↪ Answered by {message['model']} ({message['requested_model']} unavailable)")
+            if st.session_state.show_turn_timings and message.get("timings"):
+                st.caption(format_turn_timings(message["timings"]))
             
             # Add action buttons for assistant messages
             if role == "assistant" and message.get("content"):
                 btn_col1, btn_col2, btn_col3, _ = st.columns([1, 1, 1, 5])
                 
                 with btn_col1:
-                    is_playing = st.session_state.get("tts_playing") and st.session_state.get("tts_message_index") == idx
+                    is_playing = st.session_state.get("tts_playing") and st.session_state.get("tts_message_id") == message_id
                     if st.button(
                         "🔊 Read" if not is_playing else "⏹️ Stop",
                         key=f"tts_btn_{unique_key}",
@@ -1004,7 +588,7 @@ def render_chat_history(messages: List[Dict[str, Any]]) -> None:
                         if is_playing:
                             stop_tts()
                         else:
-                            start_tts(message.get("content", ""), idx)
+                            start_tts(message.get("content", ""), message_id)
                 
                 with btn_col2:
                     if st.button(
@@ -1023,25 +607,25 @@ def render_chat_history(messages: List[Dict[str, Any]]) -> None:
                         help="Copy to clipboard",
                         use_container_width=True
                     ):
-                        st.session_state[f"show_copy_{idx}"] = True
+                        st.session_state[f"show_copy_{message_id}"] = True
                         st.rerun()
                 
                 # Show copy modal with text area for easy copying
-                if st.session_state.get(f"show_copy_{idx}", False):
+                if st.session_state.get(f"show_copy_{message_id}", False):
                     with st.expander("📋 Copy Text", expanded=True):
                         content_to_copy = message.get("content", "")
                         st.text_area(
                             "Select all (Ctrl+A) and copy (Ctrl+C):",
                             value=content_to_copy,
                             height=200,
-                            key=f"copy_area_{idx}",
+                            key=f"copy_area_{message_id}",
                             label_visibility="visible"
                         )
                         
                         col_close, col_download = st.columns(2)
                         with col_close:
-                            if st.button("✕ Close", key=f"close_copy_{idx}", use_container_width=True):
-                                st.session_state[f"show_copy_{idx}"] = False
+                            if st.button("✕ Close", key=f"close_copy_{message_id}", use_container_width=True):
+                                st.session_state[f"show_copy_{message_id}"] = False
                                 st.rerun()
                         with col_download:
                             st.download_button(
@@ -1049,7 +633,7 @@ def render_chat_history(messages: List[Dict[str, Any]]) -> None:
                                 data=content_to_copy,
                                 file_name="response.txt",
                                 mime="text/plain",
-                                key=f"download_{idx}",
+                                key=f"download_{message_id}",
                                 use_container_width=True
                             )
                         
@@ -1085,7 +669,8 @@ def trigger_concept_explainer() -> None:
     st.session_state.show_bug_debugger = False
     # Pick a random concept based on difficulty
     difficulty = st.session_state.get("concept_difficulty", "Intermediate")
-    concepts = CONCEPTS_BY_DIFFICULTY.get(difficulty, CONCEPTS_BY_DIFFICULTY["Intermediate"])
+    concepts_by_difficulty = load_catalogue("concepts")
+    concepts = concepts_by_difficulty.get(difficulty, concepts_by_difficulty["Intermediate"])
     st.session_state.current_concept = random.choice(concepts)
 
 
@@ -1096,7 +681,8 @@ def trigger_writing_generator() -> None:
     st.session_state.show_bug_debugger = False
     # Pick a random writing task based on tone
     tone = st.session_state.get("writing_tone", "Formal")
-    tasks = WRITING_TASKS_BY_TONE.get(tone, WRITING_TASKS_BY_TONE["Formal"])
+    tasks_by_tone = load_catalogue("writing_tasks")
+    tasks = tasks_by_tone.get(tone, tasks_by_tone["Formal"])
     st.session_state.current_writing_task = random.choice(tasks)
 
 
@@ -1106,55 +692,14 @@ def trigger_bug_debugger() -> None:
     st.session_state.show_concept_explainer = False
     st.session_state.show_writing_generator = False
     # Pick a random buggy code snippet
-    st.session_state.current_bug = random.choice(BUGGY_CODE_SNIPPETS)
-
-
-def generate_concept_prompt(concept: dict, difficulty: str) -> str:
-    """Generate a prompt for the AI to explain a concept."""
-    return f"""Explain the concept of "{concept['topic']}" from the category "{concept['category']}" at a {difficulty} level.
-
-Please provide:
-1. **Simple Explanation** (2-3 sentences for beginners)
-2. **Structured Explanation** (detailed breakdown with key points)
-3. **Real-World Analogy** (relatable comparison)
-4. **Interview Question** (one common interview question on this topic with a brief answer)
-
-Make sure to adjust the complexity based on the {difficulty} level."""
-
-
-def generate_writing_prompt(task: dict, tone: str) -> str:
-    """Generate a prompt for the AI to create writing content."""
-    return f"""Generate a {tone.lower()} {task['type'].lower()} with the following task:
-
-"{task['prompt']}"
-
-Please create a complete, well-written piece that matches the {tone.lower()} tone. Include proper formatting and structure appropriate for a {task['type']}."""
-
-
-def generate_bug_prompt(bug: dict) -> str:
-    """Generate a prompt for the bug debugger feature."""
-    return f"""I'm practicing debugging! Here's a buggy {bug['language']} code snippet:
-
-**Bug Title:** {bug['title']}
-
-```{bug['language']}
-{bug['buggy_code']}
-```
-
-Please analyze this code and provide:
-1. **What's wrong?** - Identify the bug
-2. **Fixed Code** - Show the corrected version
-3. **Explanation** - Why did this bug occur?
-4. **Prevention Tips** - How to avoid this in the future
-
-Help me understand this debugging challenge!"""
+    st.session_state.current_bug = random.choice(load_catalogue("buggy_code"))
 
 
 def render_empty_state(display_name: str) -> None:
     """Stunning ChatGPT-style welcome screen with animated suggestions and interactive features."""
     
     # Get current model for display
-    current_model = st.session_state.get("model_select", MODEL_OPTIONS[0])
+    current_model = st.session_state.get("model_select", DEFAULT_MODEL)
     current_mode = st.session_state.get("mode_select", CHAT_MODES[0])
     
     st.markdown(
@@ -1396,178 +941,64 @@ def clear_conversation() -> None:
     """Clear only the currently active conversation."""
     messages = get_active_messages()
     messages.clear()
+    if not st.session_state.is_temp_chat:
+        clear_chat_messages(st.session_state.current_chat_id)
+        _sync_active_chat_version()
     st.session_state.uploaded_image = None
 
 
 def delete_chat(chat_id: str) -> None:
     """Remove a saved chat and keep selection valid."""
-    if chat_id in st.session_state.chats:
-        st.session_state.chats.pop(chat_id)
+    if delete_persistent_chat(chat_id, owner=st.session_state.chat_owner):
         if st.session_state.current_chat_id == chat_id:
-            next_chat = next(iter(st.session_state.chats), "")
+            next_chat = next(iter(list_chats(owner=st.session_state.chat_owner)), "")
             if next_chat:
                 st.session_state.current_chat_id = next_chat
             else:
-                st.session_state.current_chat_id = create_persistent_chat()
+                st.session_state.current_chat_id = create_persistent_chat(owner=st.session_state.chat_owner)
 
 
 def rename_chat(chat_id: str, new_title: str) -> None:
     """Rename a chat with a new title."""
-    if chat_id in st.session_state.chats and new_title.strip():
-        st.session_state.chats[chat_id]["title"] = new_title.strip()
+    if new_title.strip() and get_chat_meta(chat_id, owner=st.session_state.chat_owner) is not None:
+        set_chat_title(chat_id, new_title.strip(), owner=st.session_state.chat_owner)
         st.session_state.show_rename_input = False
         st.session_state.rename_chat_title = ""
 
 
-def summarize_title(prompt: str) -> str:
-    """Generate a short title from the first user message."""
-    condensed = prompt.strip().splitlines()[0][:40]
-    return condensed + ("…" if len(prompt.strip()) > len(condensed) else "") or "New chat"
-
+def stream_assistant_reply(chunks: Iterable[str], *, model: str, mode: str) -> None:
+    """Stream a reply into a new assistant bubble with a Stop control, then persist it.
 
-def send_to_backend(
-    messages: List[Dict[str, Any]],
-    *,
-    mode: str,
-    system_prompt: str,
-    model: str,
-    image: Optional[Image.Image] = None,
-):
-    """Send messages to the selected backend model and yield assistant text chunks for streaming.
-
-    Behavior:
-    - If `model` == "gpt-oss-120b" use the Groq/OpenAI-compatible Responses API.
-      The function will first attempt to use the `openai.OpenAI` SDK if available,
-      otherwise it will POST to the configured `GROQ_BASE_URL` using `requests`.
-    - For llama3/deepseek-r1, uses Ollama API.
-    - For other modes/models the function falls back to a friendly stub message.
-
-    Keys:
-    - Put credentials in `st.secrets` or environment variables:
-      - `GROQ_API_KEY` and optional `GROQ_BASE_URL` for Groq/OpenAI-compatible API
+    If the script run is interrupted (Stop, another widget, the tab closing) the backend
+    request is cancelled and the text received so far is saved with `stopped=True`.
+    The reply is saved with its mode and `timings`; completed replies are also
+    added to the exported metrics under the model that answered.
     """
-
-    user_prompt = next(
-        (msg.get("content", "") for msg in reversed(messages) if msg.get("role") == "user"),
-        "",
-    )
-
-    # If there is an image, attach a short descriptor to the prompt
-    if image is not None:
-        try:
-            b64 = image_to_base64(image)
-            user_prompt = f"[Image attached: base64_png({len(b64)} bytes)]\n\n" + user_prompt
-        except Exception:
-            user_prompt = "[Image attached]\n\n" + user_prompt
-
-    if not user_prompt:
-        yield "Hi there! Send a message or upload an image and I'll respond."
-        return
-    
-    # Apply mode-specific instructions to the prompt
-    mode_instructions = ""
-    if mode == "Generate Code":
-        mode_instructions = "You are a code generation assistant. Generate clean, efficient, and well-commented code based on the user's request. Always include code examples in your response.\n\n"
-    elif mode == "Explain Code":
-        mode_instructions = "You are a code explanation assistant. Provide clear, detailed explanations of code, breaking down how it works step by step. Explain concepts, logic flow, and best practices.\n\n"
-    else:  # Chat mode
-        mode_instructions = f"{system_prompt}\n\n"
-    
-    # Prepend mode instructions to user prompt
-    full_prompt = mode_instructions + user_prompt
-
-    # --------------------
-    # Groq / OpenAI-compatible (gpt-oss-120b)
-    # --------------------
-    if model == "gpt-oss-120b":
-        groq_api_key = get_secret_or_env("GROQ_API_KEY")
-        # allow hardcoded fallback for convenience during local testing
-        if not groq_api_key and "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":
-            groq_api_key = "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".strip() or None
-
-        groq_base = get_secret_or_env("GROQ_BASE_URL") or GROQ_BASE_URL_DIRECT or "https://api.groq.com/openai/v1"
-        if not groq_api_key:
-            yield "[GROQ API key not found. Set `GROQ_API_KEY` in Streamlit secrets, environment variables, or `GROQ_API_KEY_DIRECT` in this file.]"
-            return
-
-        try:
-            from openai import OpenAI
-            
-            client = OpenAI(
-                api_key=groq_api_key,
-                base_url=groq_base,
-            )
-            
-            response = client.responses.create(
-                input=full_prompt,
-                model="openai/gpt-oss-120b",
-                stream=True
+    # Keyed to this browser session for its token budget and turn in the backend queues
+    scope = GenerationScope(current_streamlit_session())
+    full_response = None
+    stats: Dict[str, float] = {}
+    started = time.monotonic()
+    try:
+        with st.chat_message("assistant", avatar="✨"):
+            stop_slot = st.empty()
+            stop_slot.button("⏹ Stop generating", key="stop_generation")
+            full_response = render_streaming_response(
+                stream_in_background(chunks, scope), status=lambda: scope.status, stats=stats
             )
-            
-            for event in response:
-                if hasattr(event, "delta"):
-                    delta = event.delta
-                    if hasattr(delta, "text") and delta.text:
-                        yield delta.text
-                    elif isinstance(delta, str):
-                        yield delta
-                elif isinstance(event, str):
-                    yield event
-        except ImportError:
-            yield "[OpenAI SDK not installed. Install: pip install openai]"
-        except Exception as http_err:
-            yield f"[Error calling Groq/OpenAI endpoint: {http_err}]"
-        return
-
-    # --------------------
-    # Ollama Models (llama3, deepseek-r1)
-    # --------------------
-    if model in ["llama3", "deepseek-r1", "deepseek-ocr:3b"]:
-        yield from stream_generate(model, full_prompt, image)
-        return
-
-    # --------------------
-    # Mode-based helper behavior (existing helpful stubs)
-    # --------------------
-    if mode == "Generate Code":
-        yield (
-            f"Here's the code you requested! 🚀\n\n"
-            "```python\n"
-            "def solution(data):\n"
-            '    """Generated based on your requirements."""\n'
-            "    # Implementation goes here\n"
-            "    result = process(data)\n"
-            "    return result\n"
-            "```\n\n"
-            "**Key points:**\n"
-            "- Clean and readable structure\n"
-            "- Follows best practices\n"
-            "- Ready to customize\n\n"
-            "Would you like me to explain any part or make modifications?"
-        )
-        return
-
-    if mode == "Explain Code":
-        yield (
-            "Let me break this down for you! 📚\n\n"
-            "**Overview:**\n"
-            "The code you shared performs a specific operation with clear logic.\n\n"
-            "**Step-by-step explanation:**\n"
-            "1. **Input handling** - Validates and processes input data\n"
-            "2. **Core logic** - Performs the main computation\n"
-            "3. **Output** - Returns the processed result\n\n"
-            "**Complexity:** O(n) time, O(1) space\n\n"
-            "Any questions about specific parts?"
-        )
-        return
-
-    # Default fallback
-    yield (
-        f"Great question! Here's a friendly stub reply while the model call is not configured.\n\n"
-        f"Your input: \"{user_prompt[:100]}{'...' if len(user_prompt) > 100 else ''}\"\n\n"
-        f"Selected model: `{model}`\n"
-        "To enable live responses, set API keys in Streamlit `secrets.toml` or environment variables and install the SDKs."
-    )
+            stop_slot.empty()
+    finally:
+        scope.cancel()
+        meta = {**scope.meta, "mode": mode}
+        meta.setdefault("model", model)
+        response = full_response if full_response is not None else "".join(scope.received)
+        meta["timings"] = turn_timings(response, stats, scope.meta.get("timings", {}), time.monotonic() - started)
+        if full_response is not None:
+            append_message(make_message("assistant", full_response, **meta))
+            if full_response.strip():
+                record_turn_metrics(meta["model"], mode, meta["timings"])
+        elif response.strip():
+            append_message(make_message("assistant", response, stopped=True, **meta))
 
 
 def handle_user_prompt(
@@ -1575,50 +1006,53 @@ def handle_user_prompt(
     mode: str, 
     system_prompt: str, 
     model: str,
-    image: Optional[Image.Image] = None
+    image: Optional[str] = None,
+    use_cache: bool = False,
 ) -> None:
-    """Persist the new user prompt, get assistant reply with streaming, and re-render."""
-    messages = get_active_messages()
-    
+    """Persist the new user prompt, get assistant reply with streaming, and re-render.
+
+    `image` is the reference of an uploaded image in the blob store. `use_cache` lets
+    deterministic prompts be answered from the response cache.
+    """
     # Create message with optional image
-    user_message = {"role": "user", "content": user_prompt}
+    user_message = make_message("user", user_prompt)
     if image:
-        user_message["image"] = image
+        user_message["image_ref"] = image
     
-    messages.append(user_message)
+    append_message(user_message)
+    messages = get_active_messages()
     
     # Display user message
     with st.chat_message("user", avatar="👤"):
         if image:
-            st.image(image, width=300)
+            st.image(image_thumbnail(image, 300), width=300)
         st.markdown(user_prompt)
     
-    # Display streaming assistant response
-    with st.chat_message("assistant", avatar="✨"):
-        message_placeholder = st.empty()
-        full_response = ""
-        
-        for chunk in send_to_backend(
+    # Clear the uploaded image once it is part of the conversation
+    st.session_state.uploaded_image = None
+
+    if not st.session_state.is_temp_chat and user_prompt.strip():
+        chat_meta = get_chat_meta(st.session_state.current_chat_id, owner=st.session_state.chat_owner) or {}
+        if chat_meta.get("title") in {"New chat", ""} or chat_meta.get("title", "").startswith("New chat "):
+            set_chat_title(
+                st.session_state.current_chat_id, summarize_title(user_prompt), owner=st.session_state.chat_owner
+            )
+
+    stream_assistant_reply(
+        send_to_backend(
             messages,
             mode=mode,
             system_prompt=system_prompt,
             model=model,
             image=image,
-        ):
-            full_response += chunk
-            message_placeholder.markdown(full_response + "▌")
-        
-        message_placeholder.markdown(full_response)
-    
-    messages.append({"role": "assistant", "content": full_response})
-
-    # Clear the uploaded image after sending
-    st.session_state.uploaded_image = None
-
-    if not st.session_state.is_temp_chat and user_prompt.strip():
-        chat_meta = st.session_state.chats[st.session_state.current_chat_id]
-        if chat_meta.get("title") in {"New chat", ""} or chat_meta.get("title", "").startswith("New chat "):
-            chat_meta["title"] = summarize_title(user_prompt)
+            use_cache=use_cache,
+            semantic_threshold=(
+                st.session_state.semantic_cache_threshold if st.session_state.semantic_cache_enabled else None
+            ),
+        ),
+        model=model,
+        mode=mode,
+    )
 
 
 def start_new_chat(title: Optional[str] = None) -> None:
@@ -1627,10 +1061,18 @@ def start_new_chat(title: Optional[str] = None) -> None:
     if st.session_state.is_temp_chat:
         st.session_state.temp_messages = []
     else:
-        chat_id = create_persistent_chat(title)
+        chat_id = create_persistent_chat(title, owner=st.session_state.chat_owner)
         st.session_state.current_chat_id = chat_id
 
 
+def handle_model_change() -> None:
+    """Callback for the model selector: start loading the newly selected Ollama model."""
+    model = st.session_state.model_select
+    if MODEL_OPTIONS.get(model, {}).get("backend") == "ollama":
+        mark_model_used(model)
+        request_model_preload(model)
+
+
 def handle_new_chat_button() -> None:
     """Callback for sidebar button to create a chat with custom title."""
     custom_title = st.session_state.get("new_chat_name", "").strip() or None
@@ -1638,42 +1080,21 @@ def handle_new_chat_button() -> None:
     st.session_state.new_chat_name = ""
 
 
-def search_in_chat(chat_id: str, query: str) -> tuple[bool, str]:
-    """Search for query in chat title and messages. Returns (found, match_type)."""
-    chat = st.session_state.chats[chat_id]
-    query_lower = query.lower()
-    
-    # Search in title
-    if query_lower in chat["title"].lower():
-        return True, "title"
-    
-    # Search in message content
-    for message in chat.get("messages", []):
-        content = message.get("content", "").lower()
-        if query_lower in content:
-            return True, "content"
-    
-    return False, ""
-
-
 def render_chat_list() -> None:
     """Renderable list of saved chats similar to ChatGPT sidebar with enhanced search."""
-    if not st.session_state.chats:
+    chats = list_chats(owner=st.session_state.chat_owner)
+    if not chats:
         st.caption("No saved chats yet.")
         return
 
-    all_chat_ids = list(st.session_state.chats.keys())
+    all_chat_ids = list(chats.keys())
     query = st.session_state.chat_search.strip().lower()
     
-    # Enhanced search: filter by title or content
+    # Enhanced search: filter by title or content via the full-text index
+    matched_chats: Dict[str, Dict[str, str]] = {}
     if query:
-        matched_chats = {}
-        for cid in all_chat_ids:
-            found, match_type = search_in_chat(cid, query)
-            if found:
-                matched_chats[cid] = match_type
-        
-        chat_ids = list(matched_chats.keys())
+        matched_chats = search_chats(query, owner=st.session_state.chat_owner)
+        chat_ids = [cid for cid in all_chat_ids if cid in matched_chats]
         
         if not chat_ids:
             st.warning(f"🔍 No chats found matching '{st.session_state.chat_search}'")
@@ -1697,9 +1118,9 @@ def render_chat_list() -> None:
     
     # Format function to show match indicator
     def format_chat_title(cid: str) -> str:
-        title = st.session_state.chats[cid]["title"]
+        title = chats[cid]["title"]
         if query:
-            _, match_type = search_in_chat(cid, query)
+            match_type = matched_chats[cid]["match"]
             if match_type == "title":
                 return f"📌 {title}"
             elif match_type == "content":
@@ -1711,6 +1132,7 @@ def render_chat_list() -> None:
         options=chat_ids,
         index=index,
         format_func=format_chat_title,
+        captions=[matched_chats[cid]["snippet"] for cid in chat_ids] if query else None,
         label_visibility="collapsed",
         key="chat_history_selector",
         help="📌 = Match in title, 💬 = Match in messages" if query else None
@@ -1725,7 +1147,7 @@ def render_chat_list() -> None:
         if st.button("✏️ Rename", key="rename_chat_btn", use_container_width=True):
             st.session_state.show_rename_input = not st.session_state.show_rename_input
             if st.session_state.show_rename_input:
-                current_title = st.session_state.chats[st.session_state.current_chat_id]["title"]
+                current_title = chats[st.session_state.current_chat_id]["title"]
                 st.session_state.rename_chat_title = current_title
     
     with col2:
@@ -1804,10 +1226,19 @@ def render_sidebar() -> tuple[str, str, str]:
         
         model = st.selectbox(
             "Model",
-            options=MODEL_OPTIONS,
+            options=[*MODEL_OPTIONS, AUTO_MODEL],
             key="model_select",
+            format_func=lambda name: "auto (fastest healthy)" if name == AUTO_MODEL else name,
+            on_change=handle_model_change,
             help="Select the AI model to use"
         )
+        if MODEL_OPTIONS.get(model, {}).get("backend") == "ollama":
+            residency = get_model_residency(model)
+            st.caption({
+                "warm": "🔥 Warm: loaded in Ollama",
+                "loading": "⏳ Loading into Ollama…",
+                "cold": "❄️ Cold: first reply will wait for the model to load",
+            }[residency])
         
         mode = st.selectbox(
             "Mode", 
@@ -1827,6 +1258,75 @@ def render_sidebar() -> tuple[str, str, str]:
                 key="system_prompt_area",
             )
 
+            st.toggle(
+                "Semantic cache",
+                key="semantic_cache_enabled",
+                help=f"Answer near-duplicate opening questions from earlier replies (embeddings via {SEMANTIC_CACHE_EMBED_MODEL})",
+            )
+            st.slider(
+                "Similarity threshold",
+                min_value=0.80,
+                max_value=0.99,
+                step=0.01,
+                key="semantic_cache_threshold",
+                disabled=not st.session_state.semantic_cache_enabled,
+            )
+            st.toggle(
+                "Show turn timings",
+                key="show_turn_timings",
+                help="Debug overlay under each reply: queue wait, connect, time to first token, tokens/s, total and render time",
+            )
+
+        with st.expander("🩺 Backend health"):
+            for backend, scheduler in get_backend_schedulers().items():
+                load = scheduler.stats()
+                capacity = load["capacity"] or "∞"
+                st.caption(
+                    f"🚦 {backend}: {load['active']}/{capacity} busy · {load['queued']} queued · "
+                    f"wait p50 {load['wait_p50']:.2f}s · p95 {load['wait_p95']:.2f}s"
+                )
+            transport = get_ollama_transport_stats()
+            st.caption(
+                f"🔌 ollama: {transport['requests']} requests on {transport['connections_opened']} connections · "
+                f"{transport['connections_reused']} reused"
+            )
+            for name in MODEL_OPTIONS:
+                health = get_backend_health(name)
+                if not health["samples"]:
+                    st.caption(f"⚪ {name}: no calls yet")
+                    continue
+                p50, p95 = health["p50_ttft"], health["p95_ttft"]
+                latency = f"TTFT p50 {p50:.2f}s · p95 {p95:.2f}s" if p50 is not None else "no successful calls"
+                st.caption(
+                    f"{'🟢' if health['healthy'] else '🔴'} {name}: {latency} · "
+                    f"{health['error_rate']:.0%} errors ({health['samples']} calls)"
+                )
+
+        with st.expander("📈 Cache metrics"):
+            cache_stats = get_response_cache_stats()
+            st.caption(
+                f"Response cache: {cache_stats['entries']} entries · "
+                f"hit rate {cache_stats['hit_rate']:.0%} "
+                f"({cache_stats['hits']} hits / {cache_stats['misses']} misses)"
+            )
+            coalescing = get_coalescing_stats()
+            st.caption(
+                f"Coalescing: {coalescing['coalesced']} requests joined one of "
+                f"{coalescing['started']} upstream generations ({coalescing['in_flight']} in flight)"
+            )
+            semantic_stats = get_semantic_cache_stats()
+            col_rate, col_saved = st.columns(2)
+            col_rate.metric(
+                "Semantic hit rate",
+                f"{semantic_stats['hit_rate']:.0%}",
+                help=f"{semantic_stats['hits']} hits / {semantic_stats['misses']} misses",
+            )
+            col_saved.metric("Tokens saved", f"{semantic_stats['tokens_saved']:,}")
+            st.caption(
+                f"Semantic cache: {semantic_stats['entries']} entries"
+                + (f" · {semantic_stats['embed_errors']} embedding errors" if semantic_stats["embed_errors"] else "")
+            )
+
         if st.button("🗑️ Clear chat", use_container_width=True):
             clear_conversation()
             st.rerun()
@@ -1836,7 +1336,7 @@ def render_sidebar() -> tuple[str, str, str]:
     return mode, model, system_prompt
 
 
-def render_input_toolbar() -> tuple[Optional[Image.Image], str]:
+def render_input_toolbar() -> tuple[Optional[str], str]:
     """Render attachment toolbar with image and voice inputs."""
     uploaded_image = None
     voice_text = ""
@@ -1864,9 +1364,9 @@ def render_input_toolbar() -> tuple[Optional[Image.Image], str]:
                 label_visibility="collapsed"
             )
             if uploaded_file:
-                uploaded_image = Image.open(uploaded_file)
+                uploaded_image = store_image_blob(uploaded_file.getvalue())
                 st.session_state.uploaded_image = uploaded_image
-                st.image(uploaded_image, width=200, caption="Ready to send")
+                st.image(image_thumbnail(uploaded_image, 200), width=200, caption="Ready to send")
                 
                 col_a, col_b = st.columns(2)
                 with col_a:
@@ -1902,6 +1402,7 @@ def render_input_toolbar() -> tuple[Optional[Image.Image], str]:
                             tmp_path = None
                             try:
                                 import wave
+                                import speech_recognition as sr
                                 import tempfile
                                 import os
                                 import time
@@ -1955,6 +1456,7 @@ def render_input_toolbar() -> tuple[Optional[Image.Image], str]:
                                 tmp_path = None
                                 try:
                                     import wave
+                                    import speech_recognition as sr
                                     import tempfile
                                     import os
                                     import time
@@ -2001,7 +1503,7 @@ def render_input_toolbar() -> tuple[Optional[Image.Image], str]:
         with st.container():
             col_img, col_remove = st.columns([4, 1])
             with col_img:
-                st.image(st.session_state.uploaded_image, width=80)
+                st.image(image_thumbnail(st.session_state.uploaded_image, 80), width=80)
             with col_remove:
                 if st.button("✕", key="remove_preview"):
                     st.session_state.uploaded_image = None
@@ -2018,13 +1520,18 @@ def main() -> None:
     )
     inject_custom_css()
     init_session_state()
+    start_model_keeper()
+    start_metrics_server()
+    if PREWARM_IN_BACKGROUND:
+        start_background_prewarm()
 
     mode, model, system_prompt = render_sidebar()
     messages = get_active_messages()
 
-    # Main chat area
+    # Main chat area (a pending regenerate redraws the history itself further down)
     if messages:
-        render_chat_history(messages)
+        if st.session_state.get("regenerate_index") is None:
+            render_chat_history(messages)
     else:
         render_empty_state(st.session_state.display_name)
 
@@ -2077,9 +1584,9 @@ def main() -> None:
                 label_visibility="collapsed"
             )
             if uploaded_file:
-                uploaded_image = Image.open(uploaded_file)
+                uploaded_image = store_image_blob(uploaded_file.getvalue())
                 st.session_state.uploaded_image = uploaded_image
-                st.image(uploaded_image, width=200, caption="Ready to send")
+                st.image(image_thumbnail(uploaded_image, 200), width=200, caption="Ready to send")
                 
                 col_a, col_b = st.columns(2)
                 with col_a:
@@ -2115,6 +1622,7 @@ def main() -> None:
                             tmp_path = None
                             try:
                                 import wave
+                                import speech_recognition as sr
                                 import tempfile
                                 import os
                                 import time
@@ -2168,6 +1676,7 @@ def main() -> None:
                                 tmp_path = None
                                 try:
                                     import wave
+                                    import speech_recognition as sr
                                     import tempfile
                                     import os
                                     import time
@@ -2214,7 +1723,7 @@ def main() -> None:
         with st.container():
             col_img, col_remove = st.columns([4, 1])
             with col_img:
-                st.image(st.session_state.uploaded_image, width=80)
+                st.image(image_thumbnail(st.session_state.uploaded_image, 80), width=80)
             with col_remove:
                 if st.button("✕", key="remove_preview"):
                     st.session_state.uploaded_image = None
@@ -2247,7 +1756,8 @@ def main() -> None:
             mode,
             system_prompt.strip(),
             model,
-            image=st.session_state.uploaded_image
+            image=st.session_state.uploaded_image,
+            use_cache=True,
         )
         st.rerun()
     
@@ -2262,33 +1772,27 @@ def main() -> None:
             user_msg_index = regen_index - 1
             if messages[user_msg_index].get("role") == "user":
                 user_prompt_regen = messages[user_msg_index].get("content", "")
-                user_image_regen = messages[user_msg_index].get("image")
+                user_image_regen = messages[user_msg_index].get("image_ref")
                 
                 # Remove the old assistant message
-                messages.pop(regen_index)
+                remove_message(regen_index)
                 
                 # Display existing messages
                 render_chat_history(messages)
                 
                 # Generate new response with streaming
-                with st.chat_message("assistant", avatar="✨"):
-                    message_placeholder = st.empty()
-                    full_response = ""
-                    
-                    for chunk in send_to_backend(
+                stream_assistant_reply(
+                    send_to_backend(
                         messages,
                         mode=mode,
                         system_prompt=system_prompt.strip(),
                         model=model,
                         image=user_image_regen,
-                    ):
-                        full_response += chunk
-                        message_placeholder.markdown(full_response + "▌")
-                    
-                    message_placeholder.markdown(full_response)
-                
-                messages.append({"role": "assistant", "content": full_response})
-                st.rerun()
+                    ),
+                    model=model,
+                    mode=mode,
+                )
+        st.rerun()
     
     if user_prompt:
         handle_user_prompt(
@@ -2305,4 +1809,6 @@ def main() -> None:
 
 
 if __name__ == "__main__":
+    if not st.runtime.exists() and sys.argv[1:2] == ["prewarm"]:
+        sys.exit(run_prewarm_cli(sys.argv[2:]))
     main()
@@ -0,0 +1,115 @@
+"""Startup profile of `import app` (or the headless `code_gen_ai` package), for cold-start
+and autoscale spin-up time.
+
+Each measurement imports the module in a fresh interpreter. Reports the median wall time,
+the `-X importtime` breakdown of what it pulls in, and whether any dependency that should
+load lazily was imported at startup (exit status 1 if so). The package must not import
+Streamlit at all:
+    python bench/importtime.py --runs 5 --top 15
+    python bench/importtime.py --module code_gen_ai
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Any, Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+
+# Only needed by optional features; importing any of these at startup is a regression
+LAZY_MODULES = ["numpy", "PIL", "requests", "speech_recognition", "openai", "http.server", "argparse"]
+# Modules that may not be imported at all, per profiled module
+FORBIDDEN_MODULES = {"code_gen_ai": ["streamlit"]}
+
+IMPORT_SCRIPT = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"seconds": elapsed, "eager": [name for name in {lazy!r} if name in sys.modules]}}))
+"""
+
+
+def _run_import(module: str, importtime: bool) -> subprocess.CompletedProcess:
+    env = {**os.environ, "CODEGEN_DATA_DIR": tempfile.mkdtemp(prefix="codegen-import-")}
+    command = [sys.executable, *(["-X", "importtime"] if importtime else []), "-c"]
+    lazy = LAZY_MODULES + FORBIDDEN_MODULES.get(module, [])
+    command.append(IMPORT_SCRIPT.format(root=REPO_ROOT, lazy=lazy, module=module))
+    result = subprocess.run(command, cwd=REPO_ROOT, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{result.stderr[-2000:]}")
+    return result
+
+
+def parse_importtime(stderr: str) -> List[Dict[str, Any]]:
+    """Rows of `-X importtime` output as {module, depth, self_us, cumulative_us}."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append({
+            "module": name.strip(),
+            # Nesting is shown as two extra spaces per level after the separator's own space
+            "depth": (len(name) - len(name.lstrip(" ")) - 1) // 2,
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us),
+        })
+    return rows
+
+
+def profile_startup(runs: int = 5, module: str = "app") -> Dict[str, Any]:
+    """Median import time over `runs` fresh interpreters, plus one `-X importtime` breakdown."""
+    samples = [
+        json.loads(_run_import(module, importtime=False).stdout.strip().splitlines()[-1]) for _ in range(runs)
+    ]
+    traced = _run_import(module, importtime=True)
+    rows = parse_importtime(traced.stderr)
+    app_index = max(idx for idx, row in enumerate(rows) if row["module"] == module)
+    # Modules it imports directly are the depth-1 rows just before it (children precede parents)
+    children = []
+    for row in reversed(rows[:app_index]):
+        if row["depth"] == 0:
+            break
+        if row["depth"] == 1:
+            children.append(row)
+    return {
+        "import_s": statistics.median(sample["seconds"] for sample in samples),
+        "app_cumulative_s": rows[app_index]["cumulative_us"] / 1e6,
+        "app_self_s": rows[app_index]["self_us"] / 1e6,
+        "imports": sorted(children, key=lambda row: row["cumulative_us"], reverse=True),
+        "eager": samples[-1]["eager"],
+    }
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to time (median is reported)")
+    parser.add_argument("--top", type=int, default=15, help="heaviest direct imports to list")
+    parser.add_argument("--module", default="app", help="module to import (e.g. code_gen_ai)")
+    parser.add_argument("--json", action="store_true", help="print the profile as JSON")
+    args = parser.parse_args(argv)
+
+    profile = profile_startup(args.runs, args.module)
+    if args.json:
+        print(json.dumps(profile, indent=2))
+    else:
+        print(f"import {args.module}: {profile['import_s'] * 1000:.1f} ms median over {args.runs} runs")
+        print(f"  {args.module} module body: {profile['app_self_s'] * 1000:.1f} ms")
+        print("  heaviest direct imports (cumulative):")
+        for row in profile["imports"][:args.top]:
+            print(f"    {row['cumulative_us'] / 1000:8.1f} ms  {row['module']}")
+    if profile["eager"]:
+        print(f"Imported at startup but should load lazily: {', '.join(profile['eager'])}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
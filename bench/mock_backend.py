@@ -0,0 +1,245 @@
+"""Local stand-in for Ollama and the Groq/OpenAI Responses API, for benchmarks and offline demos.
+
+Speaks just enough of both protocols for app.py:
+- Ollama: POST /api/generate and /api/chat (NDJSON streaming, final frame with
+  eval_count/eval_duration), POST /api/embed, GET /api/ps and /api/tags, and
+  prompt-less keep-alive preloads.
+- OpenAI Responses: POST /v1/responses with `stream: true` (server-sent events).
+
+Replies are `reply_tokens` words sent at `token_rate` tokens per second after `ttft`
+seconds, so results depend on the app's own overhead rather than on a model.
+
+Run standalone to try the UI without models:
+    python bench/mock_backend.py --port 11434 --token-rate 40 --ttft 0.3
+    OLLAMA_BASE_URL=http://127.0.0.1:11434 GROQ_BASE_URL=http://127.0.0.1:11434/v1 streamlit run app.py
+"""
+
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, Optional
+
+MOCK_MODELS = ["llama3:latest", "deepseek-r1:latest", "deepseek-ocr:3b"]
+EMBED_DIMENSIONS = 64
+WORDS = (
+    "the model streams tokens back to the client while the interface renders each chunk "
+    "def solve(data): return sorted(data) cache latency queue budget retry".split()
+)
+
+
+class MockBackendServer:
+    """Threaded mock server; use as a context manager or call `start()` / `stop()`."""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        *,
+        token_rate: float = 200.0,
+        ttft: float = 0.05,
+        reply_tokens: int = 200,
+    ) -> None:
+        self.token_rate = token_rate
+        self.ttft = ttft
+        self.reply_tokens = reply_tokens
+        self.requests: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockBackendServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-backend", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "MockBackendServer":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+    def count(self, path: str) -> None:
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def tokens(self, seed: str) -> Iterator[str]:
+        """Yield the reply's tokens on schedule: `ttft` first, then `token_rate` per second."""
+        offset = int(hashlib.md5(seed.encode("utf-8")).hexdigest(), 16)
+        started = time.monotonic()
+        time.sleep(self.ttft)
+        for idx in range(self.reply_tokens):
+            if self.token_rate > 0:
+                delay = started + self.ttft + idx / self.token_rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            yield WORDS[(offset + idx) % len(WORDS)] + ("\n\n" if idx % 40 == 39 else " ")
+
+
+def _embedding(text: str) -> list:
+    vector = [0.0] * EMBED_DIMENSIONS
+    for word in text.lower().split():
+        vector[int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % EMBED_DIMENSIONS] += 1.0
+    return vector
+
+
+def _make_handler(mock: MockBackendServer) -> type:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+        def _json(self, obj: Any, status: int = 200) -> None:
+            data = json.dumps(obj).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _start_chunked(self, content_type: str) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+        def _chunk(self, data: bytes) -> None:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        def _end_chunked(self) -> None:
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+        def do_GET(self) -> None:
+            mock.count(self.path)
+            if self.path in ("/api/ps", "/api/tags"):
+                self._json({"models": [{"name": name, "model": name} for name in MOCK_MODELS]})
+            else:
+                self._json({"error": "not found"}, 404)
+
+        def do_POST(self) -> None:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            path = self.path.split("?")[0]
+            mock.count(path)
+            try:
+                if path == "/api/embed":
+                    inputs = body.get("input", "")
+                    inputs = inputs if isinstance(inputs, list) else [inputs]
+                    self._json({"model": body.get("model"), "embeddings": [_embedding(text) for text in inputs]})
+                elif path in ("/api/generate", "/api/chat"):
+                    self._ollama(path, body)
+                elif path.endswith("/responses"):
+                    self._responses(body)
+                else:
+                    self._json({"error": "not found"}, 404)
+            except (BrokenPipeError, ConnectionResetError):
+                # The app cancelled the generation and closed the socket
+                self.close_connection = True
+
+        def _ollama(self, path: str, body: Dict[str, Any]) -> None:
+            model = body.get("model", "")
+            if "prompt" not in body and "messages" not in body:
+                self._json({"model": model, "done": True, "done_reason": "load"})
+                return
+            seed = body.get("prompt") or json.dumps(body.get("messages"))
+            self._start_chunked("application/x-ndjson")
+            started = time.monotonic()
+            count = 0
+            for token in mock.tokens(seed):
+                count += 1
+                if path == "/api/chat":
+                    frame = {"model": model, "message": {"role": "assistant", "content": token}, "done": False}
+                else:
+                    frame = {"model": model, "response": token, "done": False}
+                self._chunk((json.dumps(frame) + "\n").encode("utf-8"))
+            final = {
+                "model": model,
+                "done": True,
+                "done_reason": "stop",
+                "eval_count": count,
+                "eval_duration": int((time.monotonic() - started) * 1e9),
+            }
+            if path == "/api/chat":
+                final["message"] = {"role": "assistant", "content": ""}
+            self._chunk((json.dumps(final) + "\n").encode("utf-8"))
+            self._end_chunked()
+
+        def _responses(self, body: Dict[str, Any]) -> None:
+            response = {
+                "id": "resp_mock",
+                "object": "response",
+                "created_at": int(time.time()),
+                "model": body.get("model", ""),
+                "status": "in_progress",
+                "output": [],
+            }
+            self._start_chunked("text/event-stream")
+            sequence = 0
+
+            def event(kind: str, **fields: Any) -> None:
+                nonlocal sequence
+                payload = {"type": kind, "sequence_number": sequence, **fields}
+                sequence += 1
+                self._chunk(f"event: {kind}\ndata: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+            event("response.created", response=response)
+            text = []
+            for token in mock.tokens(json.dumps(body.get("input"))):
+                text.append(token)
+                event(
+                    "response.output_text.delta",
+                    item_id="msg_mock",
+                    output_index=0,
+                    content_index=0,
+                    delta=token,
+                    logprobs=[],
+                )
+            event(
+                "response.output_text.done",
+                item_id="msg_mock",
+                output_index=0,
+                content_index=0,
+                text="".join(text),
+                logprobs=[],
+            )
+            event("response.completed", response={**response, "status": "completed"})
+            self._end_chunked()
+
+    return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Mock Ollama + OpenAI Responses server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--token-rate", type=float, default=40.0, help="tokens per second (0 = as fast as possible)")
+    parser.add_argument("--ttft", type=float, default=0.3, help="seconds before the first token")
+    parser.add_argument("--reply-tokens", type=int, default=200)
+    args = parser.parse_args()
+    mock = MockBackendServer(
+        args.host, args.port, token_rate=args.token_rate, ttft=args.ttft, reply_tokens=args.reply_tokens
+    )
+    print(f"Mock backend on {mock.url} (Ollama API, OpenAI Responses at {mock.url}/v1)")
+    try:
+        mock._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""Reproducible performance benchmarks for the app against the local mock backend.
+
+Measures, with no live models:
+- startup: median `import app` and `import code_gen_ai` time in a fresh interpreter
+  (see bench/importtime.py);
+- backend streaming, calling the headless code_gen_ai package directly: time to first
+  token, tokens/s and client overhead of `stream_generate` (Ollama /api/generate),
+  `send_to_backend` (Ollama /api/chat and the Groq Responses API) and `stream_reply`
+  (the same Ollama chat call relayed from a worker thread);
+- the UI, through Streamlit's AppTest, at several chat sizes: cold load, warm rerun
+  (`render_chat_history`), a full chat turn, the sidebar search, `search_in_chat`, and
+  peak Python memory.
+
+Results can be saved as a baseline and later runs compared against it:
+    python bench/run_bench.py --save-baseline bench/baselines/local.json
+    python bench/run_bench.py --compare bench/baselines/local.json   # exit 1 on regression
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterable, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+APP_PATH = os.path.join(REPO_ROOT, "app.py")
+sys.path.insert(0, REPO_ROOT)
+
+from importtime import profile_startup  # noqa: E402
+from mock_backend import MockBackendServer  # noqa: E402
+
+DEFAULT_SIZES = [10, 100, 1000]
+# Differences below these floors are treated as noise when comparing to a baseline
+NOISE_FLOOR_SECONDS = 0.005
+NOISE_FLOOR_MB = 1.0
+SEARCH_TERM = "needle3"
+
+
+def configure_environment(mock: MockBackendServer, data_dir: str) -> None:
+    """Point the app at the mock server and a scratch data dir, with side jobs switched off."""
+    os.environ.update(
+        CODEGEN_DATA_DIR=data_dir,
+        OLLAMA_BASE_URL=mock.url,
+        GROQ_BASE_URL=f"{mock.url}/v1",
+        GROQ_API_KEY="bench",
+        METRICS_FILE="",
+        USER_TOKENS_PER_MINUTE="0",
+        OLLAMA_KEEPER_INTERVAL="3600",
+    )
+    for name in ("PREWARM_IN_BACKGROUND", "SEMANTIC_CACHE_ENABLED", "METRICS_PORT"):
+        os.environ.pop(name, None)
+
+
+def median(values: Iterable[float]) -> float:
+    return statistics.median(list(values))
+
+
+def measure_stream(chunks: Iterable[str]) -> Dict[str, float]:
+    started = time.perf_counter()
+    ttft = None
+    text = []
+    for chunk in chunks:
+        if chunk and ttft is None:
+            ttft = time.perf_counter() - started
+        text.append(chunk)
+    total = time.perf_counter() - started
+    return {"ttft": ttft if ttft is not None else total, "total": total, "words": len("".join(text).split())}
+
+
+def bench_backends(backend: Any, mock: MockBackendServer, runs: int) -> Dict[str, float]:
+    def chat(model: str) -> Callable[[int], Iterable[str]]:
+        return lambda run: backend.send_to_backend(
+            [backend.make_message("user", f"bench {model} {run}")],
+            mode="Chat",
+            system_prompt=backend.DEFAULT_SYSTEM_PROMPT,
+            model=model,
+        )
+
+    cases = {
+        "ollama_generate": lambda run: backend.stream_generate("llama3", f"bench generate {run}"),
+        "ollama_chat": chat("deepseek-r1"),
+        "groq_responses": chat("gpt-oss-120b"),
+        "ollama_stream_reply": lambda run: backend.stream_reply(
+            [backend.make_message("user", f"bench stream_reply {run}")], model="deepseek-r1"
+        ),
+    }
+    expected = mock.ttft + (mock.reply_tokens - 1) / mock.token_rate if mock.token_rate > 0 else mock.ttft
+    metrics: Dict[str, float] = {}
+    for name, start in cases.items():
+        measure_stream(start(-1))  # warm-up: imports, client and connection pools
+        samples = [measure_stream(start(run)) for run in range(runs)]
+        metrics[f"backend.{name}.ttft_s"] = median(sample["ttft"] for sample in samples)
+        metrics[f"backend.{name}.total_s"] = median(sample["total"] for sample in samples)
+        metrics[f"backend.{name}.overhead_s"] = max(metrics[f"backend.{name}.total_s"] - expected, 0.0)
+        metrics[f"backend.{name}.tokens_per_s"] = median(
+            sample["words"] / max(sample["total"] - sample["ttft"], 1e-9) for sample in samples
+        )
+    return metrics
+
+
+def seed_chat(backend: Any, size: int) -> str:
+    """A persistent chat with `size` alternating user/assistant messages."""
+    chat_id = backend.create_persistent_chat(f"Bench chat ({size} messages)")
+    for idx in range(size):
+        if idx % 2 == 0:
+            content = f"Question {idx}: how do I sort a list of records by two keys? needle{idx % 7}"
+            backend.save_message(chat_id, backend.make_message("user", content))
+        else:
+            content = (
+                f"Answer {idx}. Use `sorted` with a tuple key, which compares field by field.\n\n"
+                "```python\n"
+                "records = sorted(records, key=lambda r: (r.last_name, r.first_name))\n"
+                "```\n\n"
+                "- Sorting is stable, so you can also sort twice, least significant key first.\n"
+                "- Use `reverse=True` for descending order.\n"
+            )
+            backend.save_message(chat_id, backend.make_message("assistant", content))
+    return chat_id
+
+
+def new_app_test(chat_id: str) -> Any:
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP_PATH, default_timeout=120)
+    at.session_state["current_chat_id"] = chat_id
+    at.session_state["model_select"] = "llama3"
+    return at
+
+
+def timed(func: Callable[..., Any], *args: Any) -> float:
+    started = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - started
+
+
+def timed_run(run: Callable[[], Any]) -> float:
+    """Time one AppTest run, failing the benchmark if the app raised."""
+    started = time.perf_counter()
+    at = run()
+    elapsed = time.perf_counter() - started
+    if at.exception:
+        raise RuntimeError(f"app raised during benchmark: {at.exception[0].value}")
+    return elapsed
+
+
+def bench_ui(backend: Any, size: int, runs: int) -> Dict[str, float]:
+    prefix = f"ui.chat_{size}"
+    chat_id = seed_chat(backend, size)
+    metrics: Dict[str, float] = {}
+
+    at = new_app_test(chat_id)
+    metrics[f"{prefix}.cold_load_s"] = timed_run(at.run)
+    metrics[f"{prefix}.rerun_s"] = median(timed_run(at.run) for _ in range(runs))
+
+    turns, turn_timings = [], []
+    for run in range(runs):
+        turns.append(timed_run(at.chat_input[0].set_value(f"bench turn {size} {run}").run))
+        turn_timings.append(at.session_state["active_messages"][-1].get("timings", {}))
+    metrics[f"{prefix}.turn_s"] = median(turns)
+    # As recorded by the app itself for each reply
+    metrics[f"{prefix}.turn_ttft_s"] = median(timings.get("ttft", 0.0) for timings in turn_timings)
+    metrics[f"{prefix}.turn_render_s"] = median(timings.get("render", 0.0) for timings in turn_timings)
+
+    searches = []
+    for _ in range(runs):
+        searches.append(timed_run(at.text_input(key="chat_search").set_value(SEARCH_TERM).run))
+        timed_run(at.text_input(key="chat_search").set_value("").run)
+    metrics[f"{prefix}.sidebar_search_s"] = median(searches)
+    metrics[f"{prefix}.search_in_chat_s"] = median(
+        timed(backend.search_in_chat, chat_id, SEARCH_TERM) for _ in range(runs)
+    )
+
+    # Memory is measured on its own pass: tracemalloc would skew the timings above
+    tracemalloc.start()
+    try:
+        timed_run(new_app_test(chat_id).run)
+        metrics[f"{prefix}.peak_python_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+    return metrics
+
+
+def run_benchmarks(args: argparse.Namespace) -> Dict[str, Any]:
+    metrics = {
+        "startup.import_app_s": profile_startup(args.runs)["import_s"],
+        "startup.import_package_s": profile_startup(args.runs, "code_gen_ai")["import_s"],
+    }
+    with MockBackendServer(token_rate=args.token_rate, ttft=args.ttft, reply_tokens=args.reply_tokens) as mock:
+        configure_environment(mock, tempfile.mkdtemp(prefix="codegen-bench-"))
+        # The package reads its settings at import, so only after the environment is set
+        import code_gen_ai
+        import streamlit
+
+        metrics.update(bench_backends(code_gen_ai, mock, args.runs))
+        for size in args.sizes:
+            metrics.update(bench_ui(code_gen_ai, size, args.runs))
+        metrics["process.max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return {
+            "meta": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "streamlit": streamlit.__version__,
+                "runs": args.runs,
+                "sizes": args.sizes,
+                "token_rate": args.token_rate,
+                "ttft": args.ttft,
+                "reply_tokens": args.reply_tokens,
+                "requests": dict(mock.requests),
+            },
+            "metrics": {name: round(value, 6) for name, value in metrics.items()},
+        }
+
+
+def compare(current: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[str]:
+    """Metrics that got worse than the baseline by more than `tolerance` (and the noise floor)."""
+    regressions = []
+    for name, before in baseline.items():
+        after = current.get(name)
+        if after is None:
+            continue
+        if name.endswith("_per_s"):
+            worse = before > 0 and after < before * (1 - tolerance)
+        else:
+            floor = NOISE_FLOOR_MB if name.endswith("_mb") else NOISE_FLOOR_SECONDS
+            worse = after > before * (1 + tolerance) and after - before > floor
+        if worse:
+            regressions.append(f"{name}: {before:.4f} -> {after:.4f}")
+    return regressions
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="chat sizes in messages")
+    parser.add_argument("--runs", type=int, default=5, help="repetitions per measurement (median is reported)")
+    parser.add_argument("--token-rate", type=float, default=0.0, help="mock tokens per second (0 = unthrottled)")
+    parser.add_argument("--ttft", type=float, default=0.05, help="mock seconds before the first token")
+    parser.add_argument("--reply-tokens", type=int, default=2000, help="mock reply length in tokens")
+    parser.add_argument("--output", help="write the results JSON here")
+    parser.add_argument("--save-baseline", metavar="PATH", help="save the results as a baseline")
+    parser.add_argument("--compare", metavar="PATH", help="compare against a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed relative slowdown (default 30%%)")
+    args = parser.parse_args(argv)
+    # Bare-mode Streamlit warnings (no ScriptRunContext etc.) would drown the report;
+    # AppTest resets Streamlit's own log level, so silence them at the logging module
+    logging.disable(logging.WARNING)
+
+    results = run_benchmarks(args)
+    width = max(len(name) for name in results["metrics"])
+    for name, value in results["metrics"].items():
+        print(f"{name:<{width}}  {value:12.4f}")
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, indent=2, sort_keys=True)
+            handle.write("\n")
+        print(f"Saved {path}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as handle:
+            baseline = json.load(handle)
+        if baseline["meta"].get("sizes") != args.sizes or baseline["meta"].get("token_rate") != args.token_rate:
+            print("Warning: baseline was recorded with different sizes or mock settings")
+        regressions = compare(results["metrics"], baseline["metrics"], args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+        print(f"No regressions against {args.compare} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,130 @@
+"""Code Gen AI backend: model calls, prompt building and the chat store, without Streamlit.
+
+`app.py` is a thin Streamlit frontend over this package; batch jobs, workers and
+benchmarks can import it directly. Settings come from the environment (see `config`).
+
+    from code_gen_ai import complete, stream_reply
+
+    reply = complete([{"role": "user", "content": "Write a binary search"}], mode="Generate Code")
+"""
+
+from .api import complete, send_to_backend, stream_reply
+from .backend import (
+    BackendError,
+    close_groq_clients,
+    dispatch_to_backend,
+    get_backend_health,
+    get_backend_schedulers,
+    get_model_residency,
+    get_ollama_transport_stats,
+    mark_model_used,
+    request_model_preload,
+    route_candidates,
+    start_model_keeper,
+    stream_generate,
+)
+from .cache import get_coalescing_stats, get_response_cache_stats, get_semantic_cache_stats
+from .config import (
+    AUTO_MODEL,
+    CHAT_MODES,
+    DEFAULT_MODEL,
+    DEFAULT_SYSTEM_PROMPT,
+    MODEL_OPTIONS,
+    get_secret_or_env,
+    register_secret_source,
+)
+from .generation import GenerationScope, stream_in_background
+from .metrics import format_turn_timings, record_turn_metrics, render_prometheus_metrics, start_metrics_server, turn_timings
+from .prewarm import prewarm_catalogue, run_prewarm_cli, start_background_prewarm
+from .prompts import (
+    build_conversation_context,
+    estimate_tokens,
+    generate_bug_prompt,
+    generate_concept_prompt,
+    generate_writing_prompt,
+    get_mode_instructions,
+    iter_catalogue_prompts,
+    load_catalogue,
+    summarize_title,
+)
+from .store import (
+    clear_chat_messages,
+    content_digest,
+    create_persistent_chat,
+    delete_message,
+    delete_persistent_chat,
+    get_chat_meta,
+    list_chats,
+    load_chat_messages,
+    make_message,
+    save_message,
+    search_chats,
+    search_in_chat,
+    set_chat_title,
+)
+from .utils import load_image, load_image_bytes, prepare_image_payload, store_image_blob, transcribe_audio
+
+__all__ = [
+    "AUTO_MODEL",
+    "BackendError",
+    "CHAT_MODES",
+    "DEFAULT_MODEL",
+    "DEFAULT_SYSTEM_PROMPT",
+    "GenerationScope",
+    "MODEL_OPTIONS",
+    "build_conversation_context",
+    "clear_chat_messages",
+    "close_groq_clients",
+    "complete",
+    "content_digest",
+    "create_persistent_chat",
+    "delete_message",
+    "delete_persistent_chat",
+    "dispatch_to_backend",
+    "estimate_tokens",
+    "format_turn_timings",
+    "generate_bug_prompt",
+    "generate_concept_prompt",
+    "generate_writing_prompt",
+    "get_backend_health",
+    "get_backend_schedulers",
+    "get_chat_meta",
+    "get_coalescing_stats",
+    "get_mode_instructions",
+    "get_model_residency",
+    "get_ollama_transport_stats",
+    "get_response_cache_stats",
+    "get_secret_or_env",
+    "get_semantic_cache_stats",
+    "iter_catalogue_prompts",
+    "list_chats",
+    "load_catalogue",
+    "load_chat_messages",
+    "load_image",
+    "load_image_bytes",
+    "make_message",
+    "mark_model_used",
+    "prepare_image_payload",
+    "prewarm_catalogue",
+    "record_turn_metrics",
+    "register_secret_source",
+    "render_prometheus_metrics",
+    "request_model_preload",
+    "route_candidates",
+    "run_prewarm_cli",
+    "save_message",
+    "search_chats",
+    "search_in_chat",
+    "send_to_backend",
+    "set_chat_title",
+    "start_background_prewarm",
+    "start_metrics_server",
+    "start_model_keeper",
+    "store_image_blob",
+    "stream_generate",
+    "stream_in_background",
+    "stream_reply",
+    "summarize_title",
+    "transcribe_audio",
+    "turn_timings",
+]
@@ -0,0 +1,11 @@
+"""Command line entry point: `python -m code_gen_ai prewarm [--models ...] [--modes ...]`."""
+
+import sys
+
+from .prewarm import run_prewarm_cli
+
+if __name__ == "__main__":
+    if sys.argv[1:2] != ["prewarm"]:
+        print("usage: python -m code_gen_ai prewarm [--models M ...] [--modes M ...] [--concurrency N]")
+        sys.exit(2)
+    sys.exit(run_prewarm_cli(sys.argv[2:]))
@@ -0,0 +1,173 @@
+"""Headless Python API: stream or complete assistant replies without Streamlit.
+
+    from code_gen_ai import complete, make_message, stream_reply
+
+    for chunk in stream_reply([make_message("user", "Reverse a list in Python")], model="llama3"):
+        print(chunk, end="", flush=True)
+
+    reply = complete([{"role": "user", "content": "Explain list slicing"}], mode="Explain Code")
+    print(reply["content"], reply["model"], reply["timings"])
+"""
+
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+from .backend import dispatch_to_backend
+from .cache import (
+    cache_complete_response,
+    cached_reply_meta,
+    coalesced_stream,
+    get_cached_response,
+    replay_response,
+    response_cache_key,
+    semantic_reply_stream,
+    semantic_scope,
+)
+from .config import CHAT_MODES, DEFAULT_MODEL, DEFAULT_SYSTEM_PROMPT
+from .generation import GenerationScope, note_generation, stream_in_background
+from .metrics import turn_timings
+from .prompts import build_conversation_context, get_mode_instructions
+from .store import make_message
+
+
+def send_to_backend(
+    messages: List[Dict[str, Any]],
+    *,
+    mode: str,
+    system_prompt: str,
+    model: str,
+    image: Optional[str] = None,
+    use_cache: bool = False,
+    semantic_threshold: Optional[float] = None,
+) -> Iterator[str]:
+    """Send messages to the selected backend model and yield assistant text chunks for streaming.
+
+    Behavior:
+    - Each model's `backend` in MODEL_OPTIONS decides the API: "groq" uses the
+      Groq/OpenAI-compatible Responses API via the `openai.OpenAI` SDK, "ollama" the
+      local Ollama API. `dispatch_to_backend` fails over along the model's `fallback`
+      chain, and AUTO_MODEL picks the fastest healthy model for the mode.
+    - For other modes/models the function falls back to a friendly stub message.
+    - Earlier turns are sent as chat history, trimmed to the model's `context_tokens`
+      budget by `build_conversation_context`.
+    - With `use_cache`, text-only requests are sent without history and answered from
+      the response cache when the same model, mode and prompt were seen before;
+      complete replies are stored.
+    - With `semantic_threshold`, a text-only opening question may be answered from the
+      semantic cache when an earlier one in the same scope is at least that similar.
+
+    Keys:
+    - Put credentials in environment variables (or, in the Streamlit app, `st.secrets`):
+      - `GROQ_API_KEY` and optional `GROQ_BASE_URL` for Groq/OpenAI-compatible API
+    """
+
+    last_user_index = next(
+        (idx for idx in range(len(messages) - 1, -1, -1) if messages[idx].get("role") == "user"),
+        None,
+    )
+    user_prompt = messages[last_user_index].get("content", "") if last_user_index is not None else ""
+
+    # If there is an image, attach a short descriptor to the prompt. The payload itself is
+    # encoded per answering model by the backend, so its size is not known here.
+    if image is not None:
+        user_prompt = "[Image attached]\n\n" + user_prompt
+
+    if not user_prompt:
+        yield "Hi there! Send a message or upload an image and I'll respond."
+        return
+    
+    # Send the mode instructions as a system message, followed by recent turns.
+    # Cacheable (catalogue) prompts are self-contained, so they go without history
+    # and share one cache entry whatever chat they are sent from.
+    cacheable = use_cache and image is None
+    instructions = get_mode_instructions(mode, system_prompt)
+    context = build_conversation_context(
+        [] if cacheable else messages[:last_user_index],
+        user_prompt,
+        instructions=instructions,
+        model=model,
+    )
+
+    key = response_cache_key(model, mode, context)
+    if cacheable:
+        cached = get_cached_response(key)
+        if cached is not None:
+            note_generation(**cached_reply_meta(model, cached["model"]))
+            yield from replay_response(cached["response"])
+            return
+
+    # Identical requests already in flight (from any session) share one upstream call
+    chunks = coalesced_stream(
+        f"{key}:{image or ''}",
+        lambda: dispatch_to_backend(context, mode=mode, model=model, image=image),
+        on_complete=(lambda response: cache_complete_response(key, model, mode, response)) if cacheable else None,
+    )
+    if not cacheable and semantic_threshold is not None and image is None and len(context) <= 2:
+        # Only opening questions: later turns depend on the conversation so far
+        chunks = semantic_reply_stream(
+            user_prompt, semantic_scope(model, mode, instructions), semantic_threshold, chunks
+        )
+    yield from chunks
+
+
+def stream_reply(
+    messages: List[Dict[str, Any]],
+    *,
+    model: str = DEFAULT_MODEL,
+    mode: str = CHAT_MODES[0],
+    system_prompt: str = DEFAULT_SYSTEM_PROMPT,
+    image: Optional[str] = None,
+    use_cache: bool = False,
+    semantic_threshold: Optional[float] = None,
+    scope: Optional[GenerationScope] = None,
+) -> Iterator[str]:
+    """Stream the assistant's reply to `messages` (role/content dicts, oldest first).
+
+    `send_to_backend` runs on a worker thread under `scope` and its text is yielded as it
+    arrives; closing the generator early (e.g. `break`) cancels the backend request.
+    Pass your own scope to read the reply's metadata afterwards (`scope.meta`: the model
+    that answered and backend timings) or to give the caller a session id, which has its
+    own token budget and turn in the backend queues.
+    """
+    scope = scope if scope is not None else GenerationScope()
+    chunks = send_to_backend(
+        messages,
+        mode=mode,
+        system_prompt=system_prompt,
+        model=model,
+        image=image,
+        use_cache=use_cache,
+        semantic_threshold=semantic_threshold,
+    )
+    for chunk in stream_in_background(chunks, scope):
+        if chunk:  # empty chunks are heartbeats
+            yield chunk
+
+
+def complete(
+    messages: List[Dict[str, Any]],
+    *,
+    model: str = DEFAULT_MODEL,
+    mode: str = CHAT_MODES[0],
+    session_id: Optional[str] = None,
+    **options: Any,
+) -> Dict[str, Any]:
+    """Generate the whole reply to `messages` and return it as an assistant message.
+
+    The message has the fields the app saves with a reply (`model` that answered, `mode`,
+    `timings`), so it can go straight to `save_message`. Other options are those of
+    `stream_reply`.
+    """
+    scope = GenerationScope(session_id)
+    stats: Dict[str, float] = {"chunks": 0}
+    parts: List[str] = []
+    started = time.monotonic()
+    for chunk in stream_reply(messages, model=model, mode=mode, scope=scope, **options):
+        stats.setdefault("ttft", time.monotonic() - started)
+        stats["chunks"] += 1
+        parts.append(chunk)
+    response = "".join(parts)
+    meta = {**scope.meta, "mode": mode}
+    meta.setdefault("model", model)
+    meta["timings"] = turn_timings(response, stats, scope.meta.get("timings", {}), time.monotonic() - started)
+    return make_message("assistant", response, **meta)
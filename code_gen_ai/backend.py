@@ -0,0 +1,959 @@
+"""Model backends: Ollama and the Groq/OpenAI-compatible Responses API.
+
+Covers the shared HTTP transport, model residency, routing with health-based failover,
+per-backend scheduling, per-session token budgets and retries. `dispatch_to_backend`
+streams the reply to a prepared context; `stream_generate` is a plain Ollama call.
+"""
+
+import atexit
+import hashlib
+import json
+import random
+import socket
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional
+
+from .config import (
+    AUTO_MODEL,
+    BACKEND_MAX_CONCURRENT_REQUESTS,
+    BACKEND_MAX_RETRIES,
+    BACKEND_RETRY_BASE_DELAY,
+    BACKEND_RETRY_MAX_DELAY,
+    CHAT_MODES,
+    CONTINUATION_OVERLAP_CHARS,
+    CONTINUE_PROMPT,
+    DEFAULT_KEEP_ALIVE,
+    GROQ_BASE_URL_DIRECT,
+    GROQ_CONNECT_TIMEOUT,
+    GROQ_READ_TIMEOUT,
+    MESSAGE_TOKEN_OVERHEAD,
+    MODEL_OPTIONS,
+    OLLAMA_ACTIVE_WINDOW,
+    OLLAMA_API_URL,
+    OLLAMA_CHAT_URL,
+    OLLAMA_KEEPER_INTERVAL,
+    OLLAMA_POOL_CONNECTIONS,
+    OLLAMA_POOL_MAXSIZE,
+    OLLAMA_PS_TTL,
+    OLLAMA_PS_URL,
+    ROUTER_COOLDOWN_SECONDS,
+    ROUTER_DEFAULT_TTFT,
+    ROUTER_MAX_ERROR_RATE,
+    ROUTER_WINDOW,
+    STREAM_HEARTBEAT_INTERVAL,
+    USER_TOKENS_PER_MINUTE,
+    get_secret_or_env,
+)
+from .generation import (
+    _current_generation,
+    add_generation_timing,
+    current_session_id,
+    generation_cancelled,
+    generation_low_priority,
+    note_generation,
+    on_generation_cancel,
+    set_generation_status,
+)
+from .prompts import build_conversation_context, context_budget, estimate_tokens
+from .utils import prepare_image_payload, shared_resource
+
+if TYPE_CHECKING:
+    import requests
+
+
+@shared_resource
+def get_ollama_session() -> "requests.Session":
+    """Return the process-wide pooled HTTP session used for every Ollama call.
+
+    Built once per process so reruns, sessions and worker threads share the same
+    keep-alive connections instead of opening a fresh socket per turn.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=OLLAMA_POOL_CONNECTIONS,
+        pool_maxsize=OLLAMA_POOL_MAXSIZE,
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"Content-Type": "application/json", "Connection": "keep-alive"})
+    atexit.register(session.close)
+    return session
+
+
+def get_ollama_transport_stats() -> Dict[str, int]:
+    """Report connection reuse for the shared Ollama session.
+
+    `connections_reused` counts requests that went out on an already-open socket;
+    it should grow with traffic while `connections_opened` stays near the pool size.
+    """
+    session = get_ollama_session()
+    adapters = {id(adapter): adapter for adapter in session.adapters.values()}
+    pools = opened = sent = 0
+    for adapter in adapters.values():
+        manager = adapter.poolmanager
+        for key in list(manager.pools.keys()):
+            pool = manager.pools.get(key)
+            if pool is None:
+                continue
+            pools += 1
+            opened += pool.num_connections
+            sent += pool.num_requests
+    return {
+        "pools": pools,
+        "connections_opened": opened,
+        "requests": sent,
+        "connections_reused": max(sent - opened, 0),
+    }
+
+
+def iter_ndjson(response: "requests.Response"):
+    """Yield decoded objects from an Ollama NDJSON stream.
+
+    The stream is read to the end even after the `done` object so urllib3 can hand the
+    connection back to the pool; breaking out early would force the socket closed.
+    """
+    finished = False
+    for raw_line in response.iter_lines():
+        if finished or not raw_line:
+            continue
+        try:
+            obj = json.loads(raw_line)
+        except json.JSONDecodeError:
+            continue
+        yield obj
+        if obj.get("done") is True:
+            finished = True
+
+
+def abort_http_response(response: "requests.Response") -> None:
+    """Close a streaming response from another thread.
+
+    The socket is shut down first: a plain close does not wake a thread already blocked
+    reading from it, while shutdown makes that read return immediately.
+    """
+    connection = getattr(response.raw, "connection", None)
+    sock = getattr(connection, "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    response.close()
+
+
+def ollama_keep_alive(model: str) -> str:
+    return MODEL_OPTIONS.get(model, {}).get("keep_alive", DEFAULT_KEEP_ALIVE)
+
+
+@shared_resource
+def _model_residency() -> Dict[str, Any]:
+    """Which Ollama models were used when, which are being loaded, and the last /api/ps answer."""
+    return {"lock": threading.Lock(), "last_used": {}, "preloading": set(), "ps": (0.0, set())}
+
+
+def mark_model_used(model: str) -> None:
+    residency = _model_residency()
+    with residency["lock"]:
+        residency["last_used"][model] = time.monotonic()
+
+
+def preload_model(model: str) -> bool:
+    """Load `model` into Ollama memory (a prompt-less generate) and refresh its keep_alive."""
+    import requests
+
+    try:
+        response = get_ollama_session().post(
+            OLLAMA_API_URL,
+            json={"model": model, "keep_alive": ollama_keep_alive(model)},
+            timeout=120,
+        )
+        response.raise_for_status()
+        return True
+    except requests.exceptions.RequestException:
+        return False
+    finally:
+        residency = _model_residency()
+        with residency["lock"]:
+            residency["preloading"].discard(model)
+            residency["ps"] = (0.0, residency["ps"][1])
+
+
+def request_model_preload(model: str) -> None:
+    """Start loading an Ollama model in the background unless that is already under way."""
+    if MODEL_OPTIONS.get(model, {}).get("backend") != "ollama":
+        return
+    residency = _model_residency()
+    with residency["lock"]:
+        if model in residency["preloading"]:
+            return
+        residency["preloading"].add(model)
+    threading.Thread(target=preload_model, args=(model,), name=f"preload-{model}", daemon=True).start()
+
+
+def get_loaded_models() -> set:
+    """Names of the models Ollama currently holds in memory (briefly cached)."""
+    residency = _model_residency()
+    with residency["lock"]:
+        checked_at, loaded = residency["ps"]
+    if time.monotonic() - checked_at < OLLAMA_PS_TTL:
+        return loaded
+    import requests
+
+    try:
+        response = get_ollama_session().get(OLLAMA_PS_URL, timeout=2)
+        response.raise_for_status()
+        loaded = {entry.get("model") or entry.get("name") for entry in response.json().get("models", [])}
+    except (requests.exceptions.RequestException, ValueError):
+        loaded = set()
+    with residency["lock"]:
+        residency["ps"] = (time.monotonic(), loaded)
+    return loaded
+
+
+def get_model_residency(model: str) -> str:
+    """Return "warm", "loading" or "cold" for an Ollama model."""
+    loaded = get_loaded_models()
+    if model in loaded or f"{model}:latest" in loaded:
+        return "warm"
+    residency = _model_residency()
+    with residency["lock"]:
+        return "loading" if model in residency["preloading"] else "cold"
+
+
+@shared_resource
+def start_model_keeper() -> threading.Thread:
+    """Re-ping recently used Ollama models every OLLAMA_KEEPER_INTERVAL so they stay loaded."""
+    def keep_warm() -> None:
+        while True:
+            time.sleep(OLLAMA_KEEPER_INTERVAL)
+            residency = _model_residency()
+            now = time.monotonic()
+            with residency["lock"]:
+                active = [model for model, used in residency["last_used"].items() if now - used < OLLAMA_ACTIVE_WINDOW]
+            for model in active:
+                request_model_preload(model)
+
+    thread = threading.Thread(target=keep_warm, name="model-keeper", daemon=True)
+    thread.start()
+    return thread
+
+
+class BackendError(Exception):
+    """A backend call failed; the message is the inline "[Error ...]" text shown to the user.
+
+    `retryable` marks transient failures worth retrying; `retry_after` is the delay in
+    seconds the server asked for, if any.
+    """
+
+    def __init__(self, message: str, *, retryable: bool = False, retry_after: Optional[float] = None) -> None:
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+def _retry_after_seconds(response: Any) -> Optional[float]:
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _ollama_error(error: Exception) -> BackendError:
+    """Translate a failed Ollama call into a BackendError, flagging transient causes."""
+    import requests
+
+    if isinstance(error, requests.exceptions.HTTPError):
+        status = error.response.status_code if error.response is not None else 0
+        return BackendError(
+            f"[Ollama API error: {error}]",
+            retryable=status == 429 or status >= 500,
+            retry_after=_retry_after_seconds(error.response),
+        )
+    if isinstance(error, requests.exceptions.RequestException):
+        transient = (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+        )
+        return BackendError(
+            f"[Error connecting to Ollama: {error}. Make sure Ollama is running locally.]",
+            retryable=isinstance(error, transient),
+        )
+    return BackendError(f"[Ollama API error: {error}]")
+
+
+def _ollama_stream(
+    model: str,
+    prompt: str,
+    image: Optional[str] = None,
+    *,
+    history: Optional[List[Dict[str, str]]] = None,
+) -> Iterator[str]:
+    """Stream reply text from Ollama, raising BackendError when the call fails."""
+    session = get_ollama_session()
+    
+    # Use chat API for multi-turn history and for models like deepseek-ocr:3b
+    if history is not None or model in ["deepseek-ocr:3b"]:
+        # Build message with images if provided
+        message = {
+            "role": "user",
+            "content": prompt
+        }
+        
+        if image is not None:
+            encoded_image = prepare_image_payload(image, model)
+            message["images"] = [encoded_image]
+        
+        payload = {
+            "model": model,
+            "messages": [*(history or []), message],
+            "stream": True,
+            "keep_alive": ollama_keep_alive(model),
+        }
+        
+        try:
+            started = time.monotonic()
+            with session.post(OLLAMA_CHAT_URL, json=payload, stream=True, timeout=120) as response:
+                add_generation_timing("connect", time.monotonic() - started)
+                on_generation_cancel(lambda: abort_http_response(response))
+                response.raise_for_status()
+                
+                # Stream and yield only the assistant content
+                for data in iter_ndjson(response):
+                    # Extract content from message
+                    if "message" in data and "content" in data["message"]:
+                        content = data["message"]["content"]
+                        if content:
+                            yield content
+                
+        except Exception as e:
+            raise _ollama_error(e) from e
+    else:
+        # Use /api/generate for other models (llama3, deepseek-r1)
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "stream": True,
+            "keep_alive": ollama_keep_alive(model),
+        }
+
+        if image is not None:
+            encoded_image = prepare_image_payload(image, model)
+            payload["images"] = [encoded_image]
+
+        try:
+            started = time.monotonic()
+            with session.post(OLLAMA_API_URL, json=payload, stream=True, timeout=60) as resp:
+                add_generation_timing("connect", time.monotonic() - started)
+                on_generation_cancel(lambda: abort_http_response(resp))
+                resp.raise_for_status()
+                
+                for obj in iter_ndjson(resp):
+                    chunk_text = None
+                    if "message" in obj and isinstance(obj["message"], dict):
+                        chunk_text = obj["message"].get("content")
+                    elif "response" in obj:
+                        chunk_text = obj.get("response")
+                    
+                    if chunk_text:
+                        yield chunk_text
+        except Exception as e:
+            raise _ollama_error(e) from e
+
+
+def stream_generate(
+    model: str,
+    prompt: str,
+    image: Optional[str] = None,
+    *,
+    history: Optional[List[Dict[str, str]]] = None,
+):
+    """Stream generate response from Ollama API as a generator.
+
+    When `history` (role/content dicts, usually from `build_conversation_context`) is
+    given, the prompt is sent as the final user turn to /api/chat. `image` is a
+    reference returned by `store_image_blob`. Failures are yielded as inline error text.
+    """
+    try:
+        yield from _ollama_stream(model, prompt, image, history=history)
+    except BackendError as e:
+        yield str(e)
+
+
+@shared_resource
+def _groq_client_registry() -> Dict[str, Any]:
+    """Process-wide registry of OpenAI-compatible clients, shared across reruns and sessions."""
+    registry: Dict[str, Any] = {"lock": threading.Lock(), "clients": {}}
+    atexit.register(close_groq_clients, registry)
+    return registry
+
+
+def get_groq_client(base_url: str, api_key: str) -> Dict[str, Any]:
+    """Return the cached client entry for (base_url, api_key), building it on first use.
+
+    The entry holds the `client`; concurrency is capped by the backend scheduler. The
+    client never retries by itself (`_stream_with_retries` does, and honours Stop) and
+    its reads time out after GROQ_READ_TIMEOUT. Raises ImportError without openai.
+    """
+    registry = _groq_client_registry()
+    key = (base_url, hashlib.sha256(api_key.encode("utf-8")).hexdigest())
+    with registry["lock"]:
+        entry = registry["clients"].get(key)
+        if entry is None:
+            from openai import OpenAI, Timeout
+
+            entry = {"client": OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                max_retries=0,
+                timeout=Timeout(GROQ_READ_TIMEOUT, connect=GROQ_CONNECT_TIMEOUT),
+            )}
+            registry["clients"][key] = entry
+    return entry
+
+
+def close_groq_clients(registry: Optional[Dict[str, Any]] = None) -> None:
+    """Close every cached Groq/OpenAI client and release its connection pool."""
+    registry = registry or _groq_client_registry()
+    with registry["lock"]:
+        entries = list(registry["clients"].values())
+        registry["clients"].clear()
+    for entry in entries:
+        try:
+            entry["client"].close()
+        except Exception:
+            pass
+
+
+def _groq_stream(context: List[Dict[str, str]]) -> Iterator[str]:
+    """Stream reply text from the Groq/OpenAI-compatible Responses API, raising BackendError on failure."""
+    groq_api_key = get_secret_or_env("GROQ_API_KEY")
+    groq_base = get_secret_or_env("GROQ_BASE_URL") or GROQ_BASE_URL_DIRECT or "https://api.groq.com/openai/v1"
+    if not groq_api_key:
+        raise BackendError("[GROQ API key not found. Set `GROQ_API_KEY` in Streamlit secrets or environment variables.]")
+
+    response = None
+    try:
+        entry = get_groq_client(groq_base, groq_api_key)
+        
+        started = time.monotonic()
+        response = entry["client"].responses.create(
+            input=context,
+            model="openai/gpt-oss-120b",
+            stream=True
+        )
+        add_generation_timing("connect", time.monotonic() - started)
+        on_generation_cancel(response.close)
+        
+        for event in response:
+            if hasattr(event, "delta"):
+                delta = event.delta
+                if hasattr(delta, "text") and delta.text:
+                    yield delta.text
+                elif isinstance(delta, str):
+                    yield delta
+            elif isinstance(event, str):
+                yield event
+    except ImportError as e:
+        raise BackendError("[OpenAI SDK not installed. Install: pip install openai]") from e
+    except Exception as http_err:
+        status = getattr(http_err, "status_code", None) or 0
+        raise BackendError(
+            f"[Error calling Groq/OpenAI endpoint: {http_err}]",
+            retryable=(
+                type(http_err).__name__ in ("APIConnectionError", "APITimeoutError")
+                or status == 429
+                or status >= 500
+            ),
+            retry_after=_retry_after_seconds(getattr(http_err, "response", None)),
+        ) from http_err
+    finally:
+        if response is not None:
+            response.close()
+
+
+@shared_resource
+def _backend_health() -> Dict[str, Any]:
+    """Recent (finished_at, time_to_first_token) samples per model; a None TTFT is a failure."""
+    return {"lock": threading.Lock(), "samples": {}}
+
+
+def record_backend_result(model: str, ttft: Optional[float]) -> None:
+    """Record a call to `model`: its time to first token, or None if it failed."""
+    health = _backend_health()
+    with health["lock"]:
+        samples = health["samples"].setdefault(model, deque(maxlen=ROUTER_WINDOW))
+        samples.append((time.monotonic(), ttft))
+
+
+def get_backend_health(model: str) -> Dict[str, Any]:
+    """Summarize the rolling window for `model`: error rate, TTFT percentiles and health."""
+    health = _backend_health()
+    with health["lock"]:
+        samples = list(health["samples"].get(model, ()))
+    latencies = sorted(ttft for _, ttft in samples if ttft is not None)
+    failures = [finished for finished, ttft in samples if ttft is None]
+    error_rate = len(failures) / len(samples) if samples else 0.0
+    cooling_down = bool(failures) and time.monotonic() - failures[-1] < ROUTER_COOLDOWN_SECONDS
+    return {
+        "samples": len(samples),
+        "error_rate": error_rate,
+        "p50_ttft": latencies[len(latencies) // 2] if latencies else None,
+        "p95_ttft": latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] if latencies else None,
+        "healthy": not (cooling_down and error_rate >= ROUTER_MAX_ERROR_RATE),
+    }
+
+
+def route_candidates(model: str, mode: str, image: Optional[str] = None, *, failover: bool = True) -> List[str]:
+    """Return the models to try for a turn, in order.
+
+    An explicit model is followed by its `fallback` chain; AUTO_MODEL considers every
+    model configured for `mode`, fastest median TTFT first. Models that cannot take
+    the attached image are skipped, and unhealthy ones move to the back. With
+    `failover=False` only the first choice is returned.
+    """
+    def accepts_image(name: str) -> bool:
+        return image is None or "image_max_side" in MODEL_OPTIONS[name]
+
+    if model == AUTO_MODEL:
+        candidates = [
+            name for name, settings in MODEL_OPTIONS.items()
+            if mode in settings.get("modes", CHAT_MODES) and accepts_image(name)
+        ]
+        candidates.sort(key=lambda name: get_backend_health(name)["p50_ttft"] or ROUTER_DEFAULT_TTFT)
+    else:
+        chain: List[str] = []
+        name: Optional[str] = model
+        while name in MODEL_OPTIONS and name not in chain:
+            chain.append(name)
+            name = MODEL_OPTIONS[name].get("fallback")
+        candidates = [name for name in chain if name == model or accepts_image(name)]
+
+    if not failover:
+        return candidates[:1]
+    healthy = [name for name in candidates if get_backend_health(name)["healthy"]]
+    return healthy + [name for name in candidates if name not in healthy]
+
+
+def fit_context(context: List[Dict[str, str]], model: str) -> List[Dict[str, str]]:
+    """Re-trim a prepared context to `model`'s history budget."""
+    has_system = bool(context) and context[0]["role"] == "system"
+    return build_conversation_context(
+        context[1 if has_system else 0:-1],
+        context[-1]["content"],
+        instructions=context[0]["content"] if has_system else "",
+        model=model,
+    )
+
+
+def continuation_context(context: List[Dict[str, str]], partial: str, model: str) -> List[Dict[str, str]]:
+    """Build the request that resumes a cut-off answer from `model`.
+
+    The original question and the `partial` answer always go, followed by CONTINUE_PROMPT;
+    when the budget can't hold the whole partial answer only its tail is sent. Earlier
+    turns fill whatever room is left.
+    """
+    has_system = bool(context) and context[0]["role"] == "system"
+    instructions = context[0]["content"] if has_system else ""
+    question = context[-1]["content"]
+    fixed = estimate_tokens(instructions) + estimate_tokens(question) + estimate_tokens(CONTINUE_PROMPT)
+    room = context_budget(model) - fixed - 4 * MESSAGE_TOKEN_OVERHEAD
+    if estimate_tokens(partial) > room:
+        # Keep at least the overlap window so the seam can still be matched
+        partial = partial[-max(room * 4, CONTINUATION_OVERLAP_CHARS):]
+    reserve = estimate_tokens(partial) + estimate_tokens(CONTINUE_PROMPT) + 2 * MESSAGE_TOKEN_OVERHEAD
+    request = build_conversation_context(
+        context[1 if has_system else 0:-1],
+        question,
+        instructions=instructions,
+        model=model,
+        reserve=reserve,
+    )
+    return request + [
+        {"role": "assistant", "content": partial},
+        {"role": "user", "content": CONTINUE_PROMPT},
+    ]
+
+
+class BackendScheduler:
+    """Caps concurrent calls to one backend and hands free slots to sessions round-robin.
+
+    Each session has its own FIFO of waiting tickets; sessions take turns, so one
+    session sending many requests cannot starve the others. Low-priority generations
+    wait in a separate lane that is only served when no session is waiting, and never
+    with more than `capacity - 1` slots (so a user can always start); when a user does
+    have to queue, running low-priority calls are cancelled to make room.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.active = 0
+        self.granted = 0
+        self.lock = threading.Lock()
+        self.queues: "OrderedDict[str, deque]" = OrderedDict()
+        self.low_priority: deque = deque()
+        self.running_low_priority: List[Dict[str, Any]] = []
+        self.waits: deque = deque(maxlen=200)
+        self.wait_total = 0.0
+
+    def _low_priority_slot_free_locked(self) -> bool:
+        return self.capacity <= 0 or len(self.running_low_priority) < max(self.capacity - 1, 1)
+
+    def _grant_locked(self) -> None:
+        while self.capacity <= 0 or self.active < self.capacity:
+            if self.queues:
+                session_id, tickets = next(iter(self.queues.items()))
+                ticket = tickets.popleft()
+                if tickets:
+                    self.queues.move_to_end(session_id)
+                else:
+                    del self.queues[session_id]
+            elif self.low_priority and self._low_priority_slot_free_locked():
+                ticket = self.low_priority.popleft()
+                self.running_low_priority.append(ticket)
+            else:
+                break
+            self.active += 1
+            self.granted += 1
+            self.waits.append(time.monotonic() - ticket["enqueued_at"])
+            self.wait_total += self.waits[-1]
+            ticket["granted"].set()
+
+    def _position_locked(self, session_id: str, ticket: Dict[str, Any]) -> int:
+        """1-based place of `ticket` in round-robin service order."""
+        if ticket in self.low_priority:
+            return sum(len(tickets) for tickets in self.queues.values()) + self.low_priority.index(ticket) + 1
+        sessions = list(self.queues)
+        if session_id not in self.queues or ticket not in self.queues[session_id]:
+            return 1
+        depth = self.queues[session_id].index(ticket)
+        turn = sessions.index(session_id)
+        ahead = sum(
+            min(len(self.queues[other]), depth + (1 if idx < turn else 0))
+            for idx, other in enumerate(sessions)
+            if other != session_id
+        )
+        return ahead + depth + 1
+
+    def acquire(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Wait for a slot, publishing the queue position as generation status.
+
+        Returns the ticket to pass to `release`, or None if the generation was cancelled
+        while queued. Low-priority generations go to their own lane (see the class docs).
+        """
+        ticket = {
+            "granted": threading.Event(),
+            "enqueued_at": time.monotonic(),
+            "scope": _current_generation.get(),
+            "low_priority": generation_low_priority(),
+        }
+        preempted: List[Dict[str, Any]] = []
+        with self.lock:
+            if ticket["low_priority"]:
+                self.low_priority.append(ticket)
+            else:
+                self.queues.setdefault(session_id, deque()).append(ticket)
+            self._grant_locked()
+            if not ticket["granted"].is_set() and not ticket["low_priority"]:
+                preempted = list(self.running_low_priority)
+        for running in preempted:
+            if running["scope"] is not None:
+                running["scope"].cancel()
+        while not ticket["granted"].wait(STREAM_HEARTBEAT_INTERVAL):
+            with self.lock:
+                if generation_cancelled() and not ticket["granted"].is_set():
+                    if ticket["low_priority"]:
+                        self.low_priority.remove(ticket)
+                    else:
+                        self.queues[session_id].remove(ticket)
+                        if not self.queues[session_id]:
+                            del self.queues[session_id]
+                    return None
+                position = self._position_locked(session_id, ticket)
+            set_generation_status(f"Queued: position {position}")
+        set_generation_status(None)
+        return ticket
+
+    def release(self, ticket: Dict[str, Any]) -> None:
+        with self.lock:
+            self.active -= 1
+            if ticket["low_priority"]:
+                self.running_low_priority.remove(ticket)
+            self._grant_locked()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            waits = sorted(self.waits)
+            return {
+                "capacity": self.capacity,
+                "active": self.active,
+                "queued": sum(len(tickets) for tickets in self.queues.values()),
+                "low_priority_active": len(self.running_low_priority),
+                "low_priority_queued": len(self.low_priority),
+                "granted": self.granted,
+                "wait_total": self.wait_total,
+                "wait_p50": waits[len(waits) // 2] if waits else 0.0,
+                "wait_p95": waits[min(int(len(waits) * 0.95), len(waits) - 1)] if waits else 0.0,
+            }
+
+
+@shared_resource
+def get_backend_schedulers() -> Dict[str, BackendScheduler]:
+    """One process-wide scheduler per backend."""
+    return {backend: BackendScheduler(capacity) for backend, capacity in BACKEND_MAX_CONCURRENT_REQUESTS.items()}
+
+
+@shared_resource
+def _token_buckets() -> Dict[str, Any]:
+    return {"lock": threading.Lock(), "buckets": {}}
+
+
+def _refill_bucket_locked(session_id: str) -> Dict[str, float]:
+    now = time.monotonic()
+    bucket = _token_buckets()["buckets"].setdefault(session_id, {"tokens": float(USER_TOKENS_PER_MINUTE), "updated": now})
+    bucket["tokens"] = min(
+        float(USER_TOKENS_PER_MINUTE),
+        bucket["tokens"] + (now - bucket["updated"]) * USER_TOKENS_PER_MINUTE / 60.0,
+    )
+    bucket["updated"] = now
+    return bucket
+
+
+def wait_for_token_budget(session_id: str, cost: int) -> bool:
+    """Take `cost` tokens from the session's per-minute budget, waiting for refills.
+
+    Returns False if the generation is cancelled while waiting. A request larger than
+    the whole budget only waits for a full bucket.
+    """
+    if USER_TOKENS_PER_MINUTE <= 0:
+        return True
+    buckets = _token_buckets()
+    needed = min(cost, USER_TOKENS_PER_MINUTE)
+    while True:
+        with buckets["lock"]:
+            bucket = _refill_bucket_locked(session_id)
+            if bucket["tokens"] >= needed:
+                bucket["tokens"] -= cost
+                set_generation_status(None)
+                return True
+            wait = (needed - bucket["tokens"]) * 60.0 / USER_TOKENS_PER_MINUTE
+        if generation_cancelled():
+            return False
+        set_generation_status(f"Rate limited: your token budget refills in ~{wait:.0f}s")
+        time.sleep(min(wait, STREAM_HEARTBEAT_INTERVAL))
+
+
+def charge_tokens(session_id: str, cost: int) -> None:
+    """Charge reply tokens after the fact; the budget may go negative until it refills."""
+    if USER_TOKENS_PER_MINUTE <= 0:
+        return
+    buckets = _token_buckets()
+    with buckets["lock"]:
+        _refill_bucket_locked(session_id)["tokens"] -= cost
+
+
+def _backend_stream(context: List[Dict[str, str]], model: str, image: Optional[str]) -> Iterator[str]:
+    if MODEL_OPTIONS[model]["backend"] == "groq":
+        return _groq_stream(context)
+    return _ollama_stream(model, context[-1]["content"], image, history=context[:-1])
+
+
+def _strip_overlap(partial: str, continuation: str) -> str:
+    """Drop the start of `continuation` if it repeats the end of `partial`."""
+    for size in range(min(len(partial), len(continuation), CONTINUATION_OVERLAP_CHARS), 7, -1):
+        if partial.endswith(continuation[:size]):
+            return continuation[size:]
+    return continuation
+
+
+def _sleep_unless_cancelled(delay: float) -> bool:
+    deadline = time.monotonic() + delay
+    while time.monotonic() < deadline:
+        if generation_cancelled():
+            return False
+        time.sleep(min(STREAM_HEARTBEAT_INTERVAL, deadline - time.monotonic()))
+    return not generation_cancelled()
+
+
+def _stream_with_retries(
+    context: List[Dict[str, str]],
+    model: str,
+    image: Optional[str],
+    queue_key: str,
+) -> Iterator[str]:
+    """Stream `model`'s reply, retrying transient failures and resuming cut-off answers.
+
+    Each attempt takes its own scheduler slot. Retryable errors are retried up to
+    BACKEND_MAX_RETRIES times after a jittered exponential backoff (or the server's
+    Retry-After). If text had already streamed, the retry is a continuation built by
+    `continuation_context` (the question, the partial answer and CONTINUE_PROMPT), and
+    any repeated text at the seam is dropped. Raises BackendError once retries run out or
+    on a permanent error; returns quietly when the generation is cancelled.
+    """
+    scheduler = get_backend_schedulers()[MODEL_OPTIONS[model]["backend"]]
+    partial = ""
+    attempt = 0
+    # Health gets one sample per call: the first attempt's TTFT that produced text, or a
+    # failure only when retries give up, so a self-healed blip does not mark a model down
+    recorded = False
+    while True:
+        request = continuation_context(context, partial, model) if partial else fit_context(context, model)
+        waited = time.monotonic()
+        ticket = scheduler.acquire(queue_key)
+        add_generation_timing("queue", time.monotonic() - waited)
+        if ticket is None:
+            return
+        started = time.monotonic()
+        seam = "" if partial else None
+        try:
+            for chunk in _backend_stream(request, model, image):
+                if not recorded:
+                    recorded = True
+                    record_backend_result(model, time.monotonic() - started)
+                if seam is not None:
+                    seam += chunk
+                    if len(seam) < CONTINUATION_OVERLAP_CHARS:
+                        continue
+                    chunk, seam = _strip_overlap(partial, seam), None
+                partial += chunk
+                yield chunk
+            if seam:
+                chunk = _strip_overlap(partial, seam)
+                partial += chunk
+                yield chunk
+            if not recorded:
+                record_backend_result(model, time.monotonic() - started)
+            return
+        except BackendError as e:
+            if generation_cancelled():
+                return
+            if not e.retryable or attempt >= BACKEND_MAX_RETRIES:
+                record_backend_result(model, None)
+                raise
+            attempt += 1
+            delay = random.uniform(0, min(BACKEND_RETRY_MAX_DELAY, BACKEND_RETRY_BASE_DELAY * 2 ** attempt))
+            delay = max(delay, min(e.retry_after or 0.0, BACKEND_RETRY_MAX_DELAY))
+        finally:
+            scheduler.release(ticket)
+        set_generation_status(f"{model} failed; retrying in {delay:.1f}s (attempt {attempt + 1} of {BACKEND_MAX_RETRIES + 1})")
+        if not _sleep_unless_cancelled(delay):
+            return
+        set_generation_status(None)
+
+
+def dispatch_to_backend(
+    context: List[Dict[str, str]],
+    *,
+    mode: str,
+    model: str,
+    image: Optional[str] = None,
+    failover: bool = True,
+) -> Iterator[str]:
+    """Stream the reply to a prepared context (system, history, user prompt) from `model`.
+
+    Models are tried in `route_candidates` order, each through `_stream_with_retries`
+    (transient errors are retried, cut-off answers resumed). A model that still fails
+    before sending any text is skipped for the next, with the context refitted to its
+    budget; one that gives up mid-answer ends the reply with the error text. The model
+    that answered is noted on the current generation, and `failed=True` when the reply
+    ends in an error. With `failover=False` only `model` itself is tried.
+
+    The session's token budget is taken first, then each attempt takes a slot from its
+    backend's scheduler; while waiting, the queue position is published as status.
+    """
+    candidates = [name for name in route_candidates(model, mode, image, failover=failover) if "backend" in MODEL_OPTIONS[name]]
+    if not candidates:
+        yield from _stub_reply(context, mode=mode, model=model)
+        return
+
+    # Sessions spend their token budget up front; CLI and background jobs are exempt
+    session_id = current_session_id()
+    if session_id is not None:
+        prompt_tokens = sum(estimate_tokens(message["content"]) + MESSAGE_TOKEN_OVERHEAD for message in context)
+        waited = time.monotonic()
+        budget_ok = wait_for_token_budget(session_id, prompt_tokens)
+        add_generation_timing("queue", time.monotonic() - waited)
+        if not budget_ok:
+            return
+
+    reply_chars = 0
+    error: Optional[BackendError] = None
+    try:
+        for name in candidates:
+            answered = False
+            try:
+                for chunk in _stream_with_retries(context, name, image, session_id or "background"):
+                    if not answered:
+                        answered = True
+                        note_generation(model=name, **({"requested_model": model} if name != model else {}))
+                        if MODEL_OPTIONS[name]["backend"] == "ollama":
+                            mark_model_used(name)
+                    reply_chars += len(chunk)
+                    yield chunk
+            except BackendError as e:
+                if answered:
+                    note_generation(failed=True)
+                    yield f"\n\n{e}"
+                    return
+                error = e
+                continue
+            return
+        note_generation(failed=True)
+        yield str(error)
+    finally:
+        if session_id is not None:
+            charge_tokens(session_id, (reply_chars + 3) // 4)
+
+
+def _stub_reply(context: List[Dict[str, str]], *, mode: str, model: str) -> Iterator[str]:
+    """Friendly canned replies for models without a configured backend."""
+    user_prompt = context[-1]["content"]
+
+    # --------------------
+    # Mode-based helper behavior (existing helpful stubs)
+    # --------------------
+    if mode == "Generate Code":
+        yield (
+            f"Here's the code you requested! 🚀\n\n"
+            "```python\n"
+            "def solution(data):\n"
+            '    """Generated based on your requirements."""\n'
+            "    # Implementation goes here\n"
+            "    result = process(data)\n"
+            "    return result\n"
+            "```\n\n"
+            "**Key points:**\n"
+            "- Clean and readable structure\n"
+            "- Follows best practices\n"
+            "- Ready to customize\n\n"
+            "Would you like me to explain any part or make modifications?"
+        )
+        return
+
+    if mode == "Explain Code":
+        yield (
+            "Let me break this down for you! 📚\n\n"
+            "**Overview:**\n"
+            "The code you shared performs a specific operation with clear logic.\n\n"
+            "**Step-by-step explanation:**\n"
+            "1. **Input handling** - Validates and processes input data\n"
+            "2. **Core logic** - Performs the main computation\n"
+            "3. **Output** - Returns the processed result\n\n"
+            "**Complexity:** O(n) time, O(1) space\n\n"
+            "Any questions about specific parts?"
+        )
+        return
+
+    # Default fallback
+    yield (
+        f"Great question! Here's a friendly stub reply while the model call is not configured.\n\n"
+        f"Your input: \"{user_prompt[:100]}{'...' if len(user_prompt) > 100 else ''}\"\n\n"
+        f"Selected model: `{model}`\n"
+        "To enable live responses, set API keys in Streamlit `secrets.toml` or environment variables and install the SDKs."
+    )
@@ -0,0 +1,461 @@
+"""Reply caches and request coalescing.
+
+- The response cache keeps complete replies to deterministic (catalogue) prompts in
+  SQLite, shared by every process using the same data directory.
+- The semantic cache answers near-duplicate opening questions from local embeddings.
+- Coalescing lets identical requests in flight share one upstream generation.
+"""
+
+import atexit
+import contextvars
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from .backend import get_ollama_session
+from .config import (
+    AUTO_MODEL,
+    OLLAMA_EMBED_URL,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_PATH,
+    RESPONSE_CACHE_TTL,
+    RESPONSE_REPLAY_CHUNK_CHARS,
+    SEMANTIC_CACHE_EMBED_MODEL,
+    SEMANTIC_CACHE_MAX_ENTRIES,
+    SEMANTIC_CACHE_MAX_SCOPES,
+    STREAM_HEARTBEAT_INTERVAL,
+)
+from .generation import (
+    GenerationScope,
+    _current_generation,
+    current_session_id,
+    generation_cancelled,
+    generation_failed,
+    generation_meta,
+    note_generation,
+    set_generation_status,
+)
+from .prompts import estimate_tokens
+from .utils import open_sqlite, shared_resource
+
+if TYPE_CHECKING:
+    import numpy as np
+
+RESPONSE_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    response TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS responses_by_last_used ON responses(last_used);
+"""
+
+
+@shared_resource
+def get_response_cache() -> Dict[str, Any]:
+    """Process-wide response cache connection, its lock and hit/miss counters."""
+    conn = open_sqlite(RESPONSE_CACHE_PATH)
+    conn.executescript(RESPONSE_CACHE_SCHEMA)
+    atexit.register(conn.close)
+    return {"conn": conn, "lock": threading.RLock(), "hits": 0, "misses": 0}
+
+
+def response_cache_key(model: str, mode: str, context: List[Dict[str, str]]) -> str:
+    """Key a request by model, mode and its full whitespace-normalized context."""
+    normalized = [[message["role"], " ".join(message["content"].split())] for message in context]
+    payload = json.dumps([model, mode, normalized], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def get_cached_response(key: str) -> Optional[Dict[str, str]]:
+    """Return a fresh cached reply for `key` and mark it recently used, or None.
+
+    The reply is a dict with the `response` text and the `model` that wrote it.
+    """
+    cache = get_response_cache()
+    now = time.time()
+    with cache["lock"]:
+        row = cache["conn"].execute(
+            "SELECT response, model FROM responses WHERE key = ? AND created_at >= ?",
+            (key, now - RESPONSE_CACHE_TTL),
+        ).fetchone()
+        if row is None:
+            cache["misses"] += 1
+            return None
+        with cache["conn"]:
+            cache["conn"].execute(
+                "UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key)
+            )
+        cache["hits"] += 1
+    return {"response": row["response"], "model": row["model"]}
+
+
+def store_cached_response(key: str, model: str, mode: str, response: str) -> None:
+    """Cache a complete reply, then drop expired entries and the least recently used overflow."""
+    cache = get_response_cache()
+    now = time.time()
+    with cache["lock"], cache["conn"] as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO responses (key, model, mode, response, created_at, last_used)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (key, model, mode, response, now, now),
+        )
+        conn.execute("DELETE FROM responses WHERE created_at < ?", (now - RESPONSE_CACHE_TTL,))
+        conn.execute(
+            "DELETE FROM responses WHERE key IN ("
+            " SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (RESPONSE_CACHE_MAX_ENTRIES,),
+        )
+
+
+def has_cached_response(key: str) -> bool:
+    """Check for a fresh entry without touching hit statistics or recency."""
+    cache = get_response_cache()
+    with cache["lock"]:
+        row = cache["conn"].execute(
+            "SELECT 1 FROM responses WHERE key = ? AND created_at >= ?",
+            (key, time.time() - RESPONSE_CACHE_TTL),
+        ).fetchone()
+    return row is not None
+
+
+def get_response_cache_stats() -> Dict[str, Any]:
+    """Report cache size plus this process's hits, misses and hit rate."""
+    cache = get_response_cache()
+    with cache["lock"]:
+        row = cache["conn"].execute(
+            "SELECT COUNT(*) AS entries, COALESCE(SUM(hits), 0) AS lifetime_hits FROM responses"
+        ).fetchone()
+        hits, misses = cache["hits"], cache["misses"]
+    lookups = hits + misses
+    return {
+        "entries": row["entries"],
+        "lifetime_hits": row["lifetime_hits"],
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / lookups if lookups else 0.0,
+    }
+
+
+def answered_by_fallback(meta: Dict[str, Any]) -> bool:
+    """True when a generation's reply came from a fallback instead of the model asked for.
+
+    Caches are keyed by the requested model, so such replies must not be stored; models
+    routed to by AUTO_MODEL are what was asked for.
+    """
+    return meta.get("requested_model") not in (None, AUTO_MODEL)
+
+
+def cached_reply_meta(model: str, answered_by: str) -> Dict[str, str]:
+    """Generation metadata for a cached reply to `model` that `answered_by` wrote."""
+    return {"model": answered_by, **({"requested_model": model} if answered_by != model else {})}
+
+
+class SemanticIndex:
+    """Brute-force cosine index over unit-normalized prompt embeddings for one scope.
+
+    Vectors live in one float32 matrix, so a lookup is a single matrix-vector product.
+    The matrix starts small and doubles as entries arrive; past `max_entries`, the least
+    recently used entry is evicted.
+    """
+
+    INITIAL_CAPACITY = 16
+
+    def __init__(self, dim: int, max_entries: int) -> None:
+        import numpy as np
+
+        self.max_entries = max_entries
+        self.vectors = np.zeros((min(self.INITIAL_CAPACITY, max_entries), dim), dtype=np.float32)
+        self.entries: List[Dict[str, Any]] = []
+
+    def search(self, vector: "np.ndarray") -> tuple[Optional[Dict[str, Any]], float]:
+        """Return the most similar entry and its similarity (or None, 0.0 when empty)."""
+        if not self.entries:
+            return None, 0.0
+        scores = self.vectors[:len(self.entries)] @ vector
+        best = int(scores.argmax())
+        return self.entries[best], float(scores[best])
+
+    def add(self, vector: "np.ndarray", entry: Dict[str, Any]) -> None:
+        match, score = self.search(vector)
+        if match is not None and score >= 0.999:
+            # The same question answered again (e.g. by coalesced sessions); keep one copy
+            match.update(entry)
+            return
+        if len(self.entries) == len(self.vectors) < self.max_entries:
+            import numpy as np
+
+            grown = np.zeros((min(len(self.vectors) * 2, self.max_entries), self.vectors.shape[1]), dtype=np.float32)
+            grown[:len(self.vectors)] = self.vectors
+            self.vectors = grown
+        if len(self.entries) < len(self.vectors):
+            row = len(self.entries)
+            self.entries.append(entry)
+        else:
+            row = min(range(len(self.entries)), key=lambda idx: self.entries[idx]["last_used"])
+            self.entries[row] = entry
+        self.vectors[row] = vector
+
+
+@shared_resource
+def _semantic_cache() -> Dict[str, Any]:
+    """Process-wide semantic indexes keyed by scope (least recently used first), plus their counters."""
+    return {
+        "lock": threading.Lock(),
+        "indexes": OrderedDict(),
+        "hits": 0,
+        "misses": 0,
+        "tokens_saved": 0,
+        "embed_errors": 0,
+    }
+
+
+def embed_text(text: str) -> Optional["np.ndarray"]:
+    """Embed `text` with the local Ollama embedding model as a unit vector, or None on failure."""
+    import numpy as np
+    import requests
+
+    try:
+        response = get_ollama_session().post(
+            OLLAMA_EMBED_URL,
+            json={"model": SEMANTIC_CACHE_EMBED_MODEL, "input": text},
+            timeout=10,
+        )
+        response.raise_for_status()
+        vector = np.asarray(response.json()["embeddings"][0], dtype=np.float32)
+    except (requests.exceptions.RequestException, KeyError, IndexError, ValueError):
+        cache = _semantic_cache()
+        with cache["lock"]:
+            cache["embed_errors"] += 1
+        return None
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else None
+
+
+def semantic_scope(model: str, mode: str, instructions: str) -> str:
+    return f"{model}\x1f{mode}\x1f{hashlib.blake2b(instructions.encode('utf-8'), digest_size=8).hexdigest()}"
+
+
+def semantic_reply_stream(
+    prompt: str,
+    scope: str,
+    threshold: float,
+    chunks: Iterable[str],
+) -> Iterator[str]:
+    """Serve a cached answer to a question similar to `prompt`, or relay and index `chunks`.
+
+    Hits above `threshold` are replayed through the streaming renderer like exact-cache
+    hits, with the answering model noted again. When the embedding model is unavailable
+    the request simply goes to the backend. Only replies that finish without being
+    cancelled, failing or coming from a fallback model are indexed.
+    """
+    vector = embed_text(prompt)
+    if vector is None:
+        yield from chunks
+        return
+
+    cache = _semantic_cache()
+    with cache["lock"]:
+        index = cache["indexes"].get(scope)
+        if index is not None:
+            cache["indexes"].move_to_end(scope)
+        if index is not None and index.vectors.shape[1] != vector.shape[0]:
+            index = None  # embedding model changed; start over
+        entry, score = index.search(vector) if index is not None else (None, 0.0)
+        if entry is not None and score >= threshold:
+            entry["last_used"] = time.monotonic()
+            entry["hits"] += 1
+            cache["hits"] += 1
+            cache["tokens_saved"] += entry["tokens"]
+            cached = entry["response"]
+            note_generation(**entry["meta"])
+        else:
+            cache["misses"] += 1
+            cached = None
+
+    if cached is not None:
+        yield from replay_response(cached)
+        return
+
+    parts: List[str] = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    response = "".join(parts)
+    # Only complete answers: a cancelled stream ends quietly with whatever had arrived
+    meta = generation_meta()
+    if not response.strip() or generation_cancelled() or generation_failed() or answered_by_fallback(meta):
+        return
+    with cache["lock"]:
+        index = cache["indexes"].get(scope)
+        if index is None or index.vectors.shape[1] != vector.shape[0]:
+            index = cache["indexes"][scope] = SemanticIndex(vector.shape[0], SEMANTIC_CACHE_MAX_ENTRIES)
+            while len(cache["indexes"]) > max(SEMANTIC_CACHE_MAX_SCOPES, 1):
+                cache["indexes"].popitem(last=False)
+        cache["indexes"].move_to_end(scope)
+        index.add(vector, {
+            "prompt": prompt,
+            "response": response,
+            "tokens": estimate_tokens(response),
+            "meta": {field: meta[field] for field in ("model", "requested_model") if field in meta},
+            "last_used": time.monotonic(),
+            "hits": 0,
+        })
+
+
+def get_semantic_cache_stats() -> Dict[str, Any]:
+    """Report semantic cache size (entries, scopes), hits, misses, hit rate and estimated tokens saved."""
+    cache = _semantic_cache()
+    with cache["lock"]:
+        entries = sum(len(index.entries) for index in cache["indexes"].values())
+        scopes = len(cache["indexes"])
+        hits, misses = cache["hits"], cache["misses"]
+        tokens_saved, embed_errors = cache["tokens_saved"], cache["embed_errors"]
+    lookups = hits + misses
+    return {
+        "entries": entries,
+        "scopes": scopes,
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / lookups if lookups else 0.0,
+        "tokens_saved": tokens_saved,
+        "embed_errors": embed_errors,
+    }
+
+
+def replay_response(response: str) -> Iterator[str]:
+    """Yield a stored reply in RESPONSE_REPLAY_CHUNK_CHARS pieces for the streaming renderer."""
+    for start in range(0, len(response), RESPONSE_REPLAY_CHUNK_CHARS):
+        yield response[start:start + RESPONSE_REPLAY_CHUNK_CHARS]
+
+
+def cache_complete_response(key: str, model: str, mode: str, response: str) -> None:
+    """Store a finished reply to `model` in the response cache, with the model that wrote it.
+
+    Runs under the reply's generation; empty replies and fallback answers are skipped.
+    """
+    meta = generation_meta()
+    if response.strip() and not answered_by_fallback(meta):
+        store_cached_response(key, meta.get("model", model), mode, response)
+
+
+class Flight:
+    """One upstream generation whose output is shared by every subscriber."""
+
+    def __init__(self, key: str, session_id: Optional[str] = None) -> None:
+        self.key = key
+        self.chunks: List[str] = []
+        self.done = False
+        self.subscribers = 0
+        # Cancelled when the last subscriber leaves; backends register cleanup on it.
+        # The upstream call is charged to the session that started it
+        self.scope = GenerationScope(session_id)
+        self.condition = threading.Condition()
+
+
+@shared_resource
+def _flights() -> Dict[str, Any]:
+    """Process-wide registry of in-flight generations by request key."""
+    return {"lock": threading.Lock(), "flights": {}, "started": 0, "coalesced": 0}
+
+
+def _run_flight(flight: Flight, start: Callable[[], Iterable[str]], on_complete: Optional[Callable[[str], None]]) -> None:
+    registry = _flights()
+    _current_generation.set(flight.scope)
+    try:
+        for chunk in start():
+            if flight.scope.cancelled.is_set():
+                break
+            with flight.condition:
+                flight.chunks.append(chunk)
+                flight.condition.notify_all()
+    except Exception as e:
+        if not flight.scope.cancelled.is_set():
+            note_generation(failed=True)
+            with flight.condition:
+                flight.chunks.append(f"[Generation error: {e}]")
+    finally:
+        # Failed replies (the backend gave up, even mid-answer) are never passed on
+        if on_complete is not None and not flight.scope.cancelled.is_set() and not generation_failed():
+            try:
+                on_complete("".join(flight.chunks))
+            except Exception:
+                pass
+        with registry["lock"]:
+            if registry["flights"].get(flight.key) is flight:
+                del registry["flights"][flight.key]
+        with flight.condition:
+            flight.done = True
+            flight.condition.notify_all()
+
+
+def coalesced_stream(
+    key: str,
+    start: Callable[[], Iterable[str]],
+    *,
+    on_complete: Optional[Callable[[str], None]] = None,
+) -> Iterator[str]:
+    """Stream the reply for `key`, joining an identical generation already in flight.
+
+    The first caller starts `start()` on a flight thread; later callers with the same key
+    subscribe and receive everything produced so far, then the rest live. When every
+    subscriber has gone the upstream call is cancelled. `on_complete` gets the full text
+    of a flight that finished without being cancelled or failing (e.g. to fill the cache).
+    """
+    registry = _flights()
+    with registry["lock"]:
+        flight = registry["flights"].get(key)
+        leader = flight is None
+        if leader:
+            flight = registry["flights"][key] = Flight(key, current_session_id())
+            registry["started"] += 1
+        else:
+            registry["coalesced"] += 1
+        flight.subscribers += 1
+
+    if leader:
+        thread = threading.Thread(
+            target=contextvars.Context().run, args=(_run_flight, flight, start, on_complete),
+            name="flight", daemon=True,
+        )
+        thread.start()
+
+    position = 0
+    try:
+        while True:
+            with flight.condition:
+                while position == len(flight.chunks) and not flight.done:
+                    if generation_cancelled():
+                        return
+                    set_generation_status(flight.scope.status)
+                    flight.condition.wait(STREAM_HEARTBEAT_INTERVAL)
+                new_chunks = flight.chunks[position:]
+                done = flight.done
+            for chunk in new_chunks:
+                yield chunk
+            position += len(new_chunks)
+            if done:
+                note_generation(**flight.scope.meta)
+                return
+    finally:
+        with registry["lock"]:
+            flight.subscribers -= 1
+            abandoned = flight.subscribers == 0 and not flight.done
+            if abandoned and registry["flights"].get(key) is flight:
+                del registry["flights"][key]
+        if abandoned:
+            flight.scope.cancel()
+
+
+def get_coalescing_stats() -> Dict[str, int]:
+    """Upstream generations started, and requests that joined one already in flight."""
+    registry = _flights()
+    with registry["lock"]:
+        return {"started": registry["started"], "coalesced": registry["coalesced"], "in_flight": len(registry["flights"])}
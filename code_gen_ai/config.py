@@ -0,0 +1,156 @@
+"""Settings for the backends, caches and stores, mostly overridable from the environment.
+
+Values are read once at import, so set environment variables before importing the package.
+"""
+
+import importlib.util
+import os
+from typing import Any, Callable, Dict, Optional
+
+# Repository root: app data, the catalogues in data/ and static/ live next to app.py
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Fixed endpoints used when GROQ_BASE_URL is not set. API keys never go here: they come
+# from the environment or a registered secret source (e.g. Streamlit secrets).
+GROQ_BASE_URL_DIRECT = ""
+# Local Ollama server; point elsewhere (a remote box, the bench/ mock server) via env
+OLLAMA_BASE_URL = os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434").rstrip("/")
+OLLAMA_API_URL = f"{OLLAMA_BASE_URL}/api/generate"
+OLLAMA_EMBED_URL = f"{OLLAMA_BASE_URL}/api/embed"
+OLLAMA_PS_URL = f"{OLLAMA_BASE_URL}/api/ps"
+# Model residency: Ollama models used within ACTIVE_WINDOW are re-pinged every
+# KEEPER_INTERVAL so they stay loaded; /api/ps answers are reused for PS_TTL seconds
+OLLAMA_KEEPER_INTERVAL = float(os.environ.get("OLLAMA_KEEPER_INTERVAL", "120"))
+OLLAMA_ACTIVE_WINDOW = float(os.environ.get("OLLAMA_ACTIVE_WINDOW", "900"))
+OLLAMA_PS_TTL = 5.0
+
+# Audio processing is optional; check it is installed without importing it yet
+SPEECH_RECOGNITION_AVAILABLE = importlib.util.find_spec("speech_recognition") is not None
+
+CHAT_MODES = ["Chat", "Generate Code", "Explain Code"]
+# Per-model settings: `backend` serving it, `fallback` model tried when it fails,
+# the `modes` "auto" may pick it for, `context_tokens` (the history budget per turn)
+# and, for Ollama, `keep_alive` (how long the model stays loaded after a request)
+MODEL_OPTIONS: Dict[str, Dict[str, Any]] = {
+    "gpt-oss-120b": {"backend": "groq", "fallback": "llama3", "modes": CHAT_MODES, "context_tokens": 16000},
+    "llama3": {
+        "backend": "ollama", "fallback": "gpt-oss-120b", "modes": CHAT_MODES,
+        "context_tokens": 3000, "image_max_side": 1120, "keep_alive": "30m",
+    },
+    "deepseek-r1": {
+        "backend": "ollama", "fallback": "llama3", "modes": CHAT_MODES,
+        "context_tokens": 3000, "keep_alive": "15m",
+    },
+    "deepseek-ocr:3b": {
+        "backend": "ollama", "modes": ["Chat"], "context_tokens": 1500,
+        "image_max_side": 1024, "keep_alive": "5m",
+    },
+}
+DEFAULT_KEEP_ALIVE = "5m"
+DEFAULT_MODEL = next(iter(MODEL_OPTIONS))
+# Pseudo-model that routes each turn to the fastest healthy model for the mode
+AUTO_MODEL = "auto"
+# Router health window: recent calls kept per model, error rate that marks a model
+# unhealthy, how long it is skipped after its last error, and the assumed
+# time-to-first-token of a model without samples yet
+ROUTER_WINDOW = 20
+ROUTER_MAX_ERROR_RATE = 0.5
+ROUTER_COOLDOWN_SECONDS = 30.0
+ROUTER_DEFAULT_TTFT = 2.0
+DEFAULT_CONTEXT_TOKENS = 2000
+# Images sent to a model are downscaled to its `image_max_side` and re-encoded as JPEG
+DEFAULT_IMAGE_MAX_SIDE = 1024
+IMAGE_PAYLOAD_QUALITY = 85
+# Rough per-message cost of role markers and separators in chat templates
+MESSAGE_TOKEN_OVERHEAD = 4
+DEFAULT_SYSTEM_PROMPT = "You are ChatGPT, a large language model trained by OpenAI. You are helpful, creative, clever, and very friendly."
+# Waits on the backend (queues, shared flights, the streaming relay) wake this often,
+# so cancellation, Stop and reruns take effect
+STREAM_HEARTBEAT_INTERVAL = 0.25
+OLLAMA_CHAT_URL = f"{OLLAMA_BASE_URL}/api/chat"
+# Shared keep-alive pool for Ollama calls; raise POOL_MAXSIZE for many concurrent users
+OLLAMA_POOL_CONNECTIONS = int(os.environ.get("OLLAMA_POOL_CONNECTIONS", "4"))
+OLLAMA_POOL_MAXSIZE = int(os.environ.get("OLLAMA_POOL_MAXSIZE", "64"))
+# Process-wide caps on simultaneous calls per backend (0 = unlimited); waiting calls
+# are served round-robin across sessions
+BACKEND_MAX_CONCURRENT_REQUESTS = {
+    "ollama": int(os.environ.get("OLLAMA_MAX_CONCURRENT_REQUESTS", "2")),
+    "groq": int(os.environ.get("GROQ_MAX_CONCURRENT_REQUESTS", "8")),
+}
+# Transient backend failures (connection errors, timeouts, 429, 5xx) are retried this
+# many times with exponential backoff and full jitter; a stream cut off mid-answer is
+# resumed by asking the model to continue from the partial answer
+BACKEND_MAX_RETRIES = int(os.environ.get("BACKEND_MAX_RETRIES", "2"))
+BACKEND_RETRY_BASE_DELAY = 0.5
+BACKEND_RETRY_MAX_DELAY = 8.0
+# Groq/OpenAI client limits. The SDK's own retries are off so the retries above are the
+# only layer; a stream that sends nothing for GROQ_READ_TIMEOUT seconds fails (and is retried)
+GROQ_CONNECT_TIMEOUT = float(os.environ.get("GROQ_CONNECT_TIMEOUT", "5"))
+GROQ_READ_TIMEOUT = float(os.environ.get("GROQ_READ_TIMEOUT", "60"))
+CONTINUE_PROMPT = "Your previous answer was cut off. Continue exactly where it stopped, without repeating anything."
+# A resumed stream is buffered this long to drop text that repeats the partial answer
+CONTINUATION_OVERLAP_CHARS = 200
+# Per-session token budget (prompt + reply estimate) refilled per minute (0 = unlimited)
+USER_TOKENS_PER_MINUTE = int(os.environ.get("USER_TOKENS_PER_MINUTE", "40000"))
+
+# Durable app data (chat store etc.) lives in the project directory unless overridden
+APP_DATA_DIR = os.environ.get("CODEGEN_DATA_DIR", os.path.join(PROJECT_DIR, ".codegen_data"))
+CHAT_DB_PATH = os.path.join(APP_DATA_DIR, "chats.sqlite3")
+# Uploaded images, stored once per content digest
+IMAGE_BLOB_DIR = os.path.join(APP_DATA_DIR, "images")
+# Replies to deterministic (catalogue) prompts, reused across sessions
+RESPONSE_CACHE_PATH = os.path.join(APP_DATA_DIR, "response_cache.sqlite3")
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "2000"))
+# Cached replies are replayed through the streaming renderer in pieces of this size
+RESPONSE_REPLAY_CHUNK_CHARS = 256
+# Semantic cache: serve answers to near-duplicate first-turn questions, matched by
+# cosine similarity of local embeddings, scoped per mode/model/instructions
+SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE_ENABLED", "") == "1"
+SEMANTIC_CACHE_EMBED_MODEL = os.environ.get("SEMANTIC_CACHE_EMBED_MODEL", "nomic-embed-text")
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", "500"))
+# Scopes kept at once (each custom system prompt is one); the least recently used goes first
+SEMANTIC_CACHE_MAX_SCOPES = int(os.environ.get("SEMANTIC_CACHE_MAX_SCOPES", "32"))
+# Catalogue pre-warming: which models to fill, how many calls at once, and whether the
+# app server does it in the background once no reply has streamed for PREWARM_IDLE_SECONDS
+# (background jobs run at low priority: they leave a backend slot free and yield to users)
+PREWARM_MODELS = [name for name in os.environ.get("PREWARM_MODELS", "llama3,deepseek-r1").split(",") if name]
+PREWARM_CONCURRENCY = int(os.environ.get("PREWARM_CONCURRENCY", "2"))
+PREWARM_IN_BACKGROUND = os.environ.get("PREWARM_IN_BACKGROUND", "") == "1"
+PREWARM_IDLE_SECONDS = float(os.environ.get("PREWARM_IDLE_SECONDS", "30"))
+# Per-turn timings are exported in Prometheus text format: rewritten to METRICS_FILE after
+# every turn (e.g. for a node_exporter textfile collector; "" disables it) and, when
+# METRICS_PORT is set, served at http://127.0.0.1:METRICS_PORT/metrics
+METRICS_FILE = os.environ.get("METRICS_FILE", os.path.join(APP_DATA_DIR, "metrics.prom"))
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+TTFT_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TURN_DURATION_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# The learning features' catalogues (concepts, writing tasks, buggy snippets) are JSON
+# files in data/, read on first use by `load_catalogue`
+CATALOGUE_DIR = os.path.join(PROJECT_DIR, "data")
+
+# Extra places `get_secret_or_env` looks after the environment, by name (the Streamlit
+# frontend registers st.secrets); each lookup returns None for unknown keys
+_SECRET_SOURCES: Dict[str, Callable[[str], Optional[str]]] = {}
+
+
+def register_secret_source(name: str, lookup: Callable[[str], Optional[str]]) -> None:
+    """Add (or replace) a named secret lookup consulted after environment variables."""
+    _SECRET_SOURCES[name] = lookup
+
+
+def get_secret_or_env(key: str) -> Optional[str]:
+    """Fetch a secret from environment first, then the registered secret sources (safely)."""
+    env_val = os.environ.get(key)
+    if env_val:
+        return env_val
+    for lookup in list(_SECRET_SOURCES.values()):
+        try:
+            value = lookup(key)
+        except Exception:
+            continue
+        if value:
+            return value
+    return None
@@ -0,0 +1,192 @@
+"""Generation scopes: cancellation, status and metadata for one streamed reply.
+
+Backend code reports to the scope of the reply it is producing through the
+`_current_generation` context variable, so the same code serves the Streamlit app,
+workers and batch jobs.
+"""
+
+import contextvars
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from .config import STREAM_HEARTBEAT_INTERVAL
+from .utils import shared_resource
+
+
+class GenerationScope:
+    """Cancellation handle for one streamed reply.
+
+    Backends register cleanup callbacks (usually closing the HTTP response) with
+    `on_generation_cancel`; `cancel()` runs them once, from whichever thread calls it.
+    `session_id` names the user or job the reply is for; calls from the same session share
+    a token budget and a place in the backend queues (None: exempt, e.g. CLI jobs).
+    `low_priority` work (background pre-warming) only gets backend slots no user is
+    waiting for, and is cancelled when a user request has to queue behind it.
+    """
+
+    def __init__(self, session_id: Optional[str] = None, *, low_priority: bool = False) -> None:
+        self.session_id = session_id
+        self.low_priority = low_priority
+        self.cancelled = threading.Event()
+        self.received: List[str] = []
+        # Facts about the reply (e.g. which model answered), saved with the message
+        self.meta: Dict[str, Any] = {}
+        # What the reply is waiting on before its first token (queue position etc.)
+        self.status: Optional[str] = None
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def on_cancel(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            if not self.cancelled.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def cancel(self) -> None:
+        with self._lock:
+            if self.cancelled.is_set():
+                return
+            self.cancelled.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+
+_current_generation: contextvars.ContextVar[Optional[GenerationScope]] = contextvars.ContextVar(
+    "current_generation", default=None
+)
+
+
+def on_generation_cancel(callback: Callable[[], None]) -> None:
+    """Run `callback` if the generation driving the current backend call is cancelled."""
+    scope = _current_generation.get()
+    if scope is not None:
+        scope.on_cancel(callback)
+
+
+def note_generation(**fields: Any) -> None:
+    """Attach metadata to the reply being generated in this context."""
+    scope = _current_generation.get()
+    if scope is not None:
+        scope.meta.update(fields)
+
+
+def add_generation_timing(phase: str, seconds: float) -> None:
+    """Add time spent in a backend phase ("queue", "connect") to the current generation."""
+    scope = _current_generation.get()
+    if scope is not None:
+        timings = scope.meta.setdefault("timings", {})
+        timings[phase] = timings.get(phase, 0.0) + seconds
+
+
+def set_generation_status(status: Optional[str]) -> None:
+    """Describe what the current generation is waiting for (None clears it)."""
+    scope = _current_generation.get()
+    if scope is not None:
+        scope.status = status
+
+
+def generation_cancelled() -> bool:
+    scope = _current_generation.get()
+    return scope is not None and scope.cancelled.is_set()
+
+
+def generation_low_priority() -> bool:
+    scope = _current_generation.get()
+    return scope is not None and scope.low_priority
+
+
+def generation_meta() -> Dict[str, Any]:
+    """A copy of what has been noted on the current generation so far."""
+    scope = _current_generation.get()
+    return dict(scope.meta) if scope is not None else {}
+
+
+def generation_failed() -> bool:
+    """True when the current reply ended in a backend error (noted as `failed=True`)."""
+    scope = _current_generation.get()
+    return scope is not None and bool(scope.meta.get("failed"))
+
+
+_STREAM_DONE = object()
+
+
+@shared_resource
+def _generation_activity() -> Dict[str, Any]:
+    """How many replies are streaming right now, and when the last one ended."""
+    return {"lock": threading.Lock(), "active": 0, "last_active": time.monotonic()}
+
+
+def is_generation_idle(idle_seconds: float) -> bool:
+    """True when no reply is streaming and none has for `idle_seconds`."""
+    activity = _generation_activity()
+    with activity["lock"]:
+        return activity["active"] == 0 and time.monotonic() - activity["last_active"] >= idle_seconds
+
+
+def stream_in_background(chunks: Iterable[str], scope: GenerationScope) -> Iterator[str]:
+    """Drive a backend chunk generator on a worker thread and relay its output.
+
+    The calling thread only waits on a queue, waking every STREAM_HEARTBEAT_INTERVAL
+    (yielding "") so a Streamlit script run can be interrupted. When this generator is closed before
+    the backend finishes, `scope` is cancelled: the upstream request is aborted and the
+    worker exits instead of reading tokens nobody will see.
+    """
+    relay: "queue.Queue[Any]" = queue.Queue()
+
+    def worker() -> None:
+        _current_generation.set(scope)
+        try:
+            for chunk in chunks:
+                if scope.cancelled.is_set():
+                    break
+                relay.put(chunk)
+        except Exception as e:
+            if not scope.cancelled.is_set():
+                scope.meta["failed"] = True
+                relay.put(f"[Generation error: {e}]")
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                try:
+                    close()
+                except Exception:
+                    pass
+            relay.put(_STREAM_DONE)
+
+    thread = threading.Thread(target=contextvars.Context().run, args=(worker,), name="generation", daemon=True)
+    activity = _generation_activity()
+    with activity["lock"]:
+        activity["active"] += 1
+    thread.start()
+    finished = False
+    try:
+        while True:
+            try:
+                item = relay.get(timeout=STREAM_HEARTBEAT_INTERVAL)
+            except queue.Empty:
+                yield ""
+                continue
+            if item is _STREAM_DONE:
+                finished = True
+                return
+            scope.received.append(item)
+            yield item
+    finally:
+        if not finished:
+            scope.cancel()
+        with activity["lock"]:
+            activity["active"] -= 1
+            activity["last_active"] = time.monotonic()
+
+
+def current_session_id() -> Optional[str]:
+    """The session the current generation is for, or None for CLI/background jobs."""
+    scope = _current_generation.get()
+    return scope.session_id if scope is not None else None
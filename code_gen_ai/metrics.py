@@ -0,0 +1,216 @@
+"""Per-turn timings and backend queue state, exported in the Prometheus text format."""
+
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from .backend import get_backend_schedulers, get_ollama_transport_stats
+from .config import METRICS_FILE, METRICS_PORT, TTFT_BUCKETS, TURN_DURATION_BUCKETS
+from .prompts import estimate_tokens
+from .utils import shared_resource
+
+if TYPE_CHECKING:
+    import http.server
+
+
+def turn_timings(response: str, stats: Dict[str, float], backend: Dict[str, float], total: float) -> Dict[str, float]:
+    """Per-turn timings saved with the reply: backend phases plus what the UI measured.
+
+    Tokens are estimated from the text; tokens/s covers the span from the first token
+    to the end of the stream.
+    """
+    tokens = estimate_tokens(response)
+    ttft = stats.get("ttft", total)
+    timings = {phase: round(seconds, 4) for phase, seconds in backend.items()}
+    timings.update(
+        ttft=round(ttft, 4),
+        total=round(total, 4),
+        render=round(stats.get("render", 0.0), 4),
+        chunks=int(stats.get("chunks", 0)),
+        tokens=tokens,
+        tokens_per_s=round(tokens / (total - ttft), 1) if total > ttft else 0.0,
+    )
+    return timings
+
+
+def format_turn_timings(timings: Dict[str, float]) -> str:
+    """One-line debug overlay for a reply's timings."""
+    parts = [f"{phase} {timings[phase]:.2f}s" for phase in ("queue", "connect") if phase in timings]
+    parts += [
+        f"TTFT {timings.get('ttft', 0.0):.2f}s",
+        f"{timings.get('tokens_per_s', 0.0):.0f} tok/s",
+        f"total {timings.get('total', 0.0):.2f}s",
+        f"render {timings.get('render', 0.0):.2f}s ({timings.get('chunks', 0)} chunks)",
+    ]
+    return "⏱ " + " · ".join(parts)
+
+
+@shared_resource
+def _turn_metrics() -> Dict[str, Any]:
+    """Process-wide turn timings aggregated per (model, mode) for the metrics export."""
+    return {"lock": threading.Lock(), "series": {}}
+
+
+def record_turn_metrics(model: str, mode: str, timings: Dict[str, float]) -> None:
+    """Fold one finished turn into the aggregates and rewrite METRICS_FILE."""
+    metrics = _turn_metrics()
+    with metrics["lock"]:
+        series = metrics["series"].setdefault(
+            (model, mode),
+            {
+                "turns": 0,
+                "ttft": [0] * len(TTFT_BUCKETS),
+                "ttft_sum": 0.0,
+                "total": [0] * len(TURN_DURATION_BUCKETS),
+                "total_sum": 0.0,
+                "queue": 0.0,
+                "connect": 0.0,
+                "render": 0.0,
+                "generation": 0.0,
+                "tokens": 0,
+                "chunks": 0,
+            },
+        )
+        series["turns"] += 1
+        for histogram, buckets in (("ttft", TTFT_BUCKETS), ("total", TURN_DURATION_BUCKETS)):
+            value = timings[histogram]
+            series[f"{histogram}_sum"] += value
+            for idx, bound in enumerate(buckets):
+                if value <= bound:
+                    series[histogram][idx] += 1
+        for phase in ("queue", "connect", "render"):
+            series[phase] += timings.get(phase, 0.0)
+        series["generation"] += max(timings["total"] - timings["ttft"], 0.0)
+        series["tokens"] += timings["tokens"]
+        series["chunks"] += timings["chunks"]
+    write_metrics_file()
+
+
+def _metric_labels(model: str, mode: str, **extra: str) -> str:
+    return _labels(model=model, mode=mode, **extra)
+
+
+def _labels(**labels: str) -> str:
+    escaped = (
+        value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def render_prometheus_metrics() -> str:
+    """Turn timings and backend scheduler state in the Prometheus text exposition format."""
+    metrics = _turn_metrics()
+    with metrics["lock"]:
+        series = {
+            key: {**values, "ttft": list(values["ttft"]), "total": list(values["total"])}
+            for key, values in metrics["series"].items()
+        }
+
+    lines: List[str] = []
+
+    def header(name: str, kind: str, help_text: str) -> None:
+        lines.append(f"# HELP codegen_{name} {help_text}")
+        lines.append(f"# TYPE codegen_{name} {kind}")
+
+    header("turns_total", "counter", "Assistant replies streamed to completion.")
+    for (model, mode), values in series.items():
+        lines.append(f"codegen_turns_total{_metric_labels(model, mode)} {values['turns']}")
+    for histogram, name, buckets, help_text in (
+        ("ttft", "time_to_first_token_seconds", TTFT_BUCKETS, "Time from sending a turn to its first token."),
+        ("total", "turn_duration_seconds", TURN_DURATION_BUCKETS, "Time from sending a turn to the end of its reply."),
+    ):
+        header(name, "histogram", help_text)
+        for (model, mode), values in series.items():
+            for bound, count in zip(buckets, values[histogram]):
+                lines.append(f"codegen_{name}_bucket{_metric_labels(model, mode, le=str(bound))} {count}")
+            lines.append(f"codegen_{name}_bucket{_metric_labels(model, mode, le='+Inf')} {values['turns']}")
+            lines.append(f"codegen_{name}_sum{_metric_labels(model, mode)} {values[histogram + '_sum']:.6f}")
+            lines.append(f"codegen_{name}_count{_metric_labels(model, mode)} {values['turns']}")
+    for key, name, help_text in (
+        ("queue", "queue_wait_seconds_total", "Time spent waiting for a token budget or backend slot."),
+        ("connect", "connect_seconds_total", "Time from sending a backend request to its response headers."),
+        ("generation", "generation_seconds_total", "Time from the first token to the end of the reply."),
+        ("render", "render_seconds_total", "Time spent drawing streamed text in the UI."),
+        ("tokens", "output_tokens_total", "Estimated reply tokens (divide by generation seconds for tokens/s)."),
+        ("chunks", "stream_chunks_total", "Text chunks received from the backend."),
+    ):
+        header(name, "counter", help_text)
+        for (model, mode), values in series.items():
+            value = values[key]
+            value = f"{value:.6f}" if isinstance(value, float) else value
+            lines.append(f"codegen_{name}{_metric_labels(model, mode)} {value}")
+
+    # Backend queues, read live: the file export shows them as of the last finished turn
+    schedulers = {backend: scheduler.stats() for backend, scheduler in get_backend_schedulers().items()}
+    for key, name, help_text in (
+        ("capacity", "backend_capacity", "Concurrent calls allowed per backend (0 = unlimited)."),
+        ("active", "backend_active", "Backend calls holding a slot right now."),
+        ("queued", "backend_queue_length", "User calls waiting for a backend slot."),
+        ("low_priority_active", "backend_low_priority_active", "Background calls holding a slot."),
+        ("low_priority_queued", "backend_low_priority_queue_length", "Background calls waiting for a slot."),
+    ):
+        header(name, "gauge", help_text)
+        for backend, load in schedulers.items():
+            lines.append(f"codegen_{name}{_labels(backend=backend)} {load[key]}")
+    header("backend_slot_wait_seconds", "summary", "Time calls waited for a backend slot (quantiles over the last 200).")
+    for backend, load in schedulers.items():
+        for quantile, key in (("0.5", "wait_p50"), ("0.95", "wait_p95")):
+            lines.append(f"codegen_backend_slot_wait_seconds{_labels(backend=backend, quantile=quantile)} {load[key]:.6f}")
+        lines.append(f"codegen_backend_slot_wait_seconds_sum{_labels(backend=backend)} {load['wait_total']:.6f}")
+        lines.append(f"codegen_backend_slot_wait_seconds_count{_labels(backend=backend)} {load['granted']}")
+
+    transport = get_ollama_transport_stats()
+    for key, name, kind, help_text in (
+        ("pools", "ollama_pools", "gauge", "Connection pools in the shared Ollama session."),
+        ("connections_opened", "ollama_connections_opened_total", "counter", "Sockets opened to Ollama."),
+        ("requests", "ollama_requests_total", "counter", "HTTP requests sent to Ollama."),
+        ("connections_reused", "ollama_connections_reused_total", "counter", "Ollama requests sent on an already-open socket."),
+    ):
+        header(name, kind, help_text)
+        lines.append(f"codegen_{name} {transport[key]}")
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics_file() -> None:
+    """Atomically replace METRICS_FILE with the current metrics (best effort)."""
+    if not METRICS_FILE:
+        return
+    try:
+        os.makedirs(os.path.dirname(METRICS_FILE) or ".", exist_ok=True)
+        tmp_path = f"{METRICS_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            handle.write(render_prometheus_metrics())
+        os.replace(tmp_path, METRICS_FILE)
+    except OSError:
+        pass
+
+
+@shared_resource
+def start_metrics_server() -> Optional["http.server.ThreadingHTTPServer"]:
+    """Serve /metrics on localhost:METRICS_PORT from a daemon thread (None if disabled or taken)."""
+    if METRICS_PORT <= 0:
+        return None
+    import http.server
+
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render_prometheus_metrics().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    try:
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", METRICS_PORT), MetricsHandler)
+    except OSError:
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
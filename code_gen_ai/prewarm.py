@@ -0,0 +1,130 @@
+"""Catalogue pre-warming: fill the response cache with replies to every catalogue prompt."""
+
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+from .backend import dispatch_to_backend
+from .cache import has_cached_response, response_cache_key, store_cached_response
+from .config import (
+    CHAT_MODES,
+    DEFAULT_SYSTEM_PROMPT,
+    MODEL_OPTIONS,
+    PREWARM_CONCURRENCY,
+    PREWARM_IDLE_SECONDS,
+    PREWARM_MODELS,
+)
+from .generation import GenerationScope, _current_generation, is_generation_idle
+from .prompts import build_conversation_context, get_mode_instructions, iter_catalogue_prompts, summarize_title
+from .utils import shared_resource
+
+
+def prewarm_response(
+    prompt: str,
+    *,
+    model: str,
+    mode: str,
+    system_prompt: str = DEFAULT_SYSTEM_PROMPT,
+    low_priority: bool = False,
+) -> str:
+    """Make sure the response cache holds a reply to one catalogue prompt.
+
+    Returns "cached" if it already did, "generated" after a successful model call and
+    "failed" when the backend gave up (nothing is stored then). A `low_priority` call
+    yields its backend slot to users and returns "preempted" when it had to.
+    """
+    context = build_conversation_context(
+        [], prompt, instructions=get_mode_instructions(mode, system_prompt), model=model
+    )
+    key = response_cache_key(model, mode, context)
+    if has_cached_response(key):
+        return "cached"
+    scope = GenerationScope(low_priority=low_priority)
+    token = _current_generation.set(scope)
+    try:
+        # Cached under `model`, so no other model may answer for it
+        response = "".join(dispatch_to_backend(context, mode=mode, model=model, failover=False))
+    finally:
+        _current_generation.reset(token)
+    if scope.cancelled.is_set():
+        return "preempted"
+    if not response.strip() or scope.meta.get("failed"):
+        return "failed"
+    store_cached_response(key, model, mode, response)
+    return "generated"
+
+
+def prewarm_catalogue(
+    models: Iterable[str],
+    modes: Iterable[str],
+    *,
+    concurrency: int = PREWARM_CONCURRENCY,
+    idle_seconds: Optional[float] = None,
+    progress: Optional[Callable[[str, str, str, str], None]] = None,
+) -> Dict[str, int]:
+    """Generate cached replies for every catalogue prompt per model and mode.
+
+    At most `concurrency` model calls run at once. With `idle_seconds`, each call
+    first waits until no user reply has streamed for that long and runs at low priority:
+    it never takes the backend's last free slot, and a user request that has to queue
+    cancels it, after which it waits for the next idle period and starts over.
+    `progress(model, mode, prompt, outcome)` is called after every job. Returns outcome
+    counts.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    jobs = [(model, mode, prompt) for model in models for mode in modes for prompt in iter_catalogue_prompts()]
+    counts = {"cached": 0, "generated": 0, "failed": 0}
+
+    def run(model: str, mode: str, prompt: str) -> str:
+        while True:
+            if idle_seconds is not None:
+                while not is_generation_idle(idle_seconds):
+                    time.sleep(1.0)
+            try:
+                outcome = prewarm_response(prompt, model=model, mode=mode, low_priority=idle_seconds is not None)
+            except Exception:
+                return "failed"
+            if outcome != "preempted":
+                return outcome
+
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1), thread_name_prefix="prewarm") as pool:
+        futures = {pool.submit(run, *job): job for job in jobs}
+        for future in as_completed(futures):
+            outcome = future.result()
+            counts[outcome] += 1
+            if progress is not None:
+                progress(*futures[future], outcome)
+    return counts
+
+
+@shared_resource
+def start_background_prewarm() -> threading.Thread:
+    """Pre-warm the catalogue once per server process, during idle time."""
+    thread = threading.Thread(
+        target=prewarm_catalogue,
+        args=(PREWARM_MODELS, CHAT_MODES[:1]),
+        kwargs={"idle_seconds": PREWARM_IDLE_SECONDS},
+        name="prewarm",
+        daemon=True,
+    )
+    thread.start()
+    return thread
+
+
+def run_prewarm_cli(argv: List[str]) -> int:
+    """`python -m code_gen_ai prewarm`: fill the response cache before the app takes traffic."""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m code_gen_ai prewarm", description=run_prewarm_cli.__doc__)
+    parser.add_argument("--models", nargs="+", default=PREWARM_MODELS, choices=list(MODEL_OPTIONS))
+    parser.add_argument("--modes", nargs="+", default=CHAT_MODES[:1], choices=CHAT_MODES)
+    parser.add_argument("--concurrency", type=int, default=PREWARM_CONCURRENCY)
+    args = parser.parse_args(argv)
+
+    def report(model: str, mode: str, prompt: str, outcome: str) -> None:
+        print(f"{outcome:>9}  {model:<14} {mode:<13} {summarize_title(prompt)}", flush=True)
+
+    counts = prewarm_catalogue(args.models, args.modes, concurrency=args.concurrency, progress=report)
+    print(f"done: {counts['generated']} generated, {counts['cached']} already cached, {counts['failed']} failed")
+    return 1 if counts["failed"] else 0
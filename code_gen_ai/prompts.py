@@ -0,0 +1,134 @@
+"""Prompt building: the learning catalogues and their prompts, mode instructions and chat context."""
+
+import functools
+import json
+import os
+from typing import Any, Dict, Iterator, List
+
+from .config import AUTO_MODEL, CATALOGUE_DIR, DEFAULT_CONTEXT_TOKENS, MESSAGE_TOKEN_OVERHEAD, MODEL_OPTIONS
+
+
+@functools.lru_cache(maxsize=None)
+def load_catalogue(name: str) -> Any:
+    """Read data/<name>.json once per process; callers must treat the result as read-only."""
+    with open(os.path.join(CATALOGUE_DIR, f"{name}.json"), encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+def generate_concept_prompt(concept: dict, difficulty: str) -> str:
+    """Generate a prompt for the AI to explain a concept."""
+    return f"""Explain the concept of "{concept['topic']}" from the category "{concept['category']}" at a {difficulty} level.
+
+Please provide:
+1. **Simple Explanation** (2-3 sentences for beginners)
+2. **Structured Explanation** (detailed breakdown with key points)
+3. **Real-World Analogy** (relatable comparison)
+4. **Interview Question** (one common interview question on this topic with a brief answer)
+
+Make sure to adjust the complexity based on the {difficulty} level."""
+
+
+def generate_writing_prompt(task: dict, tone: str) -> str:
+    """Generate a prompt for the AI to create writing content."""
+    return f"""Generate a {tone.lower()} {task['type'].lower()} with the following task:
+
+"{task['prompt']}"
+
+Please create a complete, well-written piece that matches the {tone.lower()} tone. Include proper formatting and structure appropriate for a {task['type']}."""
+
+
+def generate_bug_prompt(bug: dict) -> str:
+    """Generate a prompt for the bug debugger feature."""
+    return f"""I'm practicing debugging! Here's a buggy {bug['language']} code snippet:
+
+**Bug Title:** {bug['title']}
+
+```{bug['language']}
+{bug['buggy_code']}
+```
+
+Please analyze this code and provide:
+1. **What's wrong?** - Identify the bug
+2. **Fixed Code** - Show the corrected version
+3. **Explanation** - Why did this bug occur?
+4. **Prevention Tips** - How to avoid this in the future
+
+Help me understand this debugging challenge!"""
+
+
+def iter_catalogue_prompts() -> Iterator[str]:
+    """Yield every prompt the learning features can send, for all difficulties and tones."""
+    for difficulty, concepts in load_catalogue("concepts").items():
+        for concept in concepts:
+            yield generate_concept_prompt(concept, difficulty)
+    for tone, tasks in load_catalogue("writing_tasks").items():
+        for task in tasks:
+            yield generate_writing_prompt(task, tone)
+    for bug in load_catalogue("buggy_code"):
+        yield generate_bug_prompt(bug)
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap local token estimate (about four characters per token for prose and code)."""
+    return (len(text) + 3) // 4
+
+
+def context_budget(model: str) -> int:
+    """Token budget for the messages sent to `model` (its `context_tokens` in MODEL_OPTIONS)."""
+    if model == AUTO_MODEL:
+        # Routed per turn; keep the most any model could take and refit after routing
+        return max(settings["context_tokens"] for settings in MODEL_OPTIONS.values())
+    return MODEL_OPTIONS.get(model, {}).get("context_tokens", DEFAULT_CONTEXT_TOKENS)
+
+
+def build_conversation_context(
+    history: List[Dict[str, Any]],
+    prompt: str,
+    *,
+    instructions: str,
+    model: str,
+    reserve: int = 0,
+) -> List[Dict[str, str]]:
+    """Build the role/content messages sent to chat-style backends.
+
+    Returns the instructions as a system message, a sliding window of the most recent
+    turns from `history`, and `prompt` as the final user message. Older turns are dropped
+    once the model's `context_tokens` budget in MODEL_OPTIONS would be exceeded; `reserve`
+    tokens are held back for messages the caller appends after the prompt.
+    """
+    budget = context_budget(model)
+    used = estimate_tokens(instructions) + estimate_tokens(prompt) + 2 * MESSAGE_TOKEN_OVERHEAD + reserve
+
+    window: List[Dict[str, str]] = []
+    for message in reversed(history):
+        role = message.get("role")
+        content = message.get("content", "")
+        if role not in ("user", "assistant") or not content:
+            continue
+        used += estimate_tokens(content) + MESSAGE_TOKEN_OVERHEAD
+        if used > budget:
+            break
+        window.append({"role": role, "content": content})
+    window.reverse()
+
+    # Don't open the window on a reply whose question was cut off
+    while window and window[0]["role"] == "assistant":
+        window.pop(0)
+
+    context = [{"role": "system", "content": instructions}] if instructions else []
+    return context + window + [{"role": "user", "content": prompt}]
+
+
+def summarize_title(prompt: str) -> str:
+    """Generate a short title from the first user message."""
+    condensed = prompt.strip().splitlines()[0][:40]
+    return condensed + ("…" if len(prompt.strip()) > len(condensed) else "") or "New chat"
+
+
+def get_mode_instructions(mode: str, system_prompt: str) -> str:
+    """Return the system instructions used for `mode`."""
+    if mode == "Generate Code":
+        return "You are a code generation assistant. Generate clean, efficient, and well-commented code based on the user's request. Always include code examples in your response."
+    if mode == "Explain Code":
+        return "You are a code explanation assistant. Provide clear, detailed explanations of code, breaking down how it works step by step. Explain concepts, logic flow, and best practices."
+    return system_prompt.strip()  # Chat mode
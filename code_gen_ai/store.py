@@ -0,0 +1,331 @@
+"""Chat store: saved conversations and their messages in SQLite, with full-text search.
+
+Every chat belongs to an `owner` key (the Streamlit app uses one per browser); listing,
+opening, searching, renaming and deleting only see the caller's own chats. The headless
+API defaults to the shared owner "". Safe to share between threads; every call takes
+the process-wide connection's lock.
+"""
+
+import atexit
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from .config import CHAT_DB_PATH
+from .prompts import estimate_tokens
+from .utils import open_sqlite, shared_resource
+
+CHAT_DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chats (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner TEXT NOT NULL DEFAULT '',
+    title TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL REFERENCES chats(id) ON DELETE CASCADE,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    meta TEXT NOT NULL DEFAULT '{}',
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_by_chat ON messages(chat_id, id);
+"""
+# Created after the owner column is added to databases from before it existed
+CHAT_OWNER_INDEX = "CREATE INDEX IF NOT EXISTS chats_by_owner ON chats(owner, id)"
+# Full-text index over chat titles and messages, kept in sync by triggers
+SEARCH_INDEX_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content, content='messages', content_rowid='id', prefix='2 3'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS chats_fts USING fts5(
+    title, content='chats', content_rowid='id', prefix='2 3'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS chats_fts_insert AFTER INSERT ON chats BEGIN
+    INSERT INTO chats_fts(rowid, title) VALUES (new.id, new.title);
+END;
+CREATE TRIGGER IF NOT EXISTS chats_fts_delete AFTER DELETE ON chats BEGIN
+    INSERT INTO chats_fts(chats_fts, rowid, title) VALUES ('delete', old.id, old.title);
+END;
+CREATE TRIGGER IF NOT EXISTS chats_fts_update AFTER UPDATE OF title ON chats BEGIN
+    INSERT INTO chats_fts(chats_fts, rowid, title) VALUES ('delete', old.id, old.title);
+    INSERT INTO chats_fts(rowid, title) VALUES (new.id, new.title);
+END;
+"""
+# Message keys stored in their own columns; everything else goes to `meta`
+MESSAGE_COLUMNS = {"id", "role", "content", "created_at"}
+
+
+@shared_resource
+def get_chat_db() -> Dict[str, Any]:
+    """Process-wide chat database connection plus the lock that serializes its use."""
+    conn = open_sqlite(CHAT_DB_PATH)
+    conn.executescript(CHAT_DB_SCHEMA)
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(chats)")}
+    if "owner" not in columns:
+        # Chats saved before owners existed go to the shared owner ""
+        with conn:
+            conn.execute("ALTER TABLE chats ADD COLUMN owner TEXT NOT NULL DEFAULT ''")
+    conn.execute(CHAT_OWNER_INDEX)
+
+    # Build the search index; fall back to plain scans if SQLite lacks FTS5
+    has_index = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'").fetchone()
+    try:
+        conn.executescript(SEARCH_INDEX_SCHEMA)
+        if not has_index:
+            with conn:
+                conn.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+                conn.execute("INSERT INTO chats_fts(chats_fts) VALUES ('rebuild')")
+        fts = True
+    except sqlite3.OperationalError:
+        fts = False
+
+    atexit.register(conn.close)
+    return {"conn": conn, "lock": threading.RLock(), "fts": fts}
+
+
+@contextmanager
+def chat_db():
+    """Hold the chat database lock and yield the connection."""
+    db = get_chat_db()
+    with db["lock"]:
+        yield db["conn"]
+
+
+def list_chats(owner: str = "") -> Dict[str, Dict[str, Any]]:
+    """Return `owner`'s chat metadata (title, updated_at) keyed by chat id, oldest first.
+
+    Only this index is loaded eagerly; messages are read per chat on demand.
+    """
+    with chat_db() as conn:
+        rows = conn.execute(
+            "SELECT id, title, updated_at FROM chats WHERE owner = ? ORDER BY id", (owner,)
+        ).fetchall()
+    return {str(row["id"]): {"title": row["title"], "updated_at": row["updated_at"]} for row in rows}
+
+
+def get_chat_meta(chat_id: str, owner: str = "") -> Optional[Dict[str, Any]]:
+    """Return title and updated_at for one of `owner`'s chats, or None if they have no such chat."""
+    with chat_db() as conn:
+        row = conn.execute(
+            "SELECT title, updated_at FROM chats WHERE id = ? AND owner = ?", (int(chat_id), owner)
+        ).fetchone()
+    return {"title": row["title"], "updated_at": row["updated_at"]} if row else None
+
+
+def load_chat_messages(chat_id: str) -> List[Dict[str, Any]]:
+    """Read every message of a chat from disk, oldest first."""
+    with chat_db() as conn:
+        rows = conn.execute(
+            "SELECT id, role, content, meta, created_at FROM messages WHERE chat_id = ? ORDER BY id",
+            (int(chat_id),),
+        ).fetchall()
+    messages = []
+    for row in rows:
+        content = row["content"]
+        message = {"created_at": row["created_at"], "length": len(content), "tokens": estimate_tokens(content)}
+        message.update(json.loads(row["meta"]))
+        message.update({"id": row["id"], "role": row["role"], "content": content})
+        messages.append(message)
+    return messages
+
+
+def save_message(chat_id: str, message: Dict[str, Any]) -> int:
+    """Append a message to a chat on disk and return its id (kept if the message has one)."""
+    meta = {
+        key: value
+        for key, value in message.items()
+        if key not in MESSAGE_COLUMNS and not key.startswith("_")
+    }
+    now = time.time()
+    with chat_db() as conn, conn:
+        cursor = conn.execute(
+            "INSERT INTO messages (id, chat_id, role, content, meta, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                message.get("id"),
+                int(chat_id),
+                message.get("role", "assistant"),
+                message.get("content", ""),
+                json.dumps(meta),
+                message.get("created_at", now),
+            ),
+        )
+        conn.execute("UPDATE chats SET updated_at = ? WHERE id = ?", (now, int(chat_id)))
+    return cursor.lastrowid
+
+
+def delete_message(chat_id: str, message_id: int) -> None:
+    """Remove one stored message from a chat."""
+    with chat_db() as conn, conn:
+        conn.execute("DELETE FROM messages WHERE id = ? AND chat_id = ?", (message_id, int(chat_id)))
+        conn.execute("UPDATE chats SET updated_at = ? WHERE id = ?", (time.time(), int(chat_id)))
+
+
+def clear_chat_messages(chat_id: str) -> None:
+    """Remove every stored message of a chat but keep the chat itself."""
+    with chat_db() as conn, conn:
+        conn.execute("DELETE FROM messages WHERE chat_id = ?", (int(chat_id),))
+        conn.execute("UPDATE chats SET updated_at = ? WHERE id = ?", (time.time(), int(chat_id)))
+
+
+def set_chat_title(chat_id: str, title: str, owner: str = "") -> None:
+    """Store a new title for one of `owner`'s chats."""
+    with chat_db() as conn, conn:
+        conn.execute("UPDATE chats SET title = ? WHERE id = ? AND owner = ?", (title, int(chat_id), owner))
+
+
+def create_persistent_chat(title: Optional[str] = None, owner: str = "") -> str:
+    """Create a saved conversation for `owner` and return its identifier."""
+    now = time.time()
+    with chat_db() as conn, conn:
+        cursor = conn.execute(
+            "INSERT INTO chats (owner, title, created_at, updated_at) VALUES (?, ?, ?, ?)",
+            (owner, title or "", now, now),
+        )
+        chat_id = str(cursor.lastrowid)
+        if not title:
+            conn.execute("UPDATE chats SET title = ? WHERE id = ?", (f"New chat {chat_id}", int(chat_id)))
+    return chat_id
+
+
+def delete_persistent_chat(chat_id: str, owner: str = "") -> bool:
+    """Delete one of `owner`'s conversations and its messages; False if there was none."""
+    with chat_db() as conn, conn:
+        return conn.execute("DELETE FROM chats WHERE id = ? AND owner = ?", (int(chat_id), owner)).rowcount > 0
+
+
+@shared_resource
+def _message_id_state() -> Dict[str, Any]:
+    """Process-wide state behind `next_message_id`."""
+    return {"lock": threading.Lock(), "last": 0}
+
+
+def next_message_id() -> int:
+    """Return a strictly increasing message id.
+
+    Ids are derived from the clock in microseconds, so they keep increasing across
+    restarts and stay clear of ids already stored on disk.
+    """
+    state = _message_id_state()
+    with state["lock"]:
+        state["last"] = max(state["last"] + 1, time.time_ns() // 1000)
+        return state["last"]
+
+
+def make_message(role: str, content: str, **fields: Any) -> Dict[str, Any]:
+    """Build a message dict with its id and precomputed metadata."""
+    return {
+        "id": next_message_id(),
+        "role": role,
+        "content": content,
+        "created_at": time.time(),
+        "length": len(content),
+        "tokens": estimate_tokens(content),
+        "digest": content_digest(content),
+        **fields,
+    }
+
+
+def content_digest(content: str) -> str:
+    """Return a stable digest of message content for keying caches."""
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _highlight_snippet(text: str, pattern: "re.Pattern[str]", width: int = 90) -> str:
+    """Cut a one-line Markdown snippet around the first match of `pattern`, bolding matches."""
+    first = pattern.search(text)
+    start = max(first.start() - width // 3, 0) if first else 0
+    window = " ".join(text[start : start + width].split())
+
+    parts = []
+    last = 0
+    for match in pattern.finditer(window):
+        parts.append(_escape_markdown(window[last : match.start()]))
+        parts.append(f"**{_escape_markdown(match.group(0))}**")
+        last = match.end()
+    parts.append(_escape_markdown(window[last:]))
+    return ("…" if start else "") + "".join(parts) + ("…" if start + width < len(text) else "")
+
+
+def _escape_markdown(text: str) -> str:
+    """Escape characters that would turn snippet text into Markdown formatting."""
+    return re.sub(r"([\\`*_\[\]#<>|~])", r"\\\1", text)
+
+
+def search_chats(query: str, chat_id: Optional[str] = None, owner: str = "") -> Dict[str, Dict[str, str]]:
+    """Find `owner`'s saved chats whose title or messages match `query`.
+
+    Every word of the query is matched as a prefix against the FTS5 index. Returns
+    {chat_id: {"match": "title" | "content", "snippet": markdown}}, optionally limited
+    to a single chat. Title matches win over content matches.
+    """
+    terms = re.findall(r"\w+", query.lower())
+    if not terms:
+        return {}
+
+    chat_filter = int(chat_id) if chat_id is not None else None
+    with chat_db() as conn:
+        if get_chat_db()["fts"]:
+            fts_query = " ".join(f'"{term}"*' for term in terms)
+            pattern = re.compile(r"\b(?:" + "|".join(map(re.escape, terms)) + r")\w*", re.IGNORECASE)
+            title_rows = conn.execute(
+                "SELECT c.id, c.title FROM chats_fts JOIN chats c ON c.id = chats_fts.rowid "
+                "WHERE chats_fts MATCH ? AND c.owner = ? AND (? IS NULL OR c.id = ?)",
+                (fts_query, owner, chat_filter, chat_filter),
+            ).fetchall()
+            # Newest matching message per chat supplies the snippet
+            content_rows = conn.execute(
+                "SELECT chat_id, content FROM messages WHERE id IN ("
+                "  SELECT MAX(m.id) FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid"
+                "  JOIN chats c ON c.id = m.chat_id"
+                "  WHERE messages_fts MATCH ? AND c.owner = ? AND (? IS NULL OR m.chat_id = ?) GROUP BY m.chat_id)",
+                (fts_query, owner, chat_filter, chat_filter),
+            ).fetchall()
+        else:
+            needle = query.strip().lower()
+            pattern = re.compile(re.escape(needle), re.IGNORECASE)
+            title_rows = conn.execute(
+                "SELECT id, title FROM chats WHERE instr(lower(title), ?) > 0 AND owner = ?"
+                " AND (? IS NULL OR id = ?)",
+                (needle, owner, chat_filter, chat_filter),
+            ).fetchall()
+            content_rows = conn.execute(
+                "SELECT chat_id, content FROM messages WHERE id IN ("
+                "  SELECT MAX(m.id) FROM messages m JOIN chats c ON c.id = m.chat_id"
+                "  WHERE instr(lower(m.content), ?) > 0 AND c.owner = ?"
+                "  AND (? IS NULL OR m.chat_id = ?) GROUP BY m.chat_id)",
+                (needle, owner, chat_filter, chat_filter),
+            ).fetchall()
+
+    results = {
+        str(row["chat_id"]): {"match": "content", "snippet": _highlight_snippet(row["content"], pattern)}
+        for row in content_rows
+    }
+    for row in title_rows:
+        results[str(row["id"])] = {"match": "title", "snippet": _highlight_snippet(row["title"], pattern)}
+    return results
+
+
+def search_in_chat(chat_id: str, query: str, owner: str = "") -> tuple[bool, str]:
+    """Search for query in chat title and messages. Returns (found, match_type)."""
+    match = search_chats(query, chat_id, owner).get(chat_id)
+    if match is None:
+        return False, ""
+    return True, match["match"]
@@ -0,0 +1,145 @@
+"""Helpers shared across the package: process-wide singletons, SQLite, images and audio."""
+
+import base64
+import functools
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+from typing import TYPE_CHECKING, Callable, List, TypeVar
+
+from .config import (
+    DEFAULT_IMAGE_MAX_SIDE,
+    IMAGE_BLOB_DIR,
+    IMAGE_PAYLOAD_QUALITY,
+    MODEL_OPTIONS,
+    SPEECH_RECOGNITION_AVAILABLE,
+)
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+T = TypeVar("T")
+
+
+def shared_resource(factory: Callable[[], T]) -> Callable[[], T]:
+    """Build `factory()` on first call and return that same object from then on.
+
+    The package's stand-in for ``st.cache_resource``: imported modules outlive Streamlit
+    reruns, so the result is shared by every session, thread and caller in the process.
+    """
+    lock = threading.Lock()
+    instance: List[T] = []
+
+    @functools.wraps(factory)
+    def get() -> T:
+        if not instance:
+            with lock:
+                if not instance:
+                    instance.append(factory())
+        return instance[0]
+
+    return get
+
+
+def open_sqlite(path: str) -> sqlite3.Connection:
+    """Open a SQLite database in WAL mode so readers never block the writer."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+
+def _image_blob_path(image_ref: str) -> str:
+    return os.path.join(IMAGE_BLOB_DIR, image_ref[:2], image_ref)
+
+
+def store_image_blob(data: bytes) -> str:
+    """Save uploaded image bytes as-is and return their SHA-256 digest as the reference.
+
+    Identical uploads map to the same file, so re-attaching an image costs nothing.
+    """
+    image_ref = hashlib.sha256(data).hexdigest()
+    path = _image_blob_path(image_ref)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as blob:
+            blob.write(data)
+        os.replace(tmp_path, path)
+    return image_ref
+
+
+def load_image_bytes(image_ref: str) -> bytes:
+    """Return the original compressed bytes of a stored image."""
+    with open(_image_blob_path(image_ref), "rb") as blob:
+        return blob.read()
+
+
+def load_image(image_ref: str) -> "Image.Image":
+    """Decode a stored image on demand."""
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(load_image_bytes(image_ref)))
+    image.load()
+    return image
+
+
+@functools.lru_cache(maxsize=64)
+def _encode_image_payload(image_ref: str, max_side: int) -> str:
+    from PIL import Image
+
+    data = load_image_bytes(image_ref)
+    image = Image.open(io.BytesIO(data))
+    # Small JPEGs are already as compact as we would make them; send the upload as-is
+    if image.format == "JPEG" and max(image.size) <= max_side:
+        return base64.b64encode(data).decode()
+
+    image.thumbnail((max_side, max_side))
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        flattened = Image.new("RGB", image.size, (255, 255, 255))
+        flattened.paste(image, mask=image.getchannel("A"))
+        image = flattened
+    buffered = io.BytesIO()
+    image.convert("RGB").save(buffered, format="JPEG", quality=IMAGE_PAYLOAD_QUALITY, optimize=True)
+    return base64.b64encode(buffered.getvalue()).decode()
+
+
+def prepare_image_payload(image_ref: str, model: str) -> str:
+    """Return the base64 image payload for `model`, encoding each image at most once.
+
+    Payloads are cached by image digest and target resolution, so retries,
+    regenerations and models sharing a resolution reuse the same encoding.
+    """
+    max_side = MODEL_OPTIONS.get(model, {}).get("image_max_side", DEFAULT_IMAGE_MAX_SIDE)
+    return _encode_image_payload(image_ref, max_side)
+
+
+def transcribe_audio(audio_bytes: bytes) -> str:
+    """Transcribe audio to text using speech recognition."""
+    if not SPEECH_RECOGNITION_AVAILABLE:
+        return "[Speech recognition not available. Install: pip install SpeechRecognition]"
+    import speech_recognition as sr
+
+    recognizer = sr.Recognizer()
+    
+    try:
+        # Convert audio bytes to AudioFile
+        audio_file = io.BytesIO(audio_bytes)
+        with sr.AudioFile(audio_file) as source:
+            audio_data = recognizer.record(source)
+        
+        # Use Google's free speech recognition
+        text = recognizer.recognize_google(audio_data)
+        return text
+    except sr.UnknownValueError:
+        return "[Could not understand audio]"
+    except sr.RequestError as e:
+        return f"[Speech recognition error: {e}]"
+    except Exception as e:
+        return f"[Audio processing error: {e}]"
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# Keep the chat store, caches and metrics of a test run out of the project directory
+os.environ.setdefault("CODEGEN_DATA_DIR", tempfile.mkdtemp(prefix="codegen-tests-"))
+os.environ.setdefault("METRICS_FILE", "")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
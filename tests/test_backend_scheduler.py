@@ -0,0 +1,124 @@
+"""BackendScheduler: per-backend slots, served round-robin, with a low-priority lane."""
+
+import contextvars
+import threading
+import time
+
+from code_gen_ai import backend
+from code_gen_ai.backend import BackendScheduler
+from code_gen_ai.generation import GenerationScope, _current_generation
+
+
+def _acquire(scheduler, session_id, scope):
+    """Call `scheduler.acquire` as the generation `scope` would."""
+    def run():
+        _current_generation.set(scope)
+        return scheduler.acquire(session_id)
+
+    return contextvars.Context().run(run)
+
+
+def _acquire_in_thread(scheduler, session_id, scope, results, queued=None):
+    thread = threading.Thread(target=lambda: results.append((session_id, _acquire(scheduler, session_id, scope))))
+    thread.start()
+    if queued is not None:
+        _wait_for(lambda: scheduler.stats()["queued"] == queued)
+    return thread
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_low_priority_never_takes_the_last_slot():
+    scheduler = BackendScheduler(2)
+    first = _acquire(scheduler, "background", GenerationScope(low_priority=True))
+    assert first is not None
+
+    waiting = []
+    thread = _acquire_in_thread(scheduler, "background", GenerationScope(low_priority=True), waiting)
+    _wait_for(lambda: scheduler.stats()["low_priority_queued"] == 1)
+
+    user = _acquire(scheduler, "user", GenerationScope("user"))
+    assert user is not None and scheduler.stats()["active"] == 2
+
+    scheduler.release(user)
+    time.sleep(0.1)
+    assert not waiting  # the second prewarm job still leaves a slot free
+    scheduler.release(first)
+    thread.join(5)
+    assert waiting and waiting[0][1] is not None
+
+
+def test_queued_user_preempts_running_low_priority_work():
+    scheduler = BackendScheduler(1)
+    prewarm_scope = GenerationScope(low_priority=True)
+    prewarm = _acquire(scheduler, "background", prewarm_scope)
+
+    granted = []
+    thread = _acquire_in_thread(scheduler, "user", GenerationScope("user"), granted)
+    _wait_for(prewarm_scope.cancelled.is_set)
+    assert not granted
+
+    scheduler.release(prewarm)  # the cancelled prewarm call gives its slot back
+    thread.join(5)
+    assert granted and granted[0][1] is not None
+    assert scheduler.stats()["low_priority_active"] == 0
+
+
+def test_sessions_take_turns_for_free_slots():
+    scheduler = BackendScheduler(1)
+    holder = _acquire(scheduler, "a", GenerationScope("a"))
+
+    granted = []
+    threads = [_acquire_in_thread(scheduler, "a", GenerationScope("a"), granted, queued=n) for n in (1, 2, 3)]
+    threads.append(_acquire_in_thread(scheduler, "b", GenerationScope("b"), granted, queued=4))
+
+    ticket = holder
+    for served in range(1, 5):
+        scheduler.release(ticket)
+        _wait_for(lambda: len(granted) == served)
+        ticket = granted[-1][1]
+    scheduler.release(ticket)
+    for thread in threads:
+        thread.join(5)
+
+    # b queued last but is served right after a's first waiting call
+    assert [session_id for session_id, _ in granted] == ["a", "b", "a", "a"]
+    assert scheduler.stats()["active"] == 0
+
+
+def test_cancelled_while_queued_leaves_the_queue():
+    scheduler = BackendScheduler(1)
+    holder = _acquire(scheduler, "a", GenerationScope("a"))
+
+    scope = GenerationScope("b")
+    results = []
+    thread = _acquire_in_thread(scheduler, "b", scope, results, queued=1)
+    scope.cancel()
+    thread.join(5)
+
+    assert results == [("b", None)]
+    assert scheduler.stats()["queued"] == 0
+    scheduler.release(holder)
+    assert scheduler.stats()["active"] == 0
+    assert _acquire(scheduler, "c", GenerationScope("c")) is not None
+
+
+def test_closing_a_stream_releases_its_slot(monkeypatch):
+    def endless(context, model, image):
+        while True:
+            yield "token "
+
+    monkeypatch.setattr(backend, "_backend_stream", endless)
+    scheduler = backend.get_backend_schedulers()["ollama"]
+    active = scheduler.stats()["active"]
+
+    stream = backend._stream_with_retries([{"role": "user", "content": "hi"}], "llama3", None, "a")
+    assert next(stream) == "token "
+    assert scheduler.stats()["active"] == active + 1
+    stream.close()
+    assert scheduler.stats()["active"] == active
@@ -0,0 +1,35 @@
+"""Saved chats are only visible to their owner."""
+
+from code_gen_ai.store import (
+    create_persistent_chat,
+    delete_persistent_chat,
+    get_chat_meta,
+    list_chats,
+    make_message,
+    save_message,
+    search_chats,
+    set_chat_title,
+)
+
+
+def test_owners_only_see_their_own_chats():
+    mine = create_persistent_chat("Sorting notes", owner="alice-key")
+    theirs = create_persistent_chat("Sorting secrets", owner="bob-key")
+    save_message(theirs, make_message("user", "my password is hunter2"))
+
+    assert mine in list_chats(owner="alice-key") and theirs not in list_chats(owner="alice-key")
+    assert get_chat_meta(theirs, owner="alice-key") is None
+    assert set(search_chats("sorting", owner="alice-key")) == {mine}
+    assert search_chats("hunter2", owner="alice-key") == {}
+    assert theirs in search_chats("hunter2", owner="bob-key")
+
+
+def test_rename_and_delete_require_the_owner():
+    chat = create_persistent_chat("Original", owner="alice-key")
+
+    set_chat_title(chat, "Hijacked", owner="bob-key")
+    assert not delete_persistent_chat(chat, owner="bob-key")
+    assert get_chat_meta(chat, owner="alice-key")["title"] == "Original"
+
+    assert delete_persistent_chat(chat, owner="alice-key")
+    assert chat not in list_chats(owner="alice-key")
@@ -0,0 +1,106 @@
+"""Request coalescing: identical generations in flight share one upstream call."""
+
+import contextvars
+import threading
+import time
+
+from code_gen_ai.cache import _flights, coalesced_stream
+from code_gen_ai.generation import GenerationScope, _current_generation, generation_meta
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def _subscribers(key):
+    flight = _flights()["flights"].get(key)
+    return flight.subscribers if flight is not None else 0
+
+
+def _consume_in_thread(key, start, results, **kwargs):
+    """Read the whole coalesced stream under a fresh generation, recording text and meta."""
+    def run():
+        _current_generation.set(GenerationScope("user"))
+        text = "".join(coalesced_stream(key, start, **kwargs))
+        results.append((text, generation_meta()))
+
+    thread = threading.Thread(target=contextvars.Context().run, args=(run,))
+    thread.start()
+    return thread
+
+
+def _gated_upstream(chunks, error=None):
+    """An upstream that counts its calls and holds its output until `gate` is set."""
+    calls = []
+    gate = threading.Event()
+
+    def start():
+        calls.append(1)
+        gate.wait(5)
+        yield from chunks
+        if error is not None:
+            raise error
+
+    return start, calls, gate
+
+
+def test_concurrent_identical_requests_share_one_upstream_call():
+    key = "coalesce-share"
+    start, calls, gate = _gated_upstream(["Hello", ", ", "world"])
+    completed = []
+    results = []
+
+    threads = [_consume_in_thread(key, start, results, on_complete=completed.append) for _ in range(5)]
+    _wait_for(lambda: _subscribers(key) == 5)
+    gate.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert [text for text, _ in results] == ["Hello, world"] * 5
+    assert completed == ["Hello, world"]
+    assert key not in _flights()["flights"]
+
+
+def test_follower_leaving_early_does_not_cancel_the_leader():
+    key = "coalesce-follower-leaves"
+    start, calls, gate = _gated_upstream(["one ", "two ", "three"])
+    completed = []
+    results = []
+
+    leader = _consume_in_thread(key, start, results, on_complete=completed.append)
+    _wait_for(lambda: _subscribers(key) == 1)
+    flight = _flights()["flights"][key]
+    follower = coalesced_stream(key, start)
+    gate.set()
+    assert next(follower) == "one "
+    follower.close()
+    leader.join(5)
+
+    assert not flight.scope.cancelled.is_set()
+    assert len(calls) == 1
+    assert results[0][0] == "one two three"
+    assert completed == ["one two three"]
+
+
+def test_leader_error_reaches_every_follower():
+    key = "coalesce-error"
+    start, calls, gate = _gated_upstream(["partial "], error=RuntimeError("upstream down"))
+    completed = []
+    results = []
+
+    threads = [_consume_in_thread(key, start, results, on_complete=completed.append) for _ in range(3)]
+    _wait_for(lambda: _subscribers(key) == 3)
+    gate.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert len(results) == 3
+    for text, meta in results:
+        assert text == "partial [Generation error: upstream down]"
+        assert meta.get("failed") is True
+    assert completed == []  # a failed reply is never cached
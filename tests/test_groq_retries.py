@@ -0,0 +1,48 @@
+"""The Groq client must not retry underneath `_stream_with_retries`."""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from code_gen_ai import backend
+from code_gen_ai.config import BACKEND_MAX_RETRIES
+
+pytest.importorskip("openai")
+
+
+class _AlwaysUnavailable(BaseHTTPRequestHandler):
+    calls = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        type(self).calls += 1
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        body = b'{"error": {"message": "overloaded"}}'
+        self.send_response(503)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def unavailable_groq(monkeypatch):
+    _AlwaysUnavailable.calls = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _AlwaysUnavailable)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("GROQ_API_KEY", "test-key")
+    monkeypatch.setenv("GROQ_BASE_URL", f"http://127.0.0.1:{server.server_address[1]}/v1")
+    monkeypatch.setattr(backend, "BACKEND_RETRY_BASE_DELAY", 0.0)
+    yield _AlwaysUnavailable
+    server.shutdown()
+    server.server_close()
+
+
+def test_failing_groq_is_called_once_per_attempt(unavailable_groq):
+    context = [{"role": "user", "content": "hello"}]
+    with pytest.raises(backend.BackendError):
+        list(backend._stream_with_retries(context, "gpt-oss-120b", None, "test"))
+    assert unavailable_groq.calls == BACKEND_MAX_RETRIES + 1
@@ -0,0 +1,37 @@
+"""Prometheus export of turn timings and backend scheduler state."""
+
+from code_gen_ai.backend import get_backend_schedulers, get_ollama_transport_stats
+from code_gen_ai.generation import GenerationScope, _current_generation
+from code_gen_ai.metrics import render_prometheus_metrics
+
+
+def test_backend_scheduler_gauges_are_exported():
+    scheduler = get_backend_schedulers()["groq"]
+    token = _current_generation.set(GenerationScope("metrics"))
+    try:
+        ticket = scheduler.acquire("metrics")
+    finally:
+        _current_generation.reset(token)
+    try:
+        text = render_prometheus_metrics()
+    finally:
+        scheduler.release(ticket)
+
+    stats = scheduler.stats()
+    assert "# TYPE codegen_backend_queue_length gauge" in text
+    assert f'codegen_backend_capacity{{backend="groq"}} {stats["capacity"]}' in text
+    assert 'codegen_backend_active{backend="groq"} 1' in text
+    assert 'codegen_backend_queue_length{backend="ollama"} 0' in text
+    assert "# TYPE codegen_backend_slot_wait_seconds summary" in text
+    assert 'codegen_backend_slot_wait_seconds{backend="groq",quantile="0.95"}' in text
+    assert f'codegen_backend_slot_wait_seconds_count{{backend="groq"}} {stats["granted"]}' in text
+
+
+def test_ollama_transport_stats_are_exported():
+    text = render_prometheus_metrics()
+    transport = get_ollama_transport_stats()
+
+    assert "# TYPE codegen_ollama_connections_reused_total counter" in text
+    assert f"codegen_ollama_requests_total {transport['requests']}" in text
+    assert f"codegen_ollama_connections_opened_total {transport['connections_opened']}" in text
+    assert f"codegen_ollama_connections_reused_total {transport['connections_reused']}" in text
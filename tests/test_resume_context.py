@@ -0,0 +1,45 @@
+"""Resuming a cut-off answer must keep the question and the partial answer."""
+
+from code_gen_ai.backend import continuation_context
+from code_gen_ai.config import CONTINUE_PROMPT, MESSAGE_TOKEN_OVERHEAD
+from code_gen_ai.prompts import build_conversation_context, context_budget, estimate_tokens
+
+MODEL = "llama3"
+
+
+def _context(history_turns: int = 0):
+    history = []
+    for i in range(history_turns):
+        history.append({"role": "user", "content": f"question {i} " + "q" * 400})
+        history.append({"role": "assistant", "content": f"answer {i} " + "a" * 400})
+    return build_conversation_context(history, "Explain decorators in depth.", instructions="Be helpful.", model=MODEL)
+
+
+def _tokens(messages):
+    return sum(estimate_tokens(message["content"]) + MESSAGE_TOKEN_OVERHEAD for message in messages)
+
+
+def test_long_partial_keeps_question_and_tail():
+    partial = "".join(f"line {i}: some explanation of decorators\n" for i in range(400))
+    assert estimate_tokens(partial) > context_budget(MODEL)
+
+    request = continuation_context(_context(history_turns=3), partial, MODEL)
+
+    assert request[0] == {"role": "system", "content": "Be helpful."}
+    assert request[-3] == {"role": "user", "content": "Explain decorators in depth."}
+    assert request[-2]["role"] == "assistant"
+    assert partial.endswith(request[-2]["content"])
+    assert len(request[-2]["content"]) > 1000
+    assert request[-1] == {"role": "user", "content": CONTINUE_PROMPT}
+    assert _tokens(request) <= context_budget(MODEL)
+
+
+def test_short_partial_is_sent_whole_with_history():
+    partial = "Decorators wrap a function"
+
+    request = continuation_context(_context(history_turns=2), partial, MODEL)
+
+    assert request[-3]["content"] == "Explain decorators in depth."
+    assert request[-2] == {"role": "assistant", "content": partial}
+    assert request[-1]["content"] == CONTINUE_PROMPT
+    assert [m["content"].split()[0] for m in request[1:-3]] == ["question", "answer"] * 2
@@ -0,0 +1,43 @@
+"""Semantic cache memory: indexes grow on demand and whole scopes are evicted."""
+
+import numpy as np
+
+from code_gen_ai import cache
+from code_gen_ai.cache import SemanticIndex
+
+
+def _unit(seed: int, dim: int = 8) -> np.ndarray:
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_index_grows_with_entries_up_to_its_cap():
+    index = SemanticIndex(dim=8, max_entries=40)
+    assert len(index.vectors) == SemanticIndex.INITIAL_CAPACITY
+
+    for seed in range(40):
+        index.add(_unit(seed), {"response": str(seed), "last_used": float(seed)})
+    assert len(index.vectors) == 40 and len(index.entries) == 40
+    assert index.search(_unit(3))[0]["response"] == "3"
+
+    index.add(_unit(100), {"response": "new", "last_used": 100.0})
+    assert len(index.vectors) == 40
+    assert index.search(_unit(100))[0]["response"] == "new"
+    assert "0" not in {entry["response"] for entry in index.entries}
+
+
+def test_least_recently_used_scope_is_evicted(monkeypatch):
+    monkeypatch.setattr(cache, "SEMANTIC_CACHE_MAX_SCOPES", 2)
+    monkeypatch.setattr(cache, "embed_text", lambda text: _unit(len(text)))
+    cache._semantic_cache()["indexes"].clear()
+
+    def ask(scope: str, answer: str) -> str:
+        return "".join(cache.semantic_reply_stream("first question", scope, 0.99, iter([answer])))
+
+    ask("a", "answer in a")
+    ask("b", "answer in b")
+    assert ask("a", "not used") == "answer in a"  # a hit makes "a" the most recent scope
+    ask("c", "answer in c")
+
+    assert list(cache._semantic_cache()["indexes"]) == ["a", "c"]
+    assert cache.get_semantic_cache_stats()["scopes"] == 2